@@ -0,0 +1,192 @@
+import asyncio
+import math
+import os
+from collections import deque
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from negotiation import NegotiatedResponse
+
+
+dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
+if os.path.exists(dotenv_path):
+    load_dotenv(dotenv_path)
+
+
+class RouteClass:
+    """Ограничение параллелизма для класса маршрутов с очередью и дедлайном ожидания.
+
+    Класс с yield_to не получает слот, пока в очереди более приоритетного
+    класса кто-то ждёт: проходы всегда обслуживаются раньше аналитики.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        limit: int,
+        queue_size: int,
+        deadline: float,
+        yield_to: Optional["RouteClass"] = None,
+    ):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.deadline = deadline
+        self.yield_to = yield_to
+        self.active = 0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._dependents: list[RouteClass] = []
+        if yield_to is not None:
+            yield_to._dependents.append(self)
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.deadline))
+
+    def _blocked(self) -> bool:
+        return self.yield_to is not None and bool(self.yield_to._waiters)
+
+    def _dispatch(self):
+        while self._waiters and self.active < self.limit and not self._blocked():
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.active += 1
+                waiter.set_result(None)
+        if not self._waiters:
+            for dependent in self._dependents:
+                dependent._dispatch()
+
+    async def acquire(self) -> bool:
+        if len(self._waiters) >= self.queue_size and (self.active >= self.limit or self._blocked()):
+            self.shed += 1
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._dispatch()
+        if waiter.done():
+            self.admitted += 1
+            return True
+        self.queued += 1
+        try:
+            await asyncio.wait_for(waiter, self.deadline)
+            self.admitted += 1
+            return True
+        except asyncio.TimeoutError:
+            self.shed += 1
+            return False
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                self._dispatch()
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "queue_size": self.queue_size,
+            "deadline": self.deadline,
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed": self.shed,
+        }
+
+
+class AdmissionController:
+    """Классы маршрутов по префиксу пути.
+
+    Перед префиксом можно перечислить методы ("PUT DELETE /bus/"): такое
+    правило действует только для них и проверяется раньше правила без методов
+    с тем же префиксом.
+    """
+
+    def __init__(self, routes: list[tuple[str, RouteClass]]):
+        rules = []
+        for rule, route_class in routes:
+            *methods, prefix = rule.split()
+            rules.append((prefix, frozenset(methods), route_class))
+        # Длинные префиксы проверяются первыми.
+        self.routes = sorted(rules, key=lambda r: (len(r[0]), bool(r[1])), reverse=True)
+        self.classes = {route_class.name: route_class for _, route_class in routes}
+
+    def classify(self, path: str, method: str = "GET") -> Optional[RouteClass]:
+        for prefix, methods, route_class in self.routes:
+            if path.startswith(prefix) and (not methods or method in methods):
+                return route_class
+        return None
+
+    def stats(self) -> dict:
+        return {name: route_class.stats() for name, route_class in self.classes.items()}
+
+    @staticmethod
+    def from_env() -> "AdmissionController":
+        def route_class(name: str, limit: int, queue_size: int, deadline: float, yield_to=None) -> RouteClass:
+            prefix = f"ADMISSION_{name.upper()}_"
+            return RouteClass(
+                name,
+                int(os.environ.get(prefix + "LIMIT", limit)),
+                int(os.environ.get(prefix + "QUEUE", queue_size)),
+                float(os.environ.get(prefix + "DEADLINE", deadline)),
+                yield_to,
+            )
+
+        taps = route_class("taps", 32, 512, 2.0)
+        reads = route_class("reads", 64, 256, 1.0)
+        stats = route_class("stats", 4, 32, 5.0, yield_to=taps)
+        exports = route_class("exports", 2, 8, 10.0, yield_to=taps)
+        admin_writes = route_class("admin_writes", 4, 32, 5.0, yield_to=taps)
+        return AdmissionController([
+            ("/transactions/add", taps),
+            ("/transactions/get_by_id", reads),
+            ("/transactions/get_by_rider", reads),
+            ("/transactions/rider_totals", reads),
+            ("/bus/", reads),
+            ("POST PUT DELETE /bus/", admin_writes),
+            ("/client_types/", reads),
+            ("POST PUT DELETE /client_types/", admin_writes),
+            ("/stats/", stats),
+            ("/reports/", reads),
+            ("/fraud/", reads),
+            ("/load/", reads),
+            ("/reports/recompute", stats),
+            ("/backup/", exports),
+            ("/transactions/get_all", exports),
+            ("/transactions/export", exports),
+            ("/transactions/get_by_client_type", exports),
+            ("/transactions/get_by_bus", exports),
+        ])
+
+
+class AdmissionMiddleware:
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        route_class = self.controller.classify(scope["path"], scope["method"]) if scope["type"] == "http" else None
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+        if not await route_class.acquire():
+            response = NegotiatedResponse(
+                {"code": 503, "error_desc": f"Overloaded: {route_class.name}", "value": None},
+                status_code=503,
+                headers={"Retry-After": str(route_class.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route_class.release()
+
+
+admission = AdmissionController.from_env()
@@ -0,0 +1,143 @@
+"""Обслуживание колоночного журнала транзакций.
+
+    python -m analytics rebuild            # заново выгрузить из SQLite
+    python -m analytics check              # сверить с таблицей transactions
+    python -m analytics group --by client_type,hour --from 2024-03-01
+    python -m analytics histogram --bins 20 --bus-id 3
+"""
+import argparse
+import datetime
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+from analytics import query
+from analytics.columns import COLUMNS, ColumnStore
+
+# Миллисекунды эпохи из строки DateTime SQLAlchemy (наивное время трактуется как UTC)
+# либо как есть, если таблица уже в компактном формате.
+EPOCH_MS_SQL = (
+    "CASE WHEN typeof(date) = 'integer' THEN date "
+    "ELSE CAST(strftime('%s', date) AS INTEGER) * 1000 + CAST(substr(date, 21, 3) AS INTEGER) END"
+)
+
+
+def default_db_path() -> str:
+    url = os.environ.get("DATABASE_URL", "sqlite+aiosqlite:///db.sqlite3")
+    return url.split(":///", 1)[1]
+
+
+def rebuild(store: ColumnStore, db_path: str, batch_size: int = 500_000) -> int:
+    started = time.perf_counter()
+    store.truncate()
+    conn = sqlite3.connect(db_path)
+    cursor = conn.execute(
+        f"SELECT id, bus_id, client_type, price, {EPOCH_MS_SQL} FROM transactions ORDER BY id"
+    )
+    rows = 0
+    try:
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            columns = list(zip(*batch))
+            for (name, fmt), values in zip(COLUMNS.items(), columns):
+                with open(store.column_path(name), "ab") as f:
+                    np.asarray(values, dtype=fmt).tofile(f)
+            rows += len(batch)
+    finally:
+        conn.close()
+    print(f"Rebuilt {rows} rows in {time.perf_counter() - started:.1f}s")
+    return rows
+
+
+def check(store: ColumnStore, db_path: str) -> list[str]:
+    """Сравнивает журнал с таблицей: число строк, id, суммы и распределение по автобусам."""
+    cols = query.load(store)
+    conn = sqlite3.connect(db_path)
+    try:
+        db_count, db_max_id, db_total = conn.execute(
+            "SELECT COUNT(*), MAX(id), TOTAL(price) FROM transactions"
+        ).fetchone()
+        db_buses = dict(conn.execute("SELECT bus_id, COUNT(*) FROM transactions GROUP BY bus_id"))
+    finally:
+        conn.close()
+
+    problems = []
+    ids = cols["id"]
+    if len(np.unique(ids)) != len(ids):
+        problems.append("duplicate ids in the column log")
+    if len(ids) != db_count:
+        problems.append(f"row count: log {len(ids)}, table {db_count}")
+    log_max_id = int(ids.max()) if len(ids) else None
+    if log_max_id != db_max_id:
+        problems.append(f"max id: log {log_max_id}, table {db_max_id}")
+    log_total = float(cols["price"].sum())
+    if not np.isclose(log_total, db_total):
+        problems.append(f"price total: log {log_total}, table {db_total}")
+    bus_ids, bus_counts = np.unique(cols["bus_id"], return_counts=True)
+    log_buses = dict(zip(map(int, bus_ids), map(int, bus_counts)))
+    for bus_id in sorted(set(db_buses) | set(log_buses), key=lambda b: (b is None, b)):
+        if db_buses.get(bus_id, 0) != log_buses.get(bus_id, 0):
+            problems.append(f"bus {bus_id}: log {log_buses.get(bus_id, 0)}, table {db_buses.get(bus_id, 0)}")
+    return problems
+
+
+def filters(args) -> dict:
+    return {
+        "bus_id": args.bus_id,
+        "client_type": args.client_type,
+        "date_from": args.date_from,
+        "date_to": args.date_to,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m analytics")
+    parser.add_argument("--dir", default=os.environ.get("ANALYTICS_DIR", "analytics_data"))
+    parser.add_argument("--db", default=default_db_path())
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("rebuild")
+    commands.add_parser("check")
+    for name in ("group", "histogram", "total"):
+        command = commands.add_parser(name)
+        command.add_argument("--bus-id", type=int)
+        command.add_argument("--client-type", type=int)
+        command.add_argument("--from", dest="date_from", type=datetime.datetime.fromisoformat)
+        command.add_argument("--to", dest="date_to", type=datetime.datetime.fromisoformat)
+        if name == "group":
+            command.add_argument("--by", default="client_type,hour",
+                                 help="Comma-separated keys: bus_id, client_type, hour, weekday, day")
+        if name == "histogram":
+            command.add_argument("--bins", type=int, default=10)
+    args = parser.parse_args()
+
+    store = ColumnStore(args.dir)
+    if args.command == "rebuild":
+        rebuild(store, args.db)
+    elif args.command == "check":
+        problems = check(store, args.db)
+        for problem in problems:
+            print(problem)
+        print("OK" if not problems else f"{len(problems)} mismatches")
+        sys.exit(1 if problems else 0)
+    else:
+        started = time.perf_counter()
+        cols = query.load(store)
+        if args.command == "total":
+            print(f"rides={query.count(cols, **filters(args))} revenue={query.total(cols, **filters(args)):.2f}")
+        elif args.command == "histogram":
+            counts, edges = query.histogram(cols, bins=args.bins, **filters(args))
+            for low, high, n in zip(edges[:-1], edges[1:], counts):
+                print(f"{low:8.2f} - {high:8.2f}: {n}")
+        else:
+            for row in query.group_by(cols, tuple(args.by.split(",")), **filters(args)):
+                print(row)
+        print(f"{len(cols['id'])} rows scanned in {(time.perf_counter() - started) * 1000:.1f} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import datetime
+import os
+import struct
+import threading
+
+from db import to_epoch_ms
+
+# Имя колонки -> формат struct / dtype numpy. Все значения little-endian фиксированной ширины.
+COLUMNS = {
+    "id": "<q",
+    "bus_id": "<i",
+    "client_type": "<i",
+    "price": "<d",
+    "epoch_ms": "<q",
+}
+
+
+class ColumnStore:
+    """Append-only журнал числовых полей транзакций: по одному файлу на колонку."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._files = {}
+        os.makedirs(path, exist_ok=True)
+        self.repair()
+
+    def column_path(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.bin")
+
+    def __len__(self) -> int:
+        return min(
+            os.path.getsize(self.column_path(name)) // struct.calcsize(fmt)
+            if os.path.exists(self.column_path(name)) else 0
+            for name, fmt in COLUMNS.items()
+        )
+
+    def repair(self) -> int:
+        """Обрезает колонки до общей длины после прерванной записи."""
+        with self._lock:
+            self._close()
+            rows = len(self)
+            for name, fmt in COLUMNS.items():
+                with open(self.column_path(name), "ab") as f:
+                    f.truncate(rows * struct.calcsize(fmt))
+            return rows
+
+    def truncate(self):
+        with self._lock:
+            self._close()
+            for name in COLUMNS:
+                with open(self.column_path(name), "wb"):
+                    pass
+
+    def append(self, id: int, bus_id: int, client_type: int, price: float, date: datetime.datetime):
+        self.append_many([(id, bus_id, client_type, price, to_epoch_ms(date))])
+
+    def append_many(self, rows):
+        """rows - кортежи (id, bus_id, client_type, price, epoch_ms)."""
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        with self._lock:
+            if not self._files:
+                self._files = {name: open(self.column_path(name), "ab") for name in COLUMNS}
+            for (name, fmt), values in zip(COLUMNS.items(), columns):
+                self._files[name].write(struct.pack(f"<{len(values)}{fmt[1]}", *values))
+            for f in self._files.values():
+                f.flush()
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+
+column_store = ColumnStore(os.environ["ANALYTICS_DIR"]) if os.environ.get("ANALYTICS_DIR") else None
@@ -0,0 +1,87 @@
+"""Векторные запросы NumPy поверх ColumnStore.
+
+Колонки открываются через np.memmap, поэтому фильтры и агрегаты читают
+только нужные страницы файлов и не проходят через ORM.
+"""
+import datetime
+from typing import Optional
+
+import numpy as np
+
+from analytics.columns import COLUMNS, ColumnStore
+from db import to_epoch_ms
+
+HOUR_MS = 3_600_000
+DAY_MS = 24 * HOUR_MS
+
+
+def load(store: ColumnStore) -> dict[str, np.ndarray]:
+    rows = len(store)
+    if rows == 0:
+        return {name: np.empty(0, dtype=fmt) for name, fmt in COLUMNS.items()}
+    return {
+        name: np.memmap(store.column_path(name), dtype=fmt, mode="r", shape=(rows,))
+        for name, fmt in COLUMNS.items()
+    }
+
+
+def mask(
+    cols: dict[str, np.ndarray],
+    bus_id: Optional[int] = None,
+    client_type: Optional[int] = None,
+    date_from: Optional[datetime.datetime] = None,
+    date_to: Optional[datetime.datetime] = None,
+) -> np.ndarray:
+    selected = np.ones(len(cols["id"]), dtype=bool)
+    if bus_id is not None:
+        selected &= cols["bus_id"] == bus_id
+    if client_type is not None:
+        selected &= cols["client_type"] == client_type
+    if date_from is not None:
+        selected &= cols["epoch_ms"] >= to_epoch_ms(date_from)
+    if date_to is not None:
+        selected &= cols["epoch_ms"] <= to_epoch_ms(date_to)
+    return selected
+
+
+def count(cols: dict[str, np.ndarray], **filters) -> int:
+    return int(np.count_nonzero(mask(cols, **filters)))
+
+
+def total(cols: dict[str, np.ndarray], **filters) -> float:
+    return float(cols["price"][mask(cols, **filters)].sum())
+
+
+def histogram(cols: dict[str, np.ndarray], bins=10, **filters) -> tuple[np.ndarray, np.ndarray]:
+    """Распределение стоимости проезда: (counts, bin_edges)."""
+    return np.histogram(cols["price"][mask(cols, **filters)], bins=bins)
+
+
+def key_column(cols: dict[str, np.ndarray], key: str, selected: np.ndarray) -> np.ndarray:
+    if key in ("bus_id", "client_type"):
+        return cols[key][selected].astype(np.int64)
+    epoch_ms = cols["epoch_ms"][selected]
+    if key == "hour":
+        return epoch_ms // HOUR_MS % 24
+    if key == "weekday":
+        # 1970-01-01 - четверг; 0 - понедельник.
+        return (epoch_ms // DAY_MS + 3) % 7
+    if key == "day":
+        return epoch_ms // DAY_MS
+    raise ValueError(f"Unknown group key {key}")
+
+
+def group_by(cols: dict[str, np.ndarray], keys: tuple[str, ...] = ("client_type",), **filters) -> list[dict]:
+    """Сумма стоимости и число поездок по комбинации ключей."""
+    selected = mask(cols, **filters)
+    if not keys:
+        raise ValueError("At least one group key is required")
+    key_arrays = [key_column(cols, key, selected) for key in keys]
+    groups, inverse = np.unique(np.stack(key_arrays, axis=1), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    rides = np.bincount(inverse, minlength=len(groups))
+    revenue = np.bincount(inverse, weights=cols["price"][selected], minlength=len(groups))
+    return [
+        {**dict(zip(keys, map(int, group))), "rides": int(r), "revenue": float(v)}
+        for group, r, v in zip(groups, rides, revenue)
+    ]
@@ -0,0 +1,223 @@
+import asyncio
+import datetime
+import glob
+import os
+import sqlite3
+import time
+from collections import deque
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from db import sqlite_path
+
+
+dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
+if os.path.exists(dotenv_path):
+    load_dotenv(dotenv_path)
+
+
+def percentiles(samples, *quantiles: float) -> dict:
+    ordered = sorted(samples)
+    if not ordered:
+        return {f"p{int(q * 100)}_ms": None for q in quantiles}
+    return {f"p{int(q * 100)}_ms": ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000 for q in quantiles}
+
+
+class TooManyRestarts(Exception):
+    pass
+
+
+class SnapshotBackup:
+    """Снимки базы на ходу через backup API SQLite.
+
+    Копирование идёт шагами по pages страниц с паузой step_sleep между ними:
+    блокировка чтения держится только на время шага, проходы и чтения
+    продолжаются. Запись в базу из другого соединения между шагами заставляет
+    SQLite начать копирование заново. В режиме WAL (база приложения
+    открывается в нём, см. db.enable_wal) на время копирования держится
+    транзакция чтения: снимок не меняется, запись идёт дальше. В остальных
+    режимах после max_restarts перезапусков база копируется одним шагом, с
+    блокировкой записи на время этого шага. Снимок пишется в .part,
+    проверяется integrity_check и только потом получает окончательное имя;
+    старые снимки сверх keep удаляются.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        directory: str,
+        pages: int = 256,
+        step_sleep: float = 0.005,
+        keep: int = 24,
+        max_restarts: int = 10,
+    ):
+        self.db_path = db_path
+        self.directory = directory
+        self.pages = pages
+        self.step_sleep = step_sleep
+        self.keep = keep
+        self.max_restarts = max_restarts
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.last_error = ""
+        self.last_path: Optional[str] = None
+        self.last_duration = 0.0
+        self.last_bytes = 0
+        self.last_steps = 0
+        self.last_restarts = 0
+        self.last_mode = ""
+        self.restarts = 0
+        self.fallbacks = 0
+        self.progress = (0, 0)
+
+    @property
+    def prefix(self) -> str:
+        return os.path.splitext(os.path.basename(self.db_path))[0]
+
+    def snapshots(self) -> list[str]:
+        return sorted(glob.glob(os.path.join(self.directory, f"{self.prefix}-*.sqlite3")))
+
+    def copy(self, target_path: str) -> int:
+        steps = 0
+        self.last_restarts = 0
+
+        def progress(status, remaining, total):
+            nonlocal steps
+            steps += 1
+            if total - remaining <= self.progress[0]:
+                # Другое соединение записало в базу: SQLite начал копирование сначала.
+                self.last_restarts += 1
+                self.restarts += 1
+                if self.last_restarts > self.max_restarts:
+                    raise TooManyRestarts()
+            self.progress = (total - remaining, total)
+            if remaining:
+                # sleep у Connection.backup срабатывает только на SQLITE_BUSY; пауза между шагами — здесь.
+                time.sleep(self.step_sleep)
+
+        self.progress = (0, 0)
+        source = sqlite3.connect(self.db_path)
+        target = sqlite3.connect(target_path)
+        try:
+            wal = source.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            if wal:
+                source.execute("BEGIN")
+                source.execute("SELECT count(*) FROM sqlite_master").fetchone()
+            self.last_mode = "wal_snapshot" if wal else "stepped"
+            try:
+                source.backup(target, pages=self.pages, progress=progress, sleep=self.step_sleep)
+            except TooManyRestarts:
+                self.fallbacks += 1
+                self.last_mode = "single_step"
+                source.backup(target)
+                steps += 1
+            if wal:
+                source.commit()
+            result = target.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            target.close()
+            source.close()
+        if result != "ok":
+            raise RuntimeError(f"integrity_check: {result}")
+        return steps
+
+    def rotate(self):
+        for path in self.snapshots()[: max(0, len(self.snapshots()) - self.keep)]:
+            os.remove(path)
+
+    async def run_once(self) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        path = os.path.join(self.directory, f"{self.prefix}-{stamp}.sqlite3")
+        started = time.perf_counter()
+        self.running = True
+        try:
+            self.last_steps = await asyncio.to_thread(self.copy, path + ".part")
+            os.replace(path + ".part", path)
+            self.rotate()
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            if os.path.exists(path + ".part"):
+                os.remove(path + ".part")
+            raise
+        finally:
+            self.running = False
+            self.runs += 1
+            self.last_duration = time.perf_counter() - started
+        self.last_path = path
+        self.last_bytes = os.path.getsize(path)
+        return path
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_path": self.last_path,
+            "last_duration": self.last_duration,
+            "last_bytes": self.last_bytes,
+            "last_steps": self.last_steps,
+            "last_restarts": self.last_restarts,
+            "last_mode": self.last_mode,
+            "restarts": self.restarts,
+            "fallbacks": self.fallbacks,
+            "max_restarts": self.max_restarts,
+            "progress_pages": list(self.progress),
+            "snapshots": len(self.snapshots()),
+            "keep": self.keep,
+        }
+
+
+class LatencyProbe:
+    """Время до первого байта ответа отдельно для запросов во время снимка и вне его."""
+
+    def __init__(self, samples: int = 2048):
+        self.during = deque(maxlen=samples)
+        self.outside = deque(maxlen=samples)
+
+    def stats(self) -> dict:
+        return {
+            "during_backup": {"requests": len(self.during), **percentiles(self.during, 0.5, 0.99)},
+            "outside_backup": {"requests": len(self.outside), **percentiles(self.outside, 0.5, 0.99)},
+        }
+
+
+class LatencyProbeMiddleware:
+    def __init__(self, app, backup: SnapshotBackup, probe: LatencyProbe):
+        self.app = app
+        self.backup = backup
+        self.probe = probe
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        during = self.backup.running
+
+        async def send_timed(message):
+            if message["type"] == "http.response.start":
+                samples = self.probe.during if during or self.backup.running else self.probe.outside
+                samples.append(time.perf_counter() - started)
+            await send(message)
+
+        await self.app(scope, receive, send_timed)
+
+
+backup = (
+    SnapshotBackup(
+        sqlite_path(os.environ["DATABASE_URL"]),
+        os.environ["BACKUP_DIR"],
+        pages=int(os.environ.get("BACKUP_PAGES", "256")),
+        step_sleep=float(os.environ.get("BACKUP_STEP_SLEEP", "0.005")),
+        keep=int(os.environ.get("BACKUP_KEEP", "24")),
+        max_restarts=int(os.environ.get("BACKUP_MAX_RESTARTS", "10")),
+    )
+    if os.environ.get("BACKUP_DIR") else None
+)
+backup_interval = float(os.environ.get("BACKUP_INTERVAL", "3600"))
+backup_latency = LatencyProbe()
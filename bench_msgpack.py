@@ -0,0 +1,86 @@
+"""Сравнение JSON и msgpack для ответов, которые опрашивают валидаторы.
+
+    python bench_msgpack.py [--rows 1000] [--repeat 2000]
+
+Полезная нагрузка собирается теми же схемами и jsonable_encoder, что и в
+маршрутах, поэтому сравниваются ровно те байты, что уходят клиенту.
+"""
+import argparse
+import datetime
+import json
+import random as rnd
+import timeit
+
+import msgpack
+from fastapi.encoders import jsonable_encoder
+
+from models.bus import BusSchema
+from models.client_type import ClientTypeSchema
+from models.transaction import TransactionSchema
+from routes.bus import BusResponse
+from routes.client_type import ClientTypesResponse
+from routes.transaction import TransactionsResponse
+
+
+def envelope(response) -> dict:
+    return jsonable_encoder(response.model_dump(by_alias=True))
+
+
+def payloads(rows: int) -> dict[str, dict]:
+    client_types = [
+        ClientTypeSchema(id=i, client_name=name, discount=discount)
+        for i, (name, discount) in enumerate(
+            [("Пенсионеры", 30), ("Студенты", 15), ("Обычные", 0), ("Алга", 10), ("Инвалиды", 70)], start=1
+        )
+    ]
+    now = datetime.datetime.now()
+    transactions = [
+        TransactionSchema(
+            id=i,
+            name=f"name {rnd.randint(1, 5000)}",
+            client_type=rnd.randint(1, 5),
+            price=float(rnd.randint(20, 45)),
+            date=now - datetime.timedelta(seconds=i * 7),
+            bus_id=rnd.randint(1, 300),
+        )
+        for i in range(1, rows + 1)
+    ]
+    return {
+        "bus/get_by_id": envelope(BusResponse(value=BusSchema(id=17, price=35.0, status=True))),
+        "client_types/get_all": envelope(ClientTypesResponse(value=client_types)),
+        f"transactions x{rows}": envelope(TransactionsResponse(value=transactions)),
+    }
+
+
+def json_dumps(content) -> bytes:
+    # Так же, как starlette.responses.JSONResponse.render.
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def per_call_us(fn, repeat: int) -> float:
+    return min(timeit.repeat(fn, number=repeat, repeat=3)) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+    rnd.seed(42)
+
+    print(f"{'payload':24}{'format':>9}{'bytes':>9}{'encode, us':>12}{'decode, us':>12}")
+    for name, content in payloads(args.rows).items():
+        repeat = max(1, args.repeat // max(1, len(json_dumps(content)) // 1000))
+        as_json, as_msgpack = json_dumps(content), msgpack.packb(content, use_bin_type=True)
+        rows = [
+            ("json", as_json, lambda: json_dumps(content), lambda: json.loads(as_json)),
+            ("msgpack", as_msgpack, lambda: msgpack.packb(content, use_bin_type=True),
+             lambda: msgpack.unpackb(as_msgpack, raw=False)),
+        ]
+        for fmt, body, encode, decode in rows:
+            print(f"{name:24}{fmt:>9}{len(body):>9}{per_call_us(encode, repeat):>12.1f}"
+                  f"{per_call_us(decode, repeat):>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""Накладные расходы на построение запросов в методах моделей: select() против lambda_stmt.
+
+    python bench_statements.py [--db db.sqlite3] [--repeat 2000]
+
+key - построение выражения и его ключа кэша, то есть работа, которую движок
+делает на каждый вызов до похода в базу. call - полный вызов метода через
+AsyncSession на копии базы. "before" строит обычный select(...), как модели
+делали раньше; "after" вызывает текущий метод модели.
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import os
+import shutil
+import tempfile
+import time
+
+from sqlalchemy import case, delete, func, insert, lambda_stmt, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from db import upgrade_schema
+from models.bus import ADD_MANY, Bus
+from models.client_type import ClientType
+from models.transaction import Transaction
+
+DAY = (datetime.datetime(2024, 3, 17), datetime.datetime(2024, 3, 18))
+BUS_IDS = [1, 2, 3]
+
+
+async def stream_all_first(session: AsyncSession, batch_size: int):
+    """stream_all на каждом повторе читал бы всю таблицу: замеряется первая пачка."""
+    async with contextlib.aclosing(Transaction.stream_all(session, batch_size)) as partitions:
+        async for partition in partitions:
+            return partition
+
+
+# Запросы, которые выполняются потоком (stream_scalars), а не execute.
+STREAMED = {"Transaction.stream_all"}
+
+# Метод модели, его аргументы, запрос в том виде, в каком он строился до lambda_stmt, и в нынешнем.
+CASES = {
+    "Bus.get_by_id": (
+        Bus.get_by_id,
+        (1,),
+        lambda bus_id: select(Bus).where(Bus.id == bus_id),
+        lambda bus_id: lambda_stmt(lambda: select(Bus).where(Bus.id == bus_id)),
+    ),
+    "Bus.set_price": (
+        Bus.set_price,
+        (1, 30.0),
+        lambda bus_id, price: update(Bus).where(Bus.id == bus_id).values(price=price),
+        lambda bus_id, price: lambda_stmt(lambda: update(Bus).where(Bus.id == bus_id).values(price=price)),
+    ),
+    "ClientType.get_by_id": (
+        ClientType.get_by_id,
+        (1,),
+        lambda client_type: select(ClientType).where(ClientType.id == client_type),
+        lambda client_type: lambda_stmt(lambda: select(ClientType).where(ClientType.id == client_type)),
+    ),
+    "Transaction.get_by_id": (
+        Transaction.get_by_id,
+        (1,),
+        lambda transaction_id: select(Transaction).where(Transaction.id == transaction_id),
+        lambda transaction_id: lambda_stmt(lambda: select(Transaction).where(Transaction.id == transaction_id)),
+    ),
+    "Transaction.get_by_bus_and_time": (
+        Transaction.get_by_bus_and_time,
+        (1, *DAY),
+        lambda bus_id, date_from, date_to: select(Transaction)
+        .where(Transaction.bus_id == bus_id)
+        .where(Transaction.date >= date_from)
+        .where(Transaction.date <= date_to),
+        lambda bus_id, date_from, date_to: lambda_stmt(
+            lambda: select(Transaction)
+            .where(Transaction.bus_id == bus_id)
+            .where(Transaction.date >= date_from)
+            .where(Transaction.date <= date_to)
+        ),
+    ),
+    "Bus.delete": (
+        Bus.delete,
+        (10**9,),
+        lambda bus_id: delete(Bus).where(Bus.id == bus_id),
+        lambda bus_id: lambda_stmt(lambda: delete(Bus).where(Bus.id == bus_id)),
+    ),
+    "Bus.add_many": (
+        Bus.add_many,
+        ([30.0] * 10,),
+        lambda prices: insert(Bus).values([{"price": price, "status": True} for price in prices]).returning(Bus.id),
+        # executemany с RETURNING: выражение собрано один раз, ключ кэша запомнен на нём.
+        lambda prices: ADD_MANY,
+    ),
+    "Bus.set_active_many": (
+        Bus.set_active_many,
+        (BUS_IDS, True),
+        lambda bus_ids, status: update(Bus).where(Bus.id.in_(bus_ids)).values(status=status).returning(Bus.id),
+        lambda bus_ids, status: lambda_stmt(
+            lambda: update(Bus).where(Bus.id.in_(bus_ids)).values(status=status).returning(Bus.id)
+        ),
+    ),
+    # Форма CASE зависит от числа автобусов, lambda_stmt тут нет: обе колонки - один и тот же запрос.
+    "Bus.set_price_many": (
+        Bus.set_price_many,
+        ({bus_id: 30.0 for bus_id in BUS_IDS},),
+        lambda prices: update(Bus).where(Bus.id.in_(list(prices))).values(price=case(prices, value=Bus.id)).returning(Bus.id),
+        lambda prices: update(Bus).where(Bus.id.in_(list(prices))).values(price=case(prices, value=Bus.id)).returning(Bus.id),
+    ),
+    "ClientType.set_discount_many": (
+        ClientType.set_discount_many,
+        ([1, 2], 0),
+        lambda client_types, discount: update(ClientType)
+        .where(ClientType.id.in_(client_types))
+        .values(discount=discount)
+        .returning(ClientType.id),
+        lambda client_types, discount: lambda_stmt(
+            lambda: update(ClientType)
+            .where(ClientType.id.in_(client_types))
+            .values(discount=discount)
+            .returning(ClientType.id)
+        ),
+    ),
+    "Transaction.get_existing_keys": (
+        Transaction.get_existing_keys,
+        (["bench-1", "bench-2", "bench-3"],),
+        lambda keys: select(Transaction.idempotency_key).where(Transaction.idempotency_key.in_(keys)),
+        lambda keys: lambda_stmt(
+            lambda: select(Transaction.idempotency_key).where(Transaction.idempotency_key.in_(keys))
+        ),
+    ),
+    "Transaction.stream_all": (
+        stream_all_first,
+        (100,),
+        lambda batch_size: select(Transaction).order_by(Transaction.id.desc()).execution_options(yield_per=batch_size),
+        lambda batch_size: lambda_stmt(lambda: select(Transaction).order_by(Transaction.id.desc())),
+    ),
+    "Transaction.count_by_bus": (
+        Transaction.count_by_bus,
+        (1,),
+        lambda bus_id: select(func.count()).select_from(Transaction).where(Transaction.bus_id == bus_id),
+        lambda bus_id: lambda_stmt(
+            lambda: select(func.count()).select_from(Transaction).where(Transaction.bus_id == bus_id)
+        ),
+    ),
+}
+
+
+def per_call_us(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+async def per_call_async_us(fn, repeat: int) -> float:
+    await fn()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await fn()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+async def run(path: str, repeat: int):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    await upgrade_schema(engine)
+    session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    print(f"{'method':34}{'key before':>12}{'key after':>12}{'call before':>13}{'call after':>12}  us")
+    async with session_factory() as session:
+        for name, (method, args, build, build_lambda) in CASES.items():
+            key_before = per_call_us(lambda: build(*args)._generate_cache_key(), repeat)
+            key_after = per_call_us(lambda: build_lambda(*args)._generate_cache_key(), repeat)
+
+            async def before():
+                if name in STREAMED:
+                    result = await session.stream_scalars(build(*args))
+                    async for _ in result.partitions():
+                        break
+                    await result.close()
+                    await session.commit()
+                    return
+                result = await session.execute(build(*args))
+                # UPDATE возвращает CursorResult без строк; у ORM-результата returns_rows нет.
+                if getattr(result, "returns_rows", True):
+                    result.scalars().all()
+                await session.commit()
+
+            call_before = await per_call_async_us(before, repeat)
+            call_after = await per_call_async_us(lambda: method(session, *args), repeat)
+            print(f"{name:34}{key_before:12.1f}{key_after:12.1f}{call_before:13.1f}{call_after:12.1f}")
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default=os.environ.get("DATABASE_URL", "sqlite+aiosqlite:///db.sqlite3").split(":///", 1)[1])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.sqlite3")
+        shutil.copyfile(args.db, path)
+        asyncio.run(run(path, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from db import DbResult
+from deadline import SharedDeadline, current_deadline
+
+
+class LRUCache:
+    """LRU-кэш ограниченного размера с необязательным временем жизни записей."""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> tuple[bool, Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires, value = item
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._data[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key: Hashable, value: Any):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class SingleFlight:
+    """Объединяет одновременные одинаковые запросы в одно выполнение.
+
+    Если первый вызвавший ждёт под дедлайном запроса (deadline.guard), загрузка
+    идёт под своим SharedDeadline. Каждый ждущий выходит по своему дедлайну или
+    отключению, не прерывая загрузку для остальных; брошенная всеми загрузка
+    прерывается и забывается.
+    """
+
+    def __init__(self):
+        self.executions = 0
+        self.coalesced = 0
+        self.abandoned = 0
+        self._inflight: dict[Hashable, tuple[asyncio.Task, Optional[SharedDeadline]]] = {}
+
+    async def do(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        waiter = current_deadline.get()
+        flight = self._inflight.get(key)
+        if flight is None:
+            self.executions += 1
+            shared = SharedDeadline() if waiter is not None else None
+            task = asyncio.ensure_future(self.run(loader, shared))
+            flight = self._inflight[key] = (task, shared)
+            task.add_done_callback(lambda done: self.forget(key, done))
+        else:
+            self.coalesced += 1
+        task, shared = flight
+        if shared is not None:
+            shared.join(waiter)
+        try:
+            if waiter is None:
+                return await asyncio.shield(task)
+            return await waiter.wait(task)
+        finally:
+            if shared is not None and shared.leave() and not task.done():
+                shared.reason = "abandoned"
+                self.abandoned += 1
+                self.forget(key, task)
+
+    @staticmethod
+    async def run(loader: Callable[[], Awaitable[Any]], shared: Optional[SharedDeadline]) -> Any:
+        # Задача унаследовала контекст первого вызвавшего вместе с его дедлайном.
+        current_deadline.set(shared)
+        return await loader()
+
+    def forget(self, key: Hashable, task: Optional[asyncio.Task] = None):
+        """Следующий вызов с этим ключом начнёт новую загрузку; уже ждущие получат результат старой."""
+        flight = self._inflight.get(key)
+        if flight is not None and (task is None or flight[0] is task):
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+            "inflight": len(self._inflight),
+        }
+
+
+class QueryCache:
+    """Single-flight поверх LRU: успешные DbResult кэшируются на ttl секунд.
+
+    Результат загрузки, во время которой ключ сбросили через invalidate, в кэш
+    не кладётся: он мог быть прочитан до изменения.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.cache = LRUCache(maxsize, ttl)
+        self.flight = SingleFlight()
+        self.bypassed = 0
+        self.discarded = 0
+        # Только ключи с загрузкой в полёте: [число загрузок, число сбросов за время загрузок].
+        self._pending: dict[Hashable, list[int]] = {}
+
+    def invalidate(self, key: Hashable):
+        self.cache.invalidate(key)
+        pending = self._pending.get(key)
+        if pending is not None:
+            pending[1] += 1
+            self.flight.forget(key)
+
+    async def get_or_load(
+        self, key: Hashable, loader: Callable[[], Awaitable[DbResult]], cacheable: bool = True
+    ) -> DbResult:
+        if cacheable:
+            hit, value = self.cache.get(key)
+            if hit:
+                return DbResult.result(value)
+        else:
+            self.bypassed += 1
+        pending = self._pending.setdefault(key, [0, 0])
+        pending[0] += 1
+        invalidations = pending[1]
+        try:
+            result: DbResult = await self.flight.do(key, loader)
+        finally:
+            pending[0] -= 1
+            if pending[0] == 0 and self._pending.get(key) is pending:
+                del self._pending[key]
+        if cacheable and not result.is_error:
+            if pending[1] == invalidations:
+                self.cache.set(key, result.value)
+            else:
+                self.discarded += 1
+        return result
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), **self.flight.stats(), "bypassed": self.bypassed, "discarded": self.discarded}
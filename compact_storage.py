@@ -0,0 +1,175 @@
+"""Перевод таблицы transactions в компактный формат и замер выигрыша.
+
+    python compact_storage.py migrate [--db db.sqlite3] [--vacuum]
+    python compact_storage.py compare --db big.sqlite3 [--runs 5]
+
+После migrate сервис нужно запускать с TRANSACTION_STORAGE=compact.
+compare ничего не меняет в исходном файле: обе версии строятся во
+временном каталоге.
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+os.environ["TRANSACTION_STORAGE"] = "compact"
+
+# pylint: disable=C0413
+from models.bus import Bus  # noqa: E402,F401  pylint: disable=W0611
+from models.client_type import ClientType  # noqa: E402,F401  pylint: disable=W0611
+from models.rider_name import RiderName  # noqa: E402
+from models.transaction import COMPACT_STORAGE, Transaction  # noqa: E402
+
+EPOCH_MS_SQL = (
+    "CASE WHEN typeof(t.date) = 'integer' THEN t.date "
+    "ELSE CAST(strftime('%s', t.date) AS INTEGER) * 1000 + CAST(substr(t.date, 21, 3) AS INTEGER) END"
+)
+
+
+def default_db_path() -> str:
+    url = os.environ.get("DATABASE_URL", "sqlite+aiosqlite:///db.sqlite3")
+    return url.split(":///", 1)[1]
+
+
+def is_compact(conn: sqlite3.Connection) -> bool:
+    return any(row[1] == "name_id" for row in conn.execute("PRAGMA table_info(transactions)"))
+
+
+def create_ddl(table) -> list[str]:
+    dialect = sqlite.dialect()
+    statements = [str(CreateTable(table, if_not_exists=True).compile(dialect=dialect))]
+    statements += [str(CreateIndex(index, if_not_exists=True).compile(dialect=dialect)) for index in table.indexes]
+    return statements
+
+
+def migrate(path: str, vacuum: bool = False) -> float:
+    assert COMPACT_STORAGE
+    started = time.perf_counter()
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        if is_compact(conn):
+            print(f"{path}: already compact")
+            return 0.0
+        legacy_columns = {row[1] for row in conn.execute("PRAGMA table_info(transactions)")}
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("ALTER TABLE transactions RENAME TO transactions_legacy")
+            legacy_indexes = conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'transactions_legacy' "
+                "AND sql IS NOT NULL"
+            ).fetchall()
+            for (index,) in legacy_indexes:
+                conn.execute(f'DROP INDEX "{index}"')
+            for statement in create_ddl(RiderName.__table__) + create_ddl(Transaction.__table__):
+                conn.execute(statement)
+            conn.execute(
+                "INSERT OR IGNORE INTO rider_names (name) "
+                "SELECT DISTINCT name FROM transactions_legacy WHERE name IS NOT NULL"
+            )
+            # Колонки, которых нет в компактной схеме, не переносятся; общие копируются как есть.
+            shared = [
+                column.name for column in Transaction.__table__.columns
+                if column.name in legacy_columns and column.name not in ("name_id", "date")
+            ]
+            conn.execute(
+                f"INSERT INTO transactions ({', '.join(shared)}, name_id, date) "
+                f"SELECT {', '.join('t.' + c for c in shared)}, r.id, {EPOCH_MS_SQL} "
+                "FROM transactions_legacy t LEFT JOIN rider_names r ON r.name = t.name ORDER BY t.id"
+            )
+            conn.execute("DROP TABLE transactions_legacy")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if vacuum:
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - started
+    print(f"{path}: migrated in {elapsed:.1f}s")
+    return elapsed
+
+
+def storage_bytes(conn: sqlite3.Connection) -> int:
+    """Размер таблиц transactions и rider_names вместе с их индексами."""
+    tables = ("transactions", "rider_names")
+    names = [
+        name for (name,) in conn.execute(
+            f"SELECT name FROM sqlite_master WHERE tbl_name IN {tables!r}"
+        )
+    ]
+    try:
+        placeholders = ", ".join("?" * len(names))
+        return conn.execute(f"SELECT TOTAL(pgsize) FROM dbstat WHERE name IN ({placeholders})", names).fetchone()[0]
+    except sqlite3.OperationalError:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return conn.execute("PRAGMA page_count").fetchone()[0] * page_size
+
+
+def best_of(runs: int, fn) -> float:
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def measure(path: str, runs: int) -> dict:
+    conn = sqlite3.connect(path)
+    try:
+        if is_compact(conn):
+            rows_sql = "SELECT r.name, t.date FROM transactions t LEFT JOIN rider_names r ON r.id = t.name_id"
+        else:
+            rows_sql = "SELECT t.name, t.date FROM transactions t"
+        # Середина периода: от первого до третьего квартиля по дате.
+        count = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+        nth_date = "SELECT date FROM transactions ORDER BY date LIMIT 1 OFFSET ?"
+        date_from = conn.execute(nth_date, (count // 4,)).fetchone()[0]
+        date_to = conn.execute(nth_date, (count * 3 // 4,)).fetchone()[0]
+        range_sql = "SELECT COUNT(*), TOTAL(price) FROM transactions WHERE date >= ? AND date <= ?"
+        return {
+            "bytes": storage_bytes(conn),
+            "range_scan": best_of(runs, lambda: conn.execute(range_sql, (date_from, date_to)).fetchone()),
+            "row_read": best_of(runs, lambda: conn.execute(rows_sql).fetchall()),
+        }
+    finally:
+        conn.close()
+
+
+def compare(path: str, runs: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = os.path.join(tmp, "legacy.sqlite3")
+        compact = os.path.join(tmp, "compact.sqlite3")
+        shutil.copyfile(path, legacy)
+        sqlite3.connect(legacy, isolation_level=None).execute("VACUUM")
+        shutil.copyfile(legacy, compact)
+        migrate(compact, vacuum=True)
+        before, after = measure(legacy, runs), measure(compact, runs)
+    print(f"{'':12}{'legacy':>14}{'compact':>14}{'ratio':>8}")
+    print(f"{'size, MiB':12}{before['bytes'] / 2**20:14.1f}{after['bytes'] / 2**20:14.1f}"
+          f"{after['bytes'] / before['bytes']:8.2f}")
+    for key, title in (("range_scan", "range, ms"), ("row_read", "rows, ms")):
+        print(f"{title:12}{before[key] * 1000:14.1f}{after[key] * 1000:14.1f}{after[key] / before[key]:8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact transactions storage")
+    parser.add_argument("command", choices=["migrate", "compare"])
+    parser.add_argument("--db", default=default_db_path())
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM after migrating")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    if args.command == "migrate":
+        migrate(args.db, args.vacuum)
+    else:
+        compare(args.db, args.runs)
+
+
+if __name__ == "__main__":
+    main()
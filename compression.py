@@ -0,0 +1,168 @@
+import os
+import time
+import zlib
+from typing import Optional
+
+import brotli
+from dotenv import load_dotenv
+from starlette.datastructures import Headers, MutableHeaders
+
+
+dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
+if os.path.exists(dotenv_path):
+    load_dotenv(dotenv_path)
+
+
+class RouteCompressionStats:
+    def __init__(self):
+        self.responses = 0
+        self.skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_seconds = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "responses": self.responses,
+            "skipped": self.skipped,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "ratio": self.bytes_out / self.bytes_in if self.bytes_in else None,
+            "cpu_seconds": self.cpu_seconds,
+        }
+
+
+compression_stats: dict[str, RouteCompressionStats] = {}
+
+
+class Compressor:
+    """Потоковый gzip или brotli с учётом процессорного времени."""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int, stats: RouteCompressionStats):
+        self.encoding = encoding
+        self.stats = stats
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._gzip = zlib.compressobj(gzip_level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        started = time.thread_time()
+        if self.encoding == "br":
+            out = self._brotli.process(data) + (self._brotli.finish() if final else b"")
+        else:
+            out = self._gzip.compress(data) + (self._gzip.flush() if final else b"")
+        self.stats.cpu_seconds += time.thread_time() - started
+        self.stats.bytes_in += len(data)
+        self.stats.bytes_out += len(out)
+        return out
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        quality = next((p.partition("=")[2] for p in params if p.startswith("q=")), "1")
+        try:
+            accepted[coding.lower()] = float(quality)
+        except ValueError:
+            continue
+    for coding in ("br", "gzip"):
+        if accepted.get(coding, accepted.get("*", 0)) > 0:
+            return coding
+    return None
+
+
+class CompressionMiddleware:
+    """Сжимает ответы списочных и экспортных маршрутов по мере их отправки.
+
+    Ответы меньше minimum_size уходят как есть; пока тело не набрало этот
+    размер, куски копятся в буфере.
+    """
+
+    def __init__(
+        self,
+        app,
+        paths: tuple[str, ...],
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+    ):
+        self.app = app
+        self.paths = paths
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        route = None
+        if scope["type"] == "http":
+            route = next((path for path in self.paths if scope["path"].startswith(path)), None)
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", "")) if route else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        stats = compression_stats.setdefault(route, RouteCompressionStats())
+        start_message = None
+        buffer = b""
+        compressor: Optional[Compressor] = None
+
+        async def send_compressed(message):
+            nonlocal start_message, buffer, compressor
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is None:
+                headers = Headers(raw=start_message["headers"])
+                if "content-encoding" in headers or start_message["status"] in (204, 304):
+                    await send(start_message)
+                    start_message = None
+                    await send(message)
+                    return
+                buffer += body
+                if more_body and len(buffer) < self.minimum_size:
+                    return
+                if not more_body and len(buffer) < self.minimum_size:
+                    stats.skipped += 1
+                    await send(start_message)
+                    start_message = None
+                    await send({"type": "http.response.body", "body": buffer, "more_body": False})
+                    return
+                stats.responses += 1
+                compressor = Compressor(encoding, self.gzip_level, self.brotli_quality, stats)
+                response_headers = MutableHeaders(scope=start_message)
+                response_headers["Content-Encoding"] = encoding
+                response_headers.add_vary_header("Accept-Encoding")
+                if "content-length" in response_headers:
+                    del response_headers["content-length"]
+                await send(start_message)
+                body, buffer = buffer, b""
+
+            chunk = compressor.compress(body, final=not more_body)
+            if chunk or not more_body:
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+compression_paths = (
+    "/transactions/get_all",
+    "/transactions/get_by_client_type",
+    "/transactions/get_by_bus",
+    "/transactions/export",
+    "/bus/get_all",
+    "/client_types/get_all",
+)
+compression_options = {
+    "paths": compression_paths,
+    "minimum_size": int(os.environ.get("COMPRESSION_MIN_SIZE", "1024")),
+    "gzip_level": int(os.environ.get("GZIP_LEVEL", "6")),
+    "brotli_quality": int(os.environ.get("BROTLI_QUALITY", "4")),
+}
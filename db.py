@@ -1,7 +1,17 @@
+import asyncio
+import calendar
+import datetime
 import os
+import sqlite3
+import threading
+import time
+from typing import Optional
 
 from dotenv import load_dotenv
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from fastapi import Request
+from sqlalchemy import Column, Integer, String, Table, event, inspect, lambda_stmt, select, text
+from sqlalchemy.engine import default
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -27,6 +37,176 @@ class DbResult:
         return response
 
 
+versioned_tables: list[str] = []
+
+
+class TableVersion:
+    """Версия таблицы для ETag списочных ответов.
+
+    Версия лежит в таблице table_versions и растёт триггером (его ставит
+    add_missing_schema) в той же транзакции, что и изменение строк: её видят
+    все воркеры и процессы, а в реплику она приезжает вместе с данными.
+    """
+
+    def __init__(self, table: str):
+        self.table = table
+        versioned_tables.append(table)
+
+    async def current(self, session: AsyncSession) -> int:
+        table = self.table
+        result = await session.execute(
+            lambda_stmt(lambda: select(table_versions.c.version).where(table_versions.c.name == table))
+        )
+        return result.scalar() or 0
+
+    def etag(self, version: int, representation: str) -> str:
+        # Разные байты одного состояния таблицы (msgpack/JSON, сжатие) - разные ETag.
+        return f'W/"{self.table}-{version}-{representation}"'
+
+    @staticmethod
+    def matches(if_none_match: Optional[str], etag: str) -> bool:
+        if not if_none_match:
+            return False
+        etag = etag.removeprefix("W/")
+        return any(
+            tag.strip() == "*" or tag.strip().removeprefix("W/") == etag
+            for tag in if_none_match.split(",")
+        )
+
+
+class ReplicaSync:
+    """Периодически копирует основной файл SQLite в файл реплики через backup API.
+
+    С interval <= 0 реплику синхронизирует кто-то снаружи: цикл копирования
+    не запускается, а возраст и поколение реплики берутся из времени изменения
+    её файла (и -wal рядом с ним).
+    """
+
+    def __init__(self, primary_path: str, replica_path: str, interval: float):
+        self.primary_path = primary_path
+        self.replica_path = replica_path
+        self.interval = interval
+        self.generation = 0
+        self.syncs = 0
+        self.errors = 0
+        self.last_error = ""
+        self.last_duration = 0.0
+        self.snapshot_at: Optional[float] = None
+
+    @property
+    def external(self) -> bool:
+        return self.interval <= 0
+
+    def observe_file(self):
+        mtimes = [os.path.getmtime(path) for path in (self.replica_path, self.replica_path + "-wal") if os.path.exists(path)]
+        if mtimes and max(mtimes) != self.snapshot_at:
+            self.snapshot_at = max(mtimes)
+            self.generation += 1
+
+    def sync_once(self):
+        started = time.time()
+        source = sqlite3.connect(self.primary_path)
+        target = sqlite3.connect(self.replica_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        self.snapshot_at = started
+        self.last_duration = time.time() - started
+        self.generation += 1
+        self.syncs += 1
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.sync_once)
+            except Exception as e:
+                self.errors += 1
+                self.last_error = str(e)
+            await asyncio.sleep(self.interval)
+
+    def lag(self) -> float:
+        """Возраст данных реплики в секундах; бесконечность до первой синхронизации."""
+        if self.external:
+            self.observe_file()
+        if self.snapshot_at is None:
+            return float("inf")
+        return time.time() - self.snapshot_at
+
+    def stats(self) -> dict:
+        return {
+            "lag_seconds": self.lag() if self.external or self.snapshot_at is not None else None,
+            "external": self.external,
+            "generation": self.generation,
+            "syncs": self.syncs,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "last_duration": self.last_duration,
+            "max_lag": replica_max_lag,
+        }
+
+
+class StatementCacheStats:
+    """Попадания выполненных запросов в кэш скомпилированных выражений движка."""
+
+    OUTCOMES = {
+        default.CACHE_HIT: "hits",
+        default.CACHE_MISS: "misses",
+        default.NO_CACHE_KEY: "no_cache_key",
+        default.CACHING_DISABLED: "disabled",
+        default.NO_DIALECT_SUPPORT: "disabled",
+    }
+
+    def __init__(self):
+        self.counts = {"hits": 0, "misses": 0, "no_cache_key": 0, "disabled": 0, "raw_sql": 0}
+        self._lock = threading.Lock()
+
+    def attach(self, async_engine: AsyncEngine):
+        event.listen(async_engine.sync_engine, "after_cursor_execute", self.record)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        outcome = "raw_sql" if context.compiled is None else self.OUTCOMES.get(context.cache_hit, "disabled")
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def stats(self) -> dict:
+        cached = self.counts["hits"] + self.counts["misses"]
+        return {
+            **self.counts,
+            "hit_ratio": self.counts["hits"] / cached if cached else None,
+            "cache_size": len(engine.sync_engine._compiled_cache or ()),  # pylint: disable=W0212
+        }
+
+
+def enable_wal(async_engine: AsyncEngine):
+    """Режим WAL для каждого нового соединения.
+
+    Чтения, в том числе снимки backup.py, не блокируют проходы и не
+    перезапускаются от них; режим сохраняется в самом файле базы.
+    """
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def set_journal_mode(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.close()
+
+
+def sqlite_path(url: str) -> str:
+    return url.split(":///", 1)[1]
+
+
+def to_epoch_ms(date: datetime.datetime) -> int:
+    """Наивные даты (как в таблице transactions) считаются UTC, чтобы час суток не сдвигался."""
+    if date.tzinfo is not None:
+        date = date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return calendar.timegm(date.timetuple()) * 1000 + date.microsecond // 1000
+
+
+def from_epoch_ms(epoch_ms: int) -> datetime.datetime:
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=epoch_ms)
+
+
 dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
 if os.path.exists(dotenv_path):
     load_dotenv(dotenv_path)
@@ -35,9 +215,96 @@ engine = create_async_engine(
     os.environ.get("DATABASE_URL"), echo=os.environ.get("DEBUG") == "1"
 )
 Base = declarative_base()
+table_versions = Table(
+    "table_versions",
+    Base.metadata,
+    Column("name", String, primary_key=True),
+    Column("version", Integer, nullable=False),
+)
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+# Движок только для чтения: отдельный файл-реплика, если задан DATABASE_READ_URL.
+read_engine = (
+    create_async_engine(os.environ["DATABASE_READ_URL"], echo=os.environ.get("DEBUG") == "1")
+    if os.environ.get("DATABASE_READ_URL") else None
+)
+async_read_session = (
+    sessionmaker(read_engine, class_=AsyncSession, expire_on_commit=False) if read_engine is not None else None
+)
+enable_wal(engine)
+statement_cache = StatementCacheStats()
+statement_cache.attach(engine)
+if read_engine is not None:
+    statement_cache.attach(read_engine)
+replica_max_lag = float(os.environ.get("REPLICA_MAX_LAG", "30"))
+replica = (
+    ReplicaSync(
+        sqlite_path(os.environ["DATABASE_URL"]),
+        sqlite_path(os.environ["DATABASE_READ_URL"]),
+        float(os.environ.get("REPLICA_SYNC_INTERVAL", "5")),
+    )
+    if read_engine is not None else None
+)
+
+
+def add_missing_schema(conn):
+    """Создаёт недостающие таблицы, колонки и индексы, не трогая данные."""
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+    Base.metadata.create_all(conn)
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                column_type = column.type.compile(dialect=conn.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+    for name in versioned_tables:
+        add_version_triggers(conn, name)
+
+
+def add_version_triggers(conn, name: str):
+    """Триггеры версии таблицы; пересоздаются, чтобы UPDATE учитывал добавленные колонки."""
+    conn.execute(text("INSERT OR IGNORE INTO table_versions (name, version) VALUES (:name, 0)"), {"name": name})
+    bump = f"UPDATE table_versions SET version = version + 1 WHERE name = '{name}';"
+    # UPDATE без изменений (например, set_active уже открытого автобуса на каждом проходе) версию не трогает.
+    changed = " OR ".join(f'OLD."{column.name}" IS NOT NEW."{column.name}"' for column in Base.metadata.tables[name].columns)
+    for event_name, when in (("insert", ""), ("update", f"WHEN {changed}"), ("delete", "")):
+        trigger = f"{name}_version_{event_name}"
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+        conn.execute(text(f"CREATE TRIGGER {trigger} AFTER {event_name.upper()} ON {name} {when} BEGIN {bump} END"))
+
+
+async def upgrade_schema(engine: AsyncEngine):
+    async with engine.begin() as conn:
+        await conn.run_sync(add_missing_schema)
+
 
 async def get_session() -> AsyncSession:
     async with async_session() as session:
         yield session
+
+
+def use_primary(request: Request) -> bool:
+    if async_read_session is None or request.headers.get("x-consistency") == "primary":
+        return True
+    return replica.lag() > replica_max_lag
+
+
+async def get_read_session(request: Request) -> AsyncSession:
+    """Сессия для запросов только на чтение.
+
+    Идёт в реплику, если она настроена и отстаёт не больше REPLICA_MAX_LAG.
+    Заголовок X-Consistency: primary принудительно читает из основной базы.
+    """
+    if use_primary(request):
+        async with async_session() as session:
+            session.info["snapshot"] = ""
+            yield session
+    else:
+        async with async_read_session() as session:
+            session.info["snapshot"] = f"replica-{replica.generation}"
+            yield session
@@ -0,0 +1,186 @@
+import asyncio
+import contextvars
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from dotenv import load_dotenv
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from db import DbResult, engine, read_engine
+
+
+dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
+if os.path.exists(dotenv_path):
+    load_dotenv(dotenv_path)
+
+
+async def wait_disconnect(request: Request):
+    """Возвращается, когда клиент отключился.
+
+    request.is_disconnected() за BaseHTTPMiddleware (SQLAlchemyMiddleware) отключения не видит:
+    его receive всегда уступает управление и тут же отменяется. Поэтому ждём сообщение сами;
+    тело запроса к этому моменту уже должно быть прочитано.
+    """
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+class QueryInterrupted(Exception):
+    def __init__(self, reason: str, seconds: float):
+        self.reason = reason
+        self.seconds = seconds
+        if reason == "disconnect":
+            super().__init__("Query interrupted: client disconnected")
+        else:
+            super().__init__(f"Query interrupted: deadline of {seconds}s exceeded")
+
+
+class Deadline:
+    __slots__ = ("expires", "reason", "watcher")
+
+    def __init__(self, expires: float):
+        self.expires = expires
+        self.reason: Optional[str] = None
+        self.watcher: Optional[asyncio.Task] = None
+
+    def check(self) -> int:
+        """Обработчик прогресса SQLite: ненулевой ответ прерывает текущий запрос."""
+        if self.reason is None and time.monotonic() > self.expires:
+            self.reason = "deadline"
+        return 1 if self.reason is not None else 0
+
+    async def wait(self, task: asyncio.Future) -> DbResult:
+        """Ждёт чужую загрузку до своего дедлайна или отключения; саму загрузку не отменяет."""
+        waits = {task} if self.watcher is None else {task, self.watcher}
+        timeout = max(0.0, self.expires - time.monotonic())
+        await asyncio.wait(waits, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if task.done():
+            return task.result()
+        if self.reason is None:
+            self.reason = "deadline"
+        return DbResult.error(f"Query interrupted: {self.reason}")
+
+
+class SharedDeadline(Deadline):
+    """Дедлайн общей загрузки SingleFlight: самый поздний из дедлайнов её ждущих.
+
+    Ждущий без дедлайна делает его бесконечным. Ушедший ждущий (дедлайн,
+    отключение) загрузку не прерывает; её прерывает только свой дедлайн
+    или уход всех ждущих.
+    """
+
+    __slots__ = ("waiters",)
+
+    def __init__(self):
+        super().__init__(0.0)
+        self.waiters = 0
+
+    def join(self, deadline: Optional[Deadline]):
+        self.waiters += 1
+        self.expires = max(self.expires, deadline.expires if deadline is not None else math.inf)
+
+    def leave(self) -> bool:
+        """True, если ушёл последний ждущий ограниченной загрузки."""
+        self.waiters -= 1
+        return self.waiters == 0 and self.expires != math.inf
+
+
+current_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("current_deadline", default=None)
+
+
+class QueryDeadlines:
+    """Дедлайны запросов к базе по префиксам маршрутов.
+
+    Перед каждым запросом на соединение ставится обработчик прогресса SQLite
+    с дедлайном текущего маршрута (или снимается, если дедлайна нет): модели
+    делают commit внутри методов, и следующий запрос сессии может уйти в другое
+    соединение пула. Обработчик вызывается каждые steps инструкций VM и
+    прерывает запрос, когда дедлайн прошёл или клиент отключился; соединение
+    после этого остаётся рабочим и возвращается в пул обычным закрытием сессии.
+    """
+
+    def __init__(self, routes: list[tuple[str, float]], steps: int = 1000):
+        self.routes = routes
+        self.steps = steps
+        self.guarded = 0
+        self.interrupted = {"deadline": 0, "disconnect": 0}
+
+    def seconds_for(self, path: str) -> Optional[float]:
+        for prefix, seconds in self.routes:
+            if path.startswith(prefix):
+                return seconds
+        return None
+
+    def attach(self, target: AsyncEngine):
+        @event.listens_for(target.sync_engine, "before_cursor_execute")
+        def set_handler(conn, cursor, statement, parameters, context, executemany):
+            deadline = current_deadline.get()
+            record = conn.connection
+            if record.info.get("deadline") is deadline:
+                return
+            record.info["deadline"] = deadline
+            # У aiosqlite запрос выполняется в его потоке; сам sqlite3.Connection лежит в _conn.
+            driver = record.driver_connection
+            sqlite_conn = getattr(driver, "_conn", driver)
+            sqlite_conn.set_progress_handler(deadline.check if deadline is not None else None, self.steps)
+
+    @staticmethod
+    async def watch_disconnect(request: Request, deadline: Deadline):
+        await wait_disconnect(request)
+        if deadline.reason is None:
+            deadline.reason = "disconnect"
+
+    @asynccontextmanager
+    async def guard(self, request: Request):
+        """Ограничивает запросы к базе внутри блока; прерванный запрос поднимает QueryInterrupted на выходе.
+
+        Общую загрузку SingleFlight блок только ждёт (Deadline.wait): она идёт
+        под своим SharedDeadline, а не под дедлайном первого вызвавшего.
+        """
+        seconds = self.seconds_for(request.url.path)
+        if seconds is None:
+            yield None
+            return
+        self.guarded += 1
+        deadline = Deadline(time.monotonic() + seconds)
+        token = current_deadline.set(deadline)
+        watcher = deadline.watcher = asyncio.create_task(self.watch_disconnect(request, deadline))
+        try:
+            yield deadline
+        finally:
+            watcher.cancel()
+            current_deadline.reset(token)
+        if deadline.reason is not None:
+            self.interrupted[deadline.reason] += 1
+            raise QueryInterrupted(deadline.reason, seconds)
+
+    def stats(self) -> dict:
+        return {
+            "routes": dict(self.routes),
+            "steps": self.steps,
+            "guarded": self.guarded,
+            "interrupted": self.interrupted,
+        }
+
+    @staticmethod
+    def from_env() -> "QueryDeadlines":
+        stats = float(os.environ.get("QUERY_DEADLINE_STATS", "10"))
+        exports = float(os.environ.get("QUERY_DEADLINE_EXPORTS", "30"))
+        return QueryDeadlines(
+            [
+                ("/stats/", stats),
+                ("/transactions/get_all", exports),
+            ],
+            steps=int(os.environ.get("QUERY_DEADLINE_STEPS", "1000")),
+        )
+
+
+query_deadlines = QueryDeadlines.from_env()
+query_deadlines.attach(engine)
+if read_engine is not None:
+    query_deadlines.attach(read_engine)
@@ -0,0 +1,95 @@
+import asyncio
+import os
+import threading
+from collections import deque
+from typing import Optional
+
+from dotenv import load_dotenv
+
+
+dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
+if os.path.exists(dotenv_path):
+    load_dotenv(dotenv_path)
+
+
+class Subscriber:
+    """Очередь событий одного подписчика: при переполнении вытесняются самые старые."""
+
+    def __init__(self, maxsize: int, bus_id: Optional[int] = None, client_type: Optional[int] = None):
+        self.bus_id = bus_id
+        self.client_type = client_type
+        self.dropped = 0
+        self.events: deque[tuple[str, dict]] = deque(maxlen=maxsize)
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+
+    def matches(self, kind: str, payload: dict) -> bool:
+        if self.bus_id is not None and payload.get("bus_id") != self.bus_id:
+            return False
+        if self.client_type is not None and payload.get("client_type") != self.client_type:
+            return False
+        return True
+
+    def push(self, kind: str, payload: dict):
+        if len(self.events) == self.events.maxlen:
+            self.dropped += 1
+        self.events.append((kind, payload))
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            pass
+
+    async def wait(self, timeout: float) -> list[tuple[str, dict]]:
+        if not self.events:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        batch = []
+        while self.events:
+            batch.append(self.events.popleft())
+        return batch
+
+
+class TransactionFeed:
+    """Рассылка новых проходов и смены статуса автобусов подписчикам.
+
+    publish никогда не ждёт подписчиков и может вызываться из любого потока.
+    """
+
+    def __init__(self, buffer_size: int):
+        self.buffer_size = buffer_size
+        self.published = 0
+        self._subscribers: set[Subscriber] = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, bus_id: Optional[int] = None, client_type: Optional[int] = None) -> Subscriber:
+        subscriber = Subscriber(self.buffer_size, bus_id, client_type)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, kind: str, payload: dict):
+        self.published += 1
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            if subscriber.matches(kind, payload):
+                subscriber.push(kind, payload)
+
+    def stats(self) -> dict:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        return {
+            "subscribers": len(subscribers),
+            "published": self.published,
+            "dropped": sum(s.dropped for s in subscribers),
+        }
+
+
+transaction_feed = TransactionFeed(int(os.environ.get("FEED_BUFFER_SIZE", "256")))
@@ -0,0 +1,155 @@
+import datetime
+import itertools
+import os
+import sys
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+from dotenv import load_dotenv
+
+
+dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
+if os.path.exists(dotenv_path):
+    load_dotenv(dotenv_path)
+
+
+class RiderWindow:
+    """Последние проходы одного пассажира за window секунд, не больше max_taps.
+
+    Обычный список вместо deque: у большинства пассажиров один-два прохода, а
+    deque сразу занимает блок на 64 элемента. Сдвиг при вытеснении ограничен max_taps.
+    """
+
+    __slots__ = ("taps", "concessions")
+
+    def __init__(self):
+        self.taps: list[tuple[float, int, bool]] = []
+        self.concessions = 0
+
+    def evict(self, now: float, window: float):
+        while self.taps and self.taps[0][0] < now - window:
+            self.concessions -= self.taps.pop(0)[2]
+
+    def append(self, ts: float, bus_id: int, concession: bool, max_taps: int):
+        if len(self.taps) >= max_taps:
+            self.concessions -= self.taps.pop(0)[2]
+        self.taps.append((ts, bus_id, concession))
+        self.concessions += concession
+
+
+class FraudDetector:
+    """Проверка каждого прохода по скользящему окну пассажира.
+
+    Правила смотрят только на последний проход и счётчик окна, поэтому проход
+    обходится в O(1) амортизированно. Память ограничена числом отслеживаемых
+    пассажиров (давно не ездившие вытесняются) и длиной окна каждого.
+    """
+
+    def __init__(
+        self,
+        window: float,
+        min_transfer: float,
+        max_concessions: int,
+        concession_types: set[int],
+        max_riders: int,
+        max_taps: int,
+        max_alerts: int,
+    ):
+        self.window = window
+        self.min_transfer = min_transfer
+        self.max_concessions = max_concessions
+        self.concession_types = concession_types
+        self.max_riders = max_riders
+        self.max_taps = max_taps
+        self.riders: OrderedDict[str, RiderWindow] = OrderedDict()
+        self.alerts: deque[dict] = deque(maxlen=max_alerts)
+        self.alert_counts = {"bus_change": 0, "concession_overuse": 0}
+        self.taps = 0
+        self.evicted_riders = 0
+        self.observe_seconds = 0.0
+        self._ids = itertools.count(1)
+
+    def observe(
+        self, name: str, bus_id: int, client_type: int, date: datetime.datetime, transaction_id: Optional[int] = None
+    ) -> list[dict]:
+        started = time.perf_counter()
+        ts = date.timestamp()
+        rider = self.riders.get(name)
+        if rider is None:
+            rider = self.riders[name] = RiderWindow()
+            if len(self.riders) > self.max_riders:
+                self.riders.popitem(last=False)
+                self.evicted_riders += 1
+        else:
+            self.riders.move_to_end(name)
+        rider.evict(ts, self.window)
+
+        alerts = []
+        if rider.taps:
+            last_ts, last_bus, _ = rider.taps[-1]
+            if last_bus != bus_id and ts - last_ts < self.min_transfer:
+                alerts.append(self.alert(
+                    "bus_change", name, bus_id, client_type, date, transaction_id,
+                    previous_bus_id=last_bus, seconds=round(ts - last_ts, 3),
+                ))
+        concession = client_type in self.concession_types
+        rider.append(ts, bus_id, concession, self.max_taps)
+        if concession and rider.concessions > self.max_concessions:
+            alerts.append(self.alert(
+                "concession_overuse", name, bus_id, client_type, date, transaction_id, count=rider.concessions,
+            ))
+        self.taps += 1
+        self.observe_seconds += time.perf_counter() - started
+        return alerts
+
+    def alert(self, kind: str, name: str, bus_id: int, client_type: int, date, transaction_id, **detail) -> dict:
+        alert = {
+            "id": next(self._ids),
+            "kind": kind,
+            "name": name,
+            "bus_id": bus_id,
+            "client_type": client_type,
+            "date": date.isoformat(),
+            "transaction_id": transaction_id,
+            **detail,
+        }
+        self.alerts.append(alert)
+        self.alert_counts[kind] += 1
+        return alert
+
+    def recent(self, since: int = 0, limit: int = 100, kind: Optional[str] = None) -> list[dict]:
+        """Алерты с id > since, от старых к новым."""
+        return list(itertools.islice(
+            (a for a in self.alerts if a["id"] > since and (kind is None or a["kind"] == kind)), limit
+        ))
+
+    def memory_bytes(self) -> int:
+        """Приблизительный объём окон: словарь, ключи, списки проходов и кортежи в них."""
+        total = sys.getsizeof(self.riders) + sys.getsizeof(self.alerts)
+        for name, rider in self.riders.items():
+            total += sys.getsizeof(name) + sys.getsizeof(rider) + sys.getsizeof(rider.taps)
+            total += sum(sys.getsizeof(tap) for tap in rider.taps)
+        return total
+
+    def stats(self) -> dict:
+        return {
+            "taps": self.taps,
+            "riders": len(self.riders),
+            "evicted_riders": self.evicted_riders,
+            "window_taps": sum(len(rider.taps) for rider in self.riders.values()),
+            "alerts": self.alert_counts,
+            "memory_bytes": self.memory_bytes(),
+            "mean_observe_us": self.observe_seconds / self.taps * 1e6 if self.taps else None,
+        }
+
+
+fraud_detector = FraudDetector(
+    window=float(os.environ.get("FRAUD_WINDOW", "3600")),
+    min_transfer=float(os.environ.get("FRAUD_MIN_TRANSFER", "300")),
+    max_concessions=int(os.environ.get("FRAUD_MAX_CONCESSIONS", "8")),
+    concession_types={int(i) for i in os.environ.get("FRAUD_CONCESSION_TYPES", "1,2,4,5").split(",") if i},
+    max_riders=int(os.environ.get("FRAUD_MAX_RIDERS", "100000")),
+    max_taps=int(os.environ.get("FRAUD_WINDOW_TAPS", "32")),
+    max_alerts=int(os.environ.get("FRAUD_MAX_ALERTS", "1000")),
+)
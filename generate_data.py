@@ -0,0 +1,200 @@
+"""Генератор синтетических данных для нагрузочных замеров.
+
+    python generate_data.py --buses 500 --transactions 20000000 --days 90 \
+        --distribution rush --bus-skew 1.1 --reset
+
+Пишет напрямую в SQLite (путь берётся из --db или DATABASE_URL) пачками
+executemany внутри одной транзакции. Чтобы сервис не стёр данные при
+старте, запускайте его с REINIT_DB=0. С TRANSACTION_STORAGE=compact данные
+пишутся сразу в компактном формате.
+"""
+import argparse
+import datetime
+import itertools
+import math
+import os
+import random as rnd
+import sqlite3
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+
+from db import Base, add_missing_schema, to_epoch_ms
+from models.bus import Bus  # noqa: F401  pylint: disable=W0611
+from models.client_type import ClientType  # noqa: F401  pylint: disable=W0611
+from models.transaction import COMPACT_STORAGE, Transaction  # noqa: F401  pylint: disable=W0611
+
+dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
+if os.path.exists(dotenv_path):
+    load_dotenv(dotenv_path)
+
+BASE_CLIENT_TYPES = [
+    ["Пенсионеры", 30, 10],
+    ["Студенты", 15, 15],
+    ["Обычные", 0, 60],
+    ["Алга", 10, 10],
+    ["Инвалиды", 70, 5],
+]
+
+# Доля проходов по часам суток для распределения "rush": пики 7-9 и 17-19.
+RUSH_HOURS = [
+    1, 1, 1, 1, 2, 6, 14, 24, 22, 12, 8, 8,
+    9, 9, 8, 9, 14, 22, 20, 12, 7, 4, 2, 1,
+]
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def default_db_path() -> str:
+    url = os.environ.get("DATABASE_URL", "sqlite+aiosqlite:///db.sqlite3")
+    return url.split(":///", 1)[1]
+
+
+def create_schema(path: str, reset: bool):
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as conn:
+        if reset:
+            Base.metadata.drop_all(conn)
+        add_missing_schema(conn)
+    engine.dispose()
+
+
+def bus_weights(count: int, skew: float) -> list[float]:
+    """Zipf-подобный вес автобуса: при skew=0 все автобусы равны."""
+    order = list(range(count))
+    rnd.shuffle(order)
+    return [1 / math.pow(rank + 1, skew) for rank in order]
+
+
+def second_of_day(distribution: str) -> float:
+    if distribution == "uniform":
+        return rnd.uniform(0, 86400)
+    if distribution == "rush":
+        hour = rnd.choices(range(24), weights=RUSH_HOURS)[0]
+        return hour * 3600 + rnd.uniform(0, 3600)
+    if distribution == "daytime":
+        return min(max(rnd.gauss(13 * 3600, 3.5 * 3600), 0), 86399.999)
+    raise ValueError(f"Unknown distribution {distribution}")
+
+
+def seed_client_types(conn: sqlite3.Connection, count: int) -> list[tuple[int, int, float]]:
+    rows = list(BASE_CLIENT_TYPES[:count])
+    rows += [[f"Тип {i}", rnd.randint(0, 50), 1] for i in range(len(rows) + 1, count + 1)]
+    for name, discount, _ in rows:
+        conn.execute(
+            "INSERT OR IGNORE INTO client_types (client_name, discount) VALUES (?, ?)",
+            (name, discount),
+        )
+    shares = {name: share for name, _, share in rows}
+    result = conn.execute("SELECT id, client_name, discount FROM client_types").fetchall()
+    return [(id_, discount, shares.get(name, 1)) for id_, name, discount in result]
+
+
+def seed_buses(conn: sqlite3.Connection, count: int) -> list[tuple[int, float]]:
+    conn.executemany(
+        "INSERT INTO buses (price, status) VALUES (?, 1)",
+        ((float(rnd.randint(25, 45)),) for _ in range(count)),
+    )
+    return conn.execute("SELECT id, price FROM buses").fetchall()
+
+
+def seed_rider_names(conn: sqlite3.Connection, count: int) -> dict[str, int]:
+    conn.executemany(
+        "INSERT OR IGNORE INTO rider_names (name) VALUES (?)",
+        ((f"name {i}",) for i in range(1, count + 1)),
+    )
+    return dict(conn.execute("SELECT name, id FROM rider_names"))
+
+
+def transaction_rows(args, buses, client_types, rider_ids=None):
+    bus_cum = list(itertools.accumulate(bus_weights(len(buses), args.bus_skew)))
+    type_cum = list(itertools.accumulate(share for _, _, share in client_types))
+    end = datetime.datetime.combine(args.end, datetime.time())
+    start = end - datetime.timedelta(days=args.days)
+    for _ in range(args.transactions):
+        bus_id, bus_price = rnd.choices(buses, cum_weights=bus_cum)[0]
+        type_id, discount, _ = rnd.choices(client_types, cum_weights=type_cum)[0]
+        moment = start + datetime.timedelta(
+            days=rnd.randrange(args.days), seconds=second_of_day(args.distribution)
+        )
+        name = f"name {rnd.randint(1, args.riders)}"
+        yield (
+            rider_ids[name] if rider_ids is not None else name,
+            type_id,
+            bus_price * (100 - discount) / 100,
+            to_epoch_ms(moment) if rider_ids is not None else moment.strftime(DATE_FORMAT),
+            bus_id,
+        )
+
+
+def generate(args) -> float:
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -262144")
+    started = time.perf_counter()
+    loaded = 0
+    conn.execute("BEGIN")
+    try:
+        client_types = seed_client_types(conn, args.client_types)
+        buses = seed_buses(conn, args.buses)
+        rider_ids = seed_rider_names(conn, args.riders) if COMPACT_STORAGE else None
+        rows = transaction_rows(args, buses, client_types, rider_ids)
+        name_column = "name_id" if COMPACT_STORAGE else "name"
+        while True:
+            batch = list(itertools.islice(rows, args.batch_size))
+            if not batch:
+                break
+            conn.executemany(
+                f"INSERT INTO transactions ({name_column}, client_type, price, date, bus_id) VALUES (?, ?, ?, ?, ?)",
+                batch,
+            )
+            loaded += len(batch)
+            elapsed = time.perf_counter() - started
+            print(f"\r{loaded}/{args.transactions} rows, {loaded / elapsed:,.0f} rows/s", end="", flush=True)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - started
+    print(f"\nLoaded {loaded} transactions, {len(buses)} buses, {len(client_types)} client types "
+          f"in {elapsed:.1f}s ({loaded / max(elapsed, 1e-9):,.0f} rows/s)")
+    return elapsed
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be >= 1, got {number}")
+    return number
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load synthetic buses, client types and transactions")
+    parser.add_argument("--db", default=default_db_path(), help="SQLite file (default: from DATABASE_URL)")
+    parser.add_argument("--buses", type=positive_int, default=300)
+    parser.add_argument("--client-types", type=positive_int, default=len(BASE_CLIENT_TYPES))
+    parser.add_argument("--transactions", type=int, default=1_000_000)
+    parser.add_argument("--riders", type=positive_int, default=200_000, help="Number of distinct rider names")
+    parser.add_argument("--days", type=positive_int, default=30, help="Length of the generated period")
+    parser.add_argument("--end", type=datetime.date.fromisoformat, default=datetime.date.today(),
+                        help="Last day (exclusive) of the generated period, YYYY-MM-DD")
+    parser.add_argument("--distribution", choices=["uniform", "rush", "daytime"], default="rush",
+                        help="Time-of-day distribution of taps")
+    parser.add_argument("--bus-skew", type=float, default=1.0,
+                        help="Zipf exponent of per-bus load, 0 for an even load")
+    parser.add_argument("--batch-size", type=positive_int, default=50_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="Drop and recreate all tables first")
+    args = parser.parse_args()
+
+    rnd.seed(args.seed)
+    create_schema(args.db, args.reset)
+    generate(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import datetime
+import os
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+
+
+dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
+if os.path.exists(dotenv_path):
+    load_dotenv(dotenv_path)
+
+
+def minute_of(date: datetime.datetime) -> int:
+    """Номер минуты от эпохи по местному времени сервиса, как и даты проходов."""
+    return int(date.timestamp()) // 60
+
+
+class BusLoad:
+    """Кольцо поминутных счётчиков одного автобуса: проходы и выручка за последние slots минут.
+
+    В ячейке хранится номер минуты, которой она принадлежит; ячейка от
+    минуты, ушедшей за пределы кольца, обнуляется при первой записи в неё.
+    """
+
+    __slots__ = ("minutes", "taps", "revenue")
+
+    def __init__(self, slots: int):
+        self.minutes = [-1] * slots
+        self.taps = [0] * slots
+        self.revenue = [0.0] * slots
+
+    def record(self, minute: int, price: float):
+        i = minute % len(self.minutes)
+        if self.minutes[i] != minute:
+            self.minutes[i] = minute
+            self.taps[i] = 0
+            self.revenue[i] = 0.0
+        self.taps[i] += 1
+        self.revenue[i] += price
+
+    def windows(self, now_minute: int, windows: tuple[int, ...]) -> dict:
+        """Суммы за последние n минут (включая текущую) для каждого n из windows за один проход по кольцу."""
+        slots = len(self.minutes)
+        result = {}
+        taps, revenue = 0, 0.0
+        for back in range(max(windows)):
+            minute = now_minute - back
+            i = minute % slots
+            if self.minutes[i] == minute:
+                taps += self.taps[i]
+                revenue += self.revenue[i]
+            if back + 1 in windows:
+                result[back + 1] = (taps, revenue)
+        return result
+
+
+class FleetLoad:
+    """Нагрузка по всем автобусам в реальном времени без обращения к базе.
+
+    Проход учитывается за O(1) в on_tap; при старте кольца заполняются из базы
+    за последние slots минут.
+    """
+
+    def __init__(self, slots: int = 60, windows: tuple[int, ...] = (5, 15, 60)):
+        if max(windows) > slots:
+            raise ValueError(f"window {max(windows)} is longer than the ring of {slots} minutes")
+        self.slots = slots
+        self.windows = windows
+        self.buses: dict[int, BusLoad] = {}
+        self.recorded = 0
+        self.stale = 0
+        self.rebuilt_rows = 0
+        self.rebuild_seconds = 0.0
+        self.query_seconds = 0.0
+        self.queries = 0
+
+    def record(self, bus_id: int, price: float, date: datetime.datetime, now: Optional[datetime.datetime] = None):
+        minute = minute_of(date)
+        if minute <= minute_of(now or datetime.datetime.now()) - self.slots:
+            # Проход старше кольца (например, поздно перенесённый из журнала) ни в одно окно не попадает.
+            self.stale += 1
+            return
+        bus = self.buses.get(bus_id)
+        if bus is None:
+            bus = self.buses[bus_id] = BusLoad(self.slots)
+        bus.record(minute, price or 0.0)
+        self.recorded += 1
+
+    def rebuild(self, rows, now: datetime.datetime):
+        """Заполняет кольца заново из строк (bus_id, price, date)."""
+        started = time.perf_counter()
+        self.buses = {}
+        count = 0
+        for bus_id, price, date in rows:
+            self.record(bus_id, price, date, now)
+            count += 1
+        self.rebuilt_rows = count
+        self.rebuild_seconds = time.perf_counter() - started
+
+    def fleet(self, now: Optional[datetime.datetime] = None) -> list[dict]:
+        started = time.perf_counter()
+        now_minute = minute_of(now or datetime.datetime.now())
+        rows = []
+        for bus_id in sorted(self.buses):
+            sums = self.buses[bus_id].windows(now_minute, self.windows)
+            rows.append({
+                "bus_id": bus_id,
+                "windows": [{"minutes": n, "taps": sums[n][0], "revenue": sums[n][1]} for n in self.windows],
+            })
+        self.queries += 1
+        self.query_seconds += time.perf_counter() - started
+        return rows
+
+    def stats(self) -> dict:
+        return {
+            "buses": len(self.buses),
+            "slots": self.slots,
+            "windows": list(self.windows),
+            "recorded": self.recorded,
+            "stale": self.stale,
+            "rebuilt_rows": self.rebuilt_rows,
+            "rebuild_seconds": self.rebuild_seconds,
+            "queries": self.queries,
+            "mean_query_us": self.query_seconds / self.queries * 1e6 if self.queries else None,
+        }
+
+
+fleet_load = FleetLoad(
+    slots=int(os.environ.get("LOAD_MINUTES", "60")),
+    windows=tuple(int(n) for n in os.environ.get("LOAD_WINDOWS", "5,15,60").split(",") if n),
+)
@@ -1,53 +1,261 @@
+"""Нагрузочные профили для сервиса оплаты проезда.
+
+Headless-запуск с отчётами и проверкой SLO:
+
+    locust -f locust_test.py --headless -H http://localhost:5000 \
+        -u 200 -r 50 -t 5m --profile mixed --seed 42 \
+        --csv reports/run --json-report reports/run.json \
+        --slo-min-rps 150 --slo-p99-ms 800
+
+Профили (--profile):
+    mixed     - утренний час пик, дашборды и выгрузки вместе
+    rush      - только пачки проходов через валидаторы
+    dashboard - только опрос /stats
+    export    - только чтение больших выгрузок
+"""
+import datetime
+import json
+import logging
 import random as rnd
+import time
+
+import requests
+from locust import HttpUser, between, events, tag, task
+from locust.runners import WorkerRunner
+
+PROFILES = {
+    "mixed": {"Validator": 20, "Dashboard": 4, "ExportReader": 1},
+    "rush": {"Validator": 1},
+    "dashboard": {"Dashboard": 1},
+    "export": {"ExportReader": 1},
+}
+
+# Автобусы, известные после подготовки данных; заполняется в on_test_start.
+FLEET: list[int] = []
+
+
+@events.init_command_line_parser.add_listener
+def _(parser):
+    parser.add_argument("--profile", type=str, env_var="LOCUST_PROFILE", default="mixed",
+                        choices=sorted(PROFILES), help="Traffic profile")
+    parser.add_argument("--seed", type=int, env_var="LOCUST_SEED", default=42,
+                        help="Random seed for the dataset and the traffic")
+    parser.add_argument("--bus-count", type=int, env_var="LOCUST_BUS_COUNT", default=300,
+                        help="Number of buses to seed and tap on")
+    parser.add_argument("--riders", type=int, env_var="LOCUST_RIDERS", default=5000,
+                        help="Number of distinct rider names")
+    parser.add_argument("--client-types", type=int, env_var="LOCUST_CLIENT_TYPES", default=5,
+                        help="Client type ids are picked from 1..N")
+    parser.add_argument("--rush-period", type=float, env_var="LOCUST_RUSH_PERIOD", default=60,
+                        help="Seconds between the starts of two tap bursts")
+    parser.add_argument("--rush-burst", type=float, env_var="LOCUST_RUSH_BURST", default=15,
+                        help="Burst length in seconds")
+    parser.add_argument("--poll-interval", type=float, env_var="LOCUST_POLL_INTERVAL", default=5,
+                        help="Dashboard polling interval in seconds")
+    parser.add_argument("--json-report", type=str, env_var="LOCUST_JSON_REPORT", default="",
+                        help="Write the final stats and SLO verdict to this file")
+    parser.add_argument("--slo-min-rps", type=float, env_var="LOCUST_SLO_MIN_RPS", default=0,
+                        help="Fail the run below this total throughput")
+    parser.add_argument("--slo-p99-ms", type=float, env_var="LOCUST_SLO_P99_MS", default=0,
+                        help="Fail the run above this total p99 latency")
+    parser.add_argument("--slo-max-fail-ratio", type=float, env_var="LOCUST_SLO_MAX_FAIL_RATIO", default=0.01,
+                        help="Fail the run above this share of failed requests")
+
+
+@events.init.add_listener
+def on_init(environment, **kwargs):
+    options = environment.parsed_options
+    if options is None:
+        return
+    weights = PROFILES[options.profile]
+    for user_class in environment.user_classes:
+        user_class.weight = weights.get(user_class.__name__, 0)
+    environment.user_classes = [u for u in environment.user_classes if u.weight > 0]
+
+
+def seed_fleet(host: str, bus_count: int) -> list[int]:
+    """Добивает количество автобусов до bus_count и возвращает их id."""
+    session = requests.Session()
+    buses = session.get(f"{host}/bus/get_all").json().get("values") or []
+    for _ in range(bus_count - len(buses)):
+        session.post(f"{host}/bus/add", json={"price": rnd.randint(25, 45)})
+    buses = session.get(f"{host}/bus/get_all").json().get("values") or []
+    return [bus["id"] for bus in buses][:bus_count]
 
-from locust import HttpUser, TaskSet, constant, tag, task
 
+@events.test_start.add_listener
+def on_test_start(environment, **kwargs):
+    options = environment.parsed_options
+    rnd.seed(options.seed)
+    if not isinstance(environment.runner, WorkerRunner):
+        FLEET[:] = seed_fleet(environment.host, options.bus_count)
+    else:
+        buses = requests.get(f"{environment.host}/bus/get_all").json().get("values") or []
+        FLEET[:] = [bus["id"] for bus in buses][:options.bus_count]
+    logging.info("Fleet ready: %d buses, profile %s", len(FLEET), options.profile)
+
+
+@events.quitting.add_listener
+def on_quitting(environment, **kwargs):
+    if isinstance(environment.runner, WorkerRunner):
+        return
+    options = environment.parsed_options
+    total = environment.stats.total
+    p99 = total.get_response_time_percentile(0.99) or 0
+    rps = total.total_rps
+    violations = []
+    if options.slo_min_rps and rps < options.slo_min_rps:
+        violations.append(f"throughput {rps:.1f} rps < {options.slo_min_rps}")
+    if options.slo_p99_ms and p99 > options.slo_p99_ms:
+        violations.append(f"p99 {p99} ms > {options.slo_p99_ms}")
+    if total.fail_ratio > options.slo_max_fail_ratio:
+        violations.append(f"fail ratio {total.fail_ratio:.3f} > {options.slo_max_fail_ratio}")
+
+    if options.json_report:
+        report = {
+            "profile": options.profile,
+            "seed": options.seed,
+            "buses": len(FLEET),
+            "finished_at": datetime.datetime.now().isoformat(),
+            "total": {
+                "requests": total.num_requests,
+                "failures": total.num_failures,
+                "rps": rps,
+                "p50_ms": total.get_response_time_percentile(0.5),
+                "p99_ms": p99,
+            },
+            "endpoints": {
+                f"{s.method} {s.name}": {
+                    "requests": s.num_requests,
+                    "failures": s.num_failures,
+                    "rps": s.total_rps,
+                    "p50_ms": s.get_response_time_percentile(0.5),
+                    "p99_ms": s.get_response_time_percentile(0.99),
+                }
+                for s in environment.stats.entries.values()
+            },
+            "slo_violations": violations,
+        }
+        with open(options.json_report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if violations:
+        logging.error("SLO missed: %s", "; ".join(violations))
+        environment.process_exit_code = 1
+    else:
+        logging.info("SLO met: %.1f rps, p99 %s ms", rps, p99)
+
+
+def rush_wait(user) -> float:
+    """Короткие паузы во время пачки проходов и длинные между пачками."""
+    options = user.environment.parsed_options
+    if time.time() % options.rush_period < options.rush_burst:
+        return rnd.uniform(0.05, 0.2)
+    return rnd.uniform(2, 5)
+
+
+def check_envelope(response, key: str = "value"):
+    if response.status_code != 200:
+        response.failure(f'status code is {response.status_code}')
+    elif response.json().get(key) is None:
+        response.failure('Error!')
+    else:
+        response.success()
+
+
+class Validator(HttpUser):
+    """Валидатор в автобусе: проходы пачками в час пик."""
+    wait_time = rush_wait
+
+    @tag("post")
+    @task(20)
+    def check_add(self):
+        options = self.environment.parsed_options
+        data = {
+            "name": f"name {rnd.randint(1, options.riders)}",
+            "bus_id": rnd.choice(FLEET),
+            "client_type": rnd.randint(1, options.client_types),
+        }
+        with self.client.post('/transactions/add', catch_response=True, json=data, name='/transactions/add') as response:
+            if response.status_code == 200:
+                value = response.json().get('value')
+                if value is not None and value > 0:
+                    response.success()
+                else:
+                    response.failure("Error!")
+            elif response.status_code == 502:
+                # Автобус ещё закрыт после предыдущего прохода - это не ошибка сервиса.
+                response.success()
+            else:
+                response.failure(f'status code is {response.status_code}')
 
-class Tests(TaskSet):
-    wait_time = constant(1)
-    
     @tag("get_id")
-    @task
+    @task(1)
     def check_get_by_id(self):
-        id = rnd.randint(1, 4)
-        with self.client.get(f'/bus/get_by_id/{id}', catch_response=True, name='/bus/get_by_id/[id]') as response:
+        bus_id = rnd.choice(FLEET)
+        with self.client.get(f'/bus/get_by_id/{bus_id}', catch_response=True, name='/bus/get_by_id/[id]') as response:
             if response.status_code == 200:
-                station = response.json().get('value')
-                if station["id"] == id:
+                bus = response.json().get('value')
+                if bus is not None and bus["id"] == bus_id:
                     response.success()
                 else:
-                    response.failure(f'bus with {id} id not found')
+                    response.failure(f'bus with {bus_id} id not found')
             else:
                 response.failure(f'status code is {response.status_code}')
 
+
+class Dashboard(HttpUser):
+    """Экран диспетчерской: периодический опрос статистики."""
+
+    def wait_time(self):
+        return self.environment.parsed_options.poll_interval
+
+    def _window(self) -> dict:
+        now = datetime.datetime.now()
+        return {
+            "bus_id": rnd.choice(FLEET),
+            "date_from": (now - datetime.timedelta(hours=1)).isoformat(),
+            "date_to": now.isoformat(),
+        }
+
+    @tag("stats")
+    @task(3)
+    def check_all_price(self):
+        with self.client.post('/stats/get_all_price', catch_response=True, json=self._window(), name='/stats/get_all_price') as response:
+            check_envelope(response)
+
+    @tag("stats")
+    @task(3)
+    def check_human_count(self):
+        with self.client.post('/stats/get_human_count', catch_response=True, json=self._window(), name='/stats/get_human_count') as response:
+            check_envelope(response)
+
+    @tag("stats")
+    @task(1)
+    def check_median_price(self):
+        with self.client.get(f'/stats/get_median_price/{rnd.choice(FLEET)}', catch_response=True, name='/stats/get_median_price/[id]') as response:
+            check_envelope(response)
+
+    @tag("get_all")
+    @task(1)
+    def check_buses(self):
+        with self.client.get('/bus/get_all', catch_response=True, name='/bus/get_all') as response:
+            check_envelope(response, 'values')
+
+
+class ExportReader(HttpUser):
+    """Выгрузка всех транзакций для отчётов."""
+    wait_time = between(10, 20)
+
     @tag("get_all")
     @task
     def check_get_all(self):
         with self.client.get('/transactions/get_all', catch_response=True, name='/transactions/get_all') as response:
-            if response.status_code == 200:
-                transactions = response.json().get('values')
-                if transactions is not None:
-                   response.success()
-                else:
-                   response.failure('Error!')
-            else:
-                response.failure(f'status code is {response.status_code}')
+            check_envelope(response, 'values')
 
-    @tag("post")
+    @tag("export")
     @task
-    def check_add(self):
-       bus_id = rnd.randint(1, 4)
-       client_type = rnd.randint(1, 4)
-       data = { "name": f"name {rnd.randint(1,50)}","bus_id": bus_id, "client_type": client_type}
-       with self.client.post('/transactions/add', catch_response=True,json=data, name='/transactions/add') as response:
-           if response.status_code == 200:
-               value = response.json().get('value')
-               if value > 0:
-                   response.success()
-               else:
-                   response.failure("Error!")
-           else:
-               response.failure(f'status code is {response.status_code}')
-
-class Website(HttpUser):
-    tasks=[Tests]
\ No newline at end of file
+    def check_export(self):
+        headers = {"Accept-Encoding": "br, gzip"}
+        with self.client.get('/transactions/export', catch_response=True, headers=headers, name='/transactions/export') as response:
+            check_envelope(response, 'values')
@@ -10,14 +10,20 @@ from sqlalchemy import (
     Column,
     Float,
     Integer,
+    case,
     delete,
     insert,
+    lambda_stmt,
     select,
     update,
 )
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
 
-from db import Base, DbResult
+from db import Base, DbResult, TableVersion
+from feed import transaction_feed
+
+
+buses_version = TableVersion("buses")
 
 
 class BusSchema(BaseModel):
@@ -26,6 +32,11 @@ class BusSchema(BaseModel):
     status: bool = Field(exclude=False, title="status")
 
 
+# Запросы строятся через lambda_stmt, кроме:
+# - add_many: ORM-вставка executemany с RETURNING из lambda_stmt не компилируется, поэтому выражение
+#   собрано один раз в ADD_MANY (ключ кэша SQLAlchemy запоминает на самом объекте);
+# - set_price_many: в CASE по WHEN на автобус, форма запроса зависит от длины списка;
+# - add_first: только начальное заполнение базы.
 # pylint: disable=E0213,C0115,C0116,W0718
 class Bus(Base):
     __tablename__ = "buses"
@@ -58,6 +69,16 @@ class Bus(Base):
         
 
 
+    async def add_many(session: AsyncSession, prices: List[float]) -> DbResult:
+        try:
+            result = await session.execute(ADD_MANY, [{"price": price, "status": True} for price in prices])
+            ids = list(result.scalars().all())
+            await session.commit()
+            return DbResult.result(ids)
+        except Exception as e:
+            await session.rollback()
+            return DbResult.error(str(e), [])
+
     def auto_open(session: AsyncSession, bus_id: int) -> DbResult:
         sleep(5)
         try:
@@ -68,7 +89,7 @@ class Bus(Base):
 
     async def get_by_id(session: AsyncSession, bus_id: int) -> DbResult:
         try:
-            result = await session.execute(select(Bus).where(Bus.id == bus_id))
+            result = await session.execute(lambda_stmt(lambda: select(Bus).where(Bus.id == bus_id)))
             data = result.scalars().first()
             await session.commit()
             return DbResult.result(data)
@@ -78,8 +99,9 @@ class Bus(Base):
     
     async def set_active(session: AsyncSession, bus_id: int, status: bool) -> DbResult:
         try:
-            await session.execute(update(Bus).where(Bus.id == bus_id).values(status=status))
+            await session.execute(lambda_stmt(lambda: update(Bus).where(Bus.id == bus_id).values(status=status)))
             await session.commit()
+            transaction_feed.publish("bus_status", {"bus_id": bus_id, "status": status})
             return DbResult.result()
         except Exception as e:
             return DbResult.error(str(e))
@@ -87,15 +109,42 @@ class Bus(Base):
     
     async def set_price(session: AsyncSession, bus_id: int, price: float) -> DbResult:
         try:
-            await session.execute(update(Bus).where(Bus.id == bus_id).values(price=price))
+            await session.execute(lambda_stmt(lambda: update(Bus).where(Bus.id == bus_id).values(price=price)))
             await session.commit()
             return DbResult.result()
         except Exception as e:
             return DbResult.error(str(e))
 
+    async def set_active_many(session: AsyncSession, bus_ids: List[int], status: bool) -> DbResult:
+        try:
+            result = await session.execute(
+                lambda_stmt(lambda: update(Bus).where(Bus.id.in_(bus_ids)).values(status=status).returning(Bus.id))
+            )
+            ids = list(result.scalars().all())
+            await session.commit()
+            for bus_id in ids:
+                transaction_feed.publish("bus_status", {"bus_id": bus_id, "status": status})
+            return DbResult.result(ids)
+        except Exception as e:
+            await session.rollback()
+            return DbResult.error(str(e), [])
+
+    async def set_price_many(session: AsyncSession, prices: dict[int, float]) -> DbResult:
+        # Один UPDATE с CASE по id: RETURNING для executemany UPDATE в SQLite не поддерживается.
+        try:
+            result = await session.execute(
+                update(Bus).where(Bus.id.in_(list(prices))).values(price=case(prices, value=Bus.id)).returning(Bus.id)
+            )
+            ids = list(result.scalars().all())
+            await session.commit()
+            return DbResult.result(ids)
+        except Exception as e:
+            await session.rollback()
+            return DbResult.error(str(e), [])
+
     async def get_all(session: AsyncSession) -> DbResult:
         try:
-            result = await session.execute(select(Bus))
+            result = await session.execute(lambda_stmt(lambda: select(Bus)))
             data = result.scalars().all()
             await session.commit()
             return DbResult.result(data)
@@ -104,7 +153,7 @@ class Bus(Base):
         
     async def delete(session: AsyncSession, id: int) -> DbResult:
         try:
-            _ = await session.execute(delete(Bus).where(Bus.id == id))
+            _ = await session.execute(lambda_stmt(lambda: delete(Bus).where(Bus.id == id)))
             await session.commit()
             return DbResult.result(True)
         except Exception as e:
@@ -131,6 +180,9 @@ class Bus(Base):
             return []
 
 
+ADD_MANY = insert(Bus).returning(Bus.id, sort_by_parameter_order=True)
+
+
 async def init_bus(engine: AsyncEngine):
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
@@ -3,10 +3,13 @@ from __future__ import annotations
 from typing import List
 
 from pydantic import BaseModel, Field
-from sqlalchemy import Column, Integer, String, insert, select, update
+from sqlalchemy import Column, Integer, String, insert, lambda_stmt, select, update
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
 
-from db import Base, DbResult
+from db import Base, DbResult, TableVersion
+
+
+client_types_version = TableVersion("client_types")
 
 
 class ClientTypeSchema(BaseModel):
@@ -37,15 +40,34 @@ class ClientType(Base):
         
     async def set_discount(session: AsyncSession, client_type: int, new_discount: float) -> DbResult:
         try:
-            await session.execute(update(ClientType).where(ClientType.id == client_type).values(discount=new_discount))
+            await session.execute(
+                lambda_stmt(lambda: update(ClientType).where(ClientType.id == client_type).values(discount=new_discount))
+            )
             await session.commit()
             return DbResult.result(True)
         except Exception as e:
             return DbResult.error(str(e),False)
 
+    async def set_discount_many(session: AsyncSession, client_types: List[int], new_discount: int) -> DbResult:
+        try:
+            result = await session.execute(
+                lambda_stmt(
+                    lambda: update(ClientType)
+                    .where(ClientType.id.in_(client_types))
+                    .values(discount=new_discount)
+                    .returning(ClientType.id)
+                )
+            )
+            ids = list(result.scalars().all())
+            await session.commit()
+            return DbResult.result(ids)
+        except Exception as e:
+            await session.rollback()
+            return DbResult.error(str(e), [])
+
     async def get_by_id(session: AsyncSession, client_type: int) -> DbResult:
         try:
-            result = await session.execute(select(ClientType).where(ClientType.id == client_type))
+            result = await session.execute(lambda_stmt(lambda: select(ClientType).where(ClientType.id == client_type)))
             data = result.scalars().first()
             await session.commit()
             return DbResult.result(data)
@@ -54,7 +76,7 @@ class ClientType(Base):
 
     async def get_all(session: AsyncSession) -> DbResult:
         try:
-            result = await session.execute(select(ClientType))
+            result = await session.execute(lambda_stmt(lambda: select(ClientType)))
             data = result.scalars().all()
             await session.commit()
             return DbResult.result(data)
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+from sqlalchemy import (
+    Column,
+    Date,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    delete,
+    func,
+    insert,
+    literal,
+    select,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import mapped_column
+
+from db import Base, DbResult
+from models.client_type import ClientType
+from models.transaction import Transaction
+
+PERIODS = ("day", "month")
+
+
+class RevenueRowSchema(BaseModel):
+    period_start: datetime.date = Field(exclude=False, title="period_start")
+    client_type: Optional[int] = Field(default=None, exclude=False, title="client_type")
+    client_name: Optional[str] = Field(default=None, exclude=False, title="client_name")
+    bus_id: Optional[int] = Field(default=None, exclude=False, title="bus_id")
+    rides: int = Field(exclude=False, title="rides")
+    revenue: float = Field(exclude=False, title="revenue")
+
+
+def period_bounds(period: str, day: datetime.date) -> tuple[datetime.date, datetime.date]:
+    """Начало периода, в который попадает day, и начало следующего."""
+    if period == "day":
+        return day, day + datetime.timedelta(days=1)
+    start = day.replace(day=1)
+    return start, (start + datetime.timedelta(days=32)).replace(day=1)
+
+
+# Запросы здесь без lambda_stmt: build выполняется раз в сутки по расписанию, а у summary
+# набор колонок зависит от group_by; выигрыш от кэша ключа на таких вызовах не виден.
+# pylint: disable=E0213,C0115,C0116,W0718
+class RevenueReport(Base):
+    """Выручка и число поездок за день или месяц по типу клиента и автобусу."""
+    __tablename__ = "revenue_reports"
+    __table_args__ = (
+        Index("ux_revenue_reports_period", "period", "period_start", "client_type", "bus_id", unique=True),
+    )
+
+    id = Column(Integer, autoincrement=True, primary_key=True)
+    period = Column(String, nullable=False)
+    period_start = Column(Date, nullable=False)
+    client_type = mapped_column(ForeignKey("client_types.id"))
+    bus_id = mapped_column(ForeignKey("buses.id"))
+    rides = Column(Integer, nullable=False)
+    revenue = Column(Float, nullable=False)
+    built_at = Column(DateTime)
+
+    async def build(session: AsyncSession, period: str, day: datetime.date) -> DbResult:
+        """Пересчитывает период целиком: старые строки удаляются в той же транзакции."""
+        try:
+            start, end = period_bounds(period, day)
+            date_from = datetime.datetime.combine(start, datetime.time())
+            date_to = datetime.datetime.combine(end, datetime.time())
+            await session.execute(
+                delete(RevenueReport).where(RevenueReport.period == period).where(RevenueReport.period_start == start)
+            )
+            rows = (
+                select(
+                    literal(period, String),
+                    literal(start, Date),
+                    Transaction.client_type,
+                    Transaction.bus_id,
+                    func.count(Transaction.id),
+                    func.total(Transaction.price),
+                    literal(datetime.datetime.now(), DateTime),
+                )
+                .where(Transaction.date >= date_from)
+                .where(Transaction.date < date_to)
+                .group_by(Transaction.client_type, Transaction.bus_id)
+            )
+            result = await session.execute(
+                insert(RevenueReport).from_select(
+                    ["period", "period_start", "client_type", "bus_id", "rides", "revenue", "built_at"], rows
+                )
+            )
+            await session.commit()
+            return DbResult.result(result.rowcount)
+        except Exception as e:
+            await session.rollback()
+            return DbResult.error(str(e))
+
+    async def summary(
+        session: AsyncSession,
+        period: str,
+        date_from: datetime.date,
+        date_to: datetime.date,
+        group_by: str,
+    ) -> DbResult:
+        """Суммы по периодам в [date_from, date_to], сгруппированные по client_type или bus."""
+        try:
+            keys = [RevenueReport.client_type, ClientType.client_name] if group_by == "client_type" else [RevenueReport.bus_id]
+            result = await session.execute(
+                select(
+                    RevenueReport.period_start,
+                    *keys,
+                    func.sum(RevenueReport.rides).label("rides"),
+                    func.total(RevenueReport.revenue).label("revenue"),
+                )
+                .outerjoin(ClientType, ClientType.id == RevenueReport.client_type)
+                .where(RevenueReport.period == period)
+                .where(RevenueReport.period_start >= date_from)
+                .where(RevenueReport.period_start <= date_to)
+                .group_by(RevenueReport.period_start, *keys)
+                .order_by(RevenueReport.period_start, *keys)
+            )
+            data = result.mappings().all()
+            await session.commit()
+            return DbResult.result(data)
+        except Exception as e:
+            return DbResult.error(str(e))
+
+    def from_list_to_schema(rows) -> List[RevenueRowSchema]:
+        try:
+            return [RevenueRowSchema(**row) for row in rows]
+        except Exception:
+            return []
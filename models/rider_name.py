@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+from typing import Optional
+
+from sqlalchemy import Column, Integer, String, lambda_stmt, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import LRUCache
+from db import Base
+
+rider_name_ids = LRUCache(maxsize=65536)
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class RiderName(Base):
+    """Словарь имён пассажиров для компактного формата таблицы transactions."""
+    __tablename__ = "rider_names"
+
+    id = Column(Integer, autoincrement=True, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+
+    async def get_id(session: AsyncSession, name: str) -> Optional[int]:
+        hit, name_id = rider_name_ids.get(name)
+        if hit:
+            return name_id
+        result = await session.execute(lambda_stmt(lambda: select(RiderName.id).where(RiderName.name == name)))
+        name_id = result.scalar_one_or_none()
+        if name_id is not None:
+            rider_name_ids.set(name, name_id)
+        return name_id
+
+    async def get_or_create_id(session: AsyncSession, name: str) -> int:
+        hit, name_id = rider_name_ids.get(name)
+        if hit:
+            return name_id
+        await session.execute(lambda_stmt(lambda: insert(RiderName).values(name=name).on_conflict_do_nothing()))
+        result = await session.execute(lambda_stmt(lambda: select(RiderName.id).where(RiderName.name == name)))
+        return result.scalar_one()
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 import datetime
-from typing import List
+import os
+from typing import List, Optional
 
 from pydantic import BaseModel, Field
 from sqlalchemy import (
@@ -9,14 +10,42 @@ from sqlalchemy import (
     DateTime,
     Float,
     ForeignKey,
+    Index,
     Integer,
     String,
+    TypeDecorator,
+    func,
+    lambda_stmt,
     select,
+    tuple_,
 )
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
-from sqlalchemy.orm import mapped_column
+from sqlalchemy.orm import column_property, mapped_column
 
-from db import Base, DbResult
+from db import Base, DbResult, from_epoch_ms, to_epoch_ms
+from models.rider_name import RiderName, rider_name_ids
+
+# "compact": дата хранится целым числом миллисекунд эпохи, имя - ссылкой на rider_names.
+COMPACT_STORAGE = os.environ.get("TRANSACTION_STORAGE") == "compact"
+
+
+class EpochMillis(TypeDecorator):
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return to_epoch_ms(value) if value is not None else None
+
+    def process_result_value(self, value, dialect):
+        return from_epoch_ms(value) if value is not None else None
+
+
+class RiderTotalsSchema(BaseModel):
+    name: str = Field(exclude=False, title="name")
+    trips: int = Field(exclude=False, title="trips")
+    spent: float = Field(exclude=False, title="spent")
+    first_trip: Optional[datetime.datetime] = Field(exclude=False, title="first_trip")
+    last_trip: Optional[datetime.datetime] = Field(exclude=False, title="last_trip")
 
 
 class TransactionSchema(BaseModel):
@@ -31,36 +60,93 @@ class TransactionSchema(BaseModel):
 # pylint: disable=E0213,C0115,C0116,W0718
 class Transaction(Base):
     __tablename__ = "transactions"
+    __table_args__ = (
+        Index("ix_transactions_client_type_date", "client_type", "date"),
+        Index("ix_transactions_bus_id_date", "bus_id", "date"),
+        Index("ix_transactions_rider_date", "name_id" if COMPACT_STORAGE else "name", "date"),
+    )
 
     id = Column(Integer, autoincrement=True, primary_key=True)
-    name = Column(String)
+    if COMPACT_STORAGE:
+        name_id = mapped_column(ForeignKey("rider_names.id"))
+        name = column_property(
+            select(RiderName.name).where(RiderName.id == name_id).correlate_except(RiderName).scalar_subquery()
+        )
+    else:
+        name = Column(String)
     client_type = mapped_column(ForeignKey("client_types.id"))
     price = Column(Float)
-    date = Column(DateTime)
+    date = Column(EpochMillis if COMPACT_STORAGE else DateTime)
     bus_id = mapped_column(ForeignKey("buses.id"))
-   
+    # Ключ из заголовка Idempotency-Key: повтор прохода не создаёт вторую запись.
+    idempotency_key = Column(String, unique=True, index=True)
+
 
     async def add(self, session: AsyncSession) -> DbResult:
         try:
+            if COMPACT_STORAGE:
+                self.name_id = await RiderName.get_or_create_id(session, self.name)
             session.add(self)
             await session.commit()
+            if COMPACT_STORAGE:
+                rider_name_ids.set(self.name, self.name_id)
             return DbResult.result(self.id)
         except Exception as e:
             await session.rollback()
             return DbResult.error(str(e), False)
 
+    async def add_many(session: AsyncSession, transactions: List[Transaction]) -> DbResult:
+        """Вставка пачки одной транзакцией; при ошибке не вставляется ничего."""
+        try:
+            if COMPACT_STORAGE:
+                for transaction in transactions:
+                    transaction.name_id = await RiderName.get_or_create_id(session, transaction.name)
+            session.add_all(transactions)
+            await session.commit()
+            if COMPACT_STORAGE:
+                for transaction in transactions:
+                    rider_name_ids.set(transaction.name, transaction.name_id)
+            return DbResult.result([transaction.id for transaction in transactions])
+        except Exception as e:
+            await session.rollback()
+            return DbResult.error(str(e), [])
+
+    async def get_existing_keys(session: AsyncSession, idempotency_keys: List[str]) -> DbResult:
+        try:
+            result = await session.execute(
+                lambda_stmt(
+                    lambda: select(Transaction.idempotency_key).where(Transaction.idempotency_key.in_(idempotency_keys))
+                )
+            )
+            data = set(result.scalars().all())
+            await session.commit()
+            return DbResult.result(data)
+        except Exception as e:
+            return DbResult.error(str(e), set())
+
     async def get_by_id(session: AsyncSession, transaction_id: int) -> DbResult:
         try:
-            result = await session.execute(select(Transaction).where(Transaction.id == transaction_id))
+            result = await session.execute(lambda_stmt(lambda: select(Transaction).where(Transaction.id == transaction_id)))
             data = result.scalars().first()
             await session.commit()
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
         
+    async def get_by_idempotency_key(session: AsyncSession, idempotency_key: str) -> DbResult:
+        try:
+            result = await session.execute(
+                lambda_stmt(lambda: select(Transaction.id).where(Transaction.idempotency_key == idempotency_key))
+            )
+            data = result.scalar_one_or_none()
+            await session.commit()
+            return DbResult.result(data)
+        except Exception as e:
+            return DbResult.error(str(e))
+
     async def get_by_bus_and_time(session: AsyncSession, bus_id: int,date_from: datetime.datetime, date_to: datetime.datetime) -> DbResult:
         try:
-            result = await session.execute(select(Transaction).where(Transaction.bus_id == bus_id).where(Transaction.date >= date_from).where(Transaction.date <= date_to))
+            result = await session.execute(lambda_stmt(lambda: select(Transaction).where(Transaction.bus_id == bus_id).where(Transaction.date >= date_from).where(Transaction.date <= date_to)))
             data = result.scalars().all()
             await session.commit()
             return DbResult.result(data)
@@ -68,42 +154,186 @@ class Transaction(Base):
             return DbResult.error(str(e))
         
     
-    async def get_by_bus(session: AsyncSession, bus_id: int) -> DbResult:
+    async def get_by_bus(
+        session: AsyncSession,
+        bus_id: int,
+        limit: Optional[int] = None,
+        cursor: Optional[int] = None,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> DbResult:
+        return await Transaction.get_page(session, Transaction.bus_id, bus_id, limit, cursor, date_from, date_to)
+
+    async def count_by_bus(
+        session: AsyncSession,
+        bus_id: int,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> DbResult:
+        return await Transaction.count(session, Transaction.bus_id, bus_id, date_from, date_to)
+
+    async def rider_filter(session: AsyncSession, name: str) -> tuple:
+        """Колонка и значение для поиска по пассажиру; в компактном формате - id из rider_names."""
+        if COMPACT_STORAGE:
+            return Transaction.name_id, await RiderName.get_id(session, name)
+        return Transaction.name, name
+
+    async def get_by_rider(
+        session: AsyncSession,
+        name: str,
+        limit: Optional[int] = None,
+        cursor: Optional[int] = None,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> DbResult:
         try:
-            result = await session.execute(select(Transaction).where(Transaction.bus_id == bus_id))
+            column, value = await Transaction.rider_filter(session, name)
+        except Exception as e:
+            return DbResult.error(str(e))
+        if value is None:
+            return DbResult.result([])
+        return await Transaction.get_page(session, column, value, limit, cursor, date_from, date_to)
+
+    async def count_by_rider(
+        session: AsyncSession,
+        name: str,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> DbResult:
+        try:
+            column, value = await Transaction.rider_filter(session, name)
+        except Exception as e:
+            return DbResult.error(str(e))
+        if value is None:
+            return DbResult.result(0)
+        return await Transaction.count(session, column, value, date_from, date_to)
+
+    async def get_rider_totals(session: AsyncSession, name: str) -> DbResult:
+        try:
+            column, value = await Transaction.rider_filter(session, name)
+            if value is None:
+                return DbResult.result(RiderTotalsSchema(name=name, trips=0, spent=0.0, first_trip=None, last_trip=None))
+            result = await session.execute(
+                lambda_stmt(
+                    lambda: select(
+                        func.count(Transaction.id),
+                        func.total(Transaction.price),
+                        func.min(Transaction.date),
+                        func.max(Transaction.date),
+                    ).where(column == value)
+                )
+            )
+            trips, spent, first_trip, last_trip = result.one()
+            await session.commit()
+            return DbResult.result(
+                RiderTotalsSchema(name=name, trips=trips, spent=spent, first_trip=first_trip, last_trip=last_trip)
+            )
+        except Exception as e:
+            return DbResult.error(str(e))
+
+    async def get_page(
+        session: AsyncSession,
+        column,
+        value: int,
+        limit: Optional[int] = None,
+        cursor: Optional[int] = None,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> DbResult:
+        """Строки с column == value от новых к старым; cursor - id последней строки предыдущей страницы.
+
+        Порядок (date, id) совпадает с индексами (client_type, date) и (bus_id, date),
+        поэтому страница читается по индексу без сортировки.
+        """
+        try:
+            query = Transaction.in_dates(lambda_stmt(lambda: select(Transaction).where(column == value)), date_from, date_to)
+            if cursor is not None:
+                query += lambda s: s.where(
+                    tuple_(Transaction.date, Transaction.id)
+                    < tuple_(select(Transaction.date).where(Transaction.id == cursor).scalar_subquery(), cursor)
+                )
+            query += lambda s: s.order_by(Transaction.date.desc(), Transaction.id.desc())
+            if limit is not None:
+                query += lambda s: s.limit(limit)
+            result = await session.execute(query)
             data = result.scalars().all()
             await session.commit()
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
-        
-    async def get_all(session: AsyncSession) -> DbResult:
+
+    async def count(
+        session: AsyncSession,
+        column,
+        value: int,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> DbResult:
         try:
-            result = await session.execute(select(Transaction))
-            data = result.scalars().all()
+            query = Transaction.in_dates(
+                lambda_stmt(lambda: select(func.count()).select_from(Transaction).where(column == value)), date_from, date_to
+            )
+            result = await session.execute(query)
+            data = result.scalar_one()
             await session.commit()
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
 
-    async def get_by_date(session: AsyncSession,date_from: datetime.datetime, date_to: datetime.datetime) -> DbResult:
+    def in_dates(query, date_from: Optional[datetime.datetime], date_to: Optional[datetime.datetime]):
+        if date_from is not None:
+            query += lambda s: s.where(Transaction.date >= date_from)
+        if date_to is not None:
+            query += lambda s: s.where(Transaction.date <= date_to)
+        return query
+
+    async def get_all(session: AsyncSession) -> DbResult:
         try:
-            result = await session.execute(select(Transaction).where(Transaction.date >= date_from).where(Transaction.date <= date_to))
+            result = await session.execute(lambda_stmt(lambda: select(Transaction)))
             data = result.scalars().all()
             await session.commit()
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
-        
 
-    async def get_by_client_type(session: AsyncSession, client_type: int) -> DbResult:
+    async def stream_all(session: AsyncSession, batch_size: int = 1000):
+        """Все транзакции от новых к старым пачками по batch_size, без загрузки всей таблицы."""
+        result = await session.stream_scalars(
+            lambda_stmt(lambda: select(Transaction).order_by(Transaction.id.desc())),
+            execution_options={"yield_per": batch_size},
+        )
+        async for partition in result.partitions():
+            yield partition
+
+    async def get_by_date(session: AsyncSession,date_from: datetime.datetime, date_to: datetime.datetime) -> DbResult:
         try:
-            result = await session.execute(select(Transaction).where(Transaction.client_type == client_type))
+            result = await session.execute(lambda_stmt(lambda: select(Transaction).where(Transaction.date >= date_from).where(Transaction.date <= date_to)))
             data = result.scalars().all()
             await session.commit()
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
+        
+
+    async def get_by_client_type(
+        session: AsyncSession,
+        client_type: int,
+        limit: Optional[int] = None,
+        cursor: Optional[int] = None,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> DbResult:
+        return await Transaction.get_page(
+            session, Transaction.client_type, client_type, limit, cursor, date_from, date_to
+        )
+
+    async def count_by_client_type(
+        session: AsyncSession,
+        client_type: int,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> DbResult:
+        return await Transaction.count(session, Transaction.client_type, client_type, date_from, date_to)
 
     def from_one_to_schema(transaction: Transaction) -> TransactionSchema:
         try:
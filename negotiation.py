@@ -0,0 +1,115 @@
+import json
+from contextvars import ContextVar
+
+import msgpack
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from compression import choose_encoding, compression_paths
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+wants_msgpack: ContextVar[bool] = ContextVar("wants_msgpack", default=False)
+
+
+def accept_qualities(accept: str) -> dict[str, float]:
+    qualities = {}
+    for item in accept.split(","):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        if not media_type:
+            continue
+        quality = next((p.partition("=")[2] for p in params if p.startswith("q=")), "1")
+        try:
+            qualities[media_type.lower()] = max(float(quality), qualities.get(media_type.lower(), 0.0))
+        except ValueError:
+            qualities[media_type.lower()] = 0.0
+    return qualities
+
+
+def accepts_msgpack(accept: str) -> bool:
+    """msgpack, если его q не ниже q для JSON (явного или через application/*, */*)."""
+    qualities = accept_qualities(accept)
+    msgpack_q = max((qualities[t] for t in MSGPACK_TYPES if t in qualities), default=0.0)
+    if msgpack_q <= 0:
+        return False
+    for json_type in ("application/json", "application/*", "*/*"):
+        if json_type in qualities:
+            return msgpack_q >= qualities[json_type]
+    return True
+
+
+def response_representation(request: Request) -> str:
+    """Формат и сжатие, которые для запроса выберут MsgPackMiddleware и CompressionMiddleware; часть ETag."""
+    media = "msgpack" if accepts_msgpack(request.headers.get("accept", "")) else "json"
+    encoding = None
+    if any(request.url.path.startswith(path) for path in compression_paths):
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+    return f"{media}-{encoding or 'identity'}"
+
+
+class NegotiatedResponse(JSONResponse):
+    """Тот же конверт ответа, но в msgpack, если клиент прислал Accept: application/msgpack."""
+
+    def render(self, content) -> bytes:
+        if wants_msgpack.get():
+            self.media_type = MSGPACK_TYPES[0]
+            return msgpack.packb(content, use_bin_type=True)
+        return super().render(content)
+
+
+class MsgPackMiddleware:
+    """Выбирает формат ответа по Accept и переводит msgpack-тело запроса в JSON для FastAPI."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        token = wants_msgpack.set(accepts_msgpack(headers.get("accept", "")))
+        try:
+            if headers.get("content-type", "").split(";")[0].strip() in MSGPACK_TYPES:
+                try:
+                    receive = await self.msgpack_body_as_json(scope, receive)
+                except (ValueError, TypeError, msgpack.UnpackException) as e:
+                    response = NegotiatedResponse(
+                        {"code": 400, "error_desc": f"Invalid msgpack body: {e}", "value": None}, status_code=400
+                    )
+                    await response(scope, receive, send)
+                    return
+
+            async def send_with_vary(message):
+                if message["type"] == "http.response.start":
+                    MutableHeaders(scope=message).add_vary_header("Accept")
+                await send(message)
+
+            await self.app(scope, receive, send_with_vary)
+        finally:
+            wants_msgpack.reset(token)
+
+    @staticmethod
+    async def msgpack_body_as_json(scope, receive):
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = json.dumps(msgpack.unpackb(b"".join(chunks), raw=False), ensure_ascii=False).encode("utf-8")
+
+        request_headers = MutableHeaders(scope=scope)
+        request_headers["content-type"] = "application/json"
+        request_headers["content-length"] = str(len(body))
+        sent = False
+
+        async def receive_json():
+            nonlocal sent
+            if sent:
+                return await receive()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        return receive_json
@@ -0,0 +1,38 @@
+from typing import Optional
+
+from fastapi import FastAPI, Response
+from pydantic import BaseModel, Field
+
+from backup import backup
+from scheduler import scheduler
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class BackupResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[str] = Field(exclude=False, title="value")
+
+    def __init__(
+        self, code: int = 200, error_desc: Optional[str] = None, value: Optional[str] = None
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value)
+
+
+def init_backup_routes(app: FastAPI):
+    @app.post("/backup/run", response_model=BackupResponse)
+    async def run_backup(
+        response: Response,
+    ):
+        if backup is None:
+            response.status_code = 400
+            return BackupResponse(code=400, error_desc="Backups are disabled: BACKUP_DIR is not set")
+        if backup.running:
+            response.status_code = 409
+            return BackupResponse(code=409, error_desc="Backup is already running")
+        try:
+            path = await scheduler.call("backup", backup.run_once)
+            return BackupResponse(code=200, value=path)
+        except Exception as e:
+            response.status_code = 500
+            return BackupResponse(code=500, error_desc=str(e))
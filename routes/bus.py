@@ -1,17 +1,39 @@
 from typing import Optional
 
-from fastapi import Depends, FastAPI, Response
+from fastapi import Depends, FastAPI, Request, Response
 from pydantic import BaseModel, Field
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db import DbResult, get_session
-from models.bus import Bus, BusSchema
+from db import DbResult, get_read_session, get_session
+from models.bus import Bus, BusSchema, buses_version
+from negotiation import response_representation
 
 
 class NewBus(BaseModel):
     price: int = Field(exclude=False, title="price")
 
 
+class NewBuses(BaseModel):
+    prices: list[int] = Field(exclude=False, title="prices", min_length=1, max_length=10000)
+
+
+class BusPrice(BaseModel):
+    id: int = Field(exclude=False, title="id")
+    price: int = Field(exclude=False, title="price")
+
+
+class BusesPrice(BaseModel):
+    # Своя цена у каждого автобуса в prices; ids с одной price - сокращение для общей цены.
+    prices: list[BusPrice] = Field(default=[], exclude=False, title="prices", max_length=10000)
+    ids: list[int] = Field(default=[], exclude=False, title="ids", max_length=10000)
+    price: Optional[int] = Field(default=None, exclude=False, title="price")
+
+
+class BusesStatus(BaseModel):
+    ids: list[int] = Field(exclude=False, title="ids", min_length=1, max_length=10000)
+    status: bool = Field(exclude=False, title="status")
+
+
 # pylint: disable=E0213,C0115,C0116,W0718
 class AddResponse(BaseModel):
     code: int = Field(exclude=False, title="code")
@@ -69,6 +91,23 @@ class BusesResponse(BaseModel):
         super().__init__(code=code, error_desc=error_desc, value=value)
 
 
+# pylint: disable=E0213,C0115,C0116,W0718
+class BulkResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[list[int]] = Field(exclude=False, title="value")
+    not_found: Optional[list[int]] = Field(exclude=False, title="not_found")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[list[int]] = [],
+        not_found: Optional[list[int]] = [],
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value, not_found=not_found)
+
+
 def init_bus_routes(app: FastAPI):
 
     @app.post(
@@ -97,7 +136,7 @@ def init_bus_routes(app: FastAPI):
     async def get_by_id(
         response: Response,
         id: int,
-        session: AsyncSession = Depends(get_session),
+        session: AsyncSession = Depends(get_read_session),
     ):
         try:
             result: DbResult = await Bus.get_by_id(session, id)
@@ -113,14 +152,20 @@ def init_bus_routes(app: FastAPI):
 
     @app.get("/bus/get_all", response_model=BusesResponse)
     async def get_all(
+        request: Request,
         response: Response,
-        session: AsyncSession = Depends(get_session),
+        session: AsyncSession = Depends(get_read_session),
     ):
         try:
+            etag = buses_version.etag(await buses_version.current(session), response_representation(request))
+            if buses_version.matches(request.headers.get("if-none-match"), etag):
+                return Response(status_code=304, headers={"ETag": etag})
             result: DbResult = await Bus.get_all(session)
             if result.is_error is True:
                 response.status_code = 500
                 return BusesResponse(code=500, error_desc=result.error_desc)
+            # ETag только у успешного ответа: конверт с ошибкой клиент кэшировать не должен.
+            response.headers["ETag"] = etag
             return BusesResponse(code=200, value=Bus.from_list_to_schema(result.value))
         except Exception as e:
             response.status_code = 500
@@ -141,4 +186,60 @@ def init_bus_routes(app: FastAPI):
             return DeleteResponse(code=200, value=result.value)
         except Exception as e:
             response.status_code = 500
-            return DeleteResponse(code=500, error_desc=str(e))
\ No newline at end of file
+            return DeleteResponse(code=500, error_desc=str(e))
+
+    @app.post("/bus/bulk_add", response_model=BulkResponse)
+    async def bulk_add(
+        response: Response,
+        data: NewBuses,
+        session: AsyncSession = Depends(get_session),
+    ):
+        try:
+            result = await Bus.add_many(session, data.prices)
+            if result.is_error is True:
+                response.status_code = 500
+                return BulkResponse(code=500, error_desc=result.error_desc)
+            return BulkResponse(code=200, value=result.value)
+        except Exception as e:
+            response.status_code = 500
+            return BulkResponse(code=500, error_desc=str(e))
+
+    @app.put("/bus/bulk_set_price", response_model=BulkResponse)
+    async def bulk_set_price(
+        response: Response,
+        data: BusesPrice,
+        session: AsyncSession = Depends(get_session),
+    ):
+        if data.ids and data.price is None:
+            response.status_code = 400
+            return BulkResponse(code=400, error_desc="ids require a price")
+        prices = {bus_id: data.price for bus_id in data.ids}
+        prices.update((item.id, item.price) for item in data.prices)
+        if not prices or len(prices) > 10000:
+            response.status_code = 400
+            return BulkResponse(code=400, error_desc="Expected 1 to 10000 buses in prices or ids")
+        try:
+            result = await Bus.set_price_many(session, prices)
+            if result.is_error is True:
+                response.status_code = 500
+                return BulkResponse(code=500, error_desc=result.error_desc)
+            return BulkResponse(code=200, value=result.value, not_found=sorted(set(prices) - set(result.value)))
+        except Exception as e:
+            response.status_code = 500
+            return BulkResponse(code=500, error_desc=str(e))
+
+    @app.put("/bus/bulk_set_status", response_model=BulkResponse)
+    async def bulk_set_status(
+        response: Response,
+        data: BusesStatus,
+        session: AsyncSession = Depends(get_session),
+    ):
+        try:
+            result = await Bus.set_active_many(session, data.ids, data.status)
+            if result.is_error is True:
+                response.status_code = 500
+                return BulkResponse(code=500, error_desc=result.error_desc)
+            return BulkResponse(code=200, value=result.value, not_found=sorted(set(data.ids) - set(result.value)))
+        except Exception as e:
+            response.status_code = 500
+            return BulkResponse(code=500, error_desc=str(e))
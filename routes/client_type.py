@@ -1,11 +1,12 @@
 from typing import Optional
 
-from fastapi import Depends, FastAPI, Response
+from fastapi import Depends, FastAPI, Request, Response
 from pydantic import BaseModel, Field
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db import DbResult, get_session
-from models.client_type import ClientType, ClientTypeSchema
+from db import DbResult, get_read_session, get_session
+from models.client_type import ClientType, ClientTypeSchema, client_types_version
+from negotiation import response_representation
 
 
 class NewValue(BaseModel):
@@ -13,6 +14,11 @@ class NewValue(BaseModel):
     new_discount: int = Field(exclude=False, title="new_discount")
 
 
+class NewValues(BaseModel):
+    ids: list[int] = Field(exclude=False, title="ids", min_length=1, max_length=10000)
+    new_discount: int = Field(exclude=False, title="new_discount")
+
+
 # pylint: disable=E0213,C0115,C0116,W0718
 class UpdateResponse(BaseModel):
     code: int = Field(exclude=False, title="code")
@@ -57,6 +63,23 @@ class ClientTypesResponse(BaseModel):
         super().__init__(code=code, error_desc=error_desc, value=value)
 
 
+# pylint: disable=E0213,C0115,C0116,W0718
+class BulkResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[list[int]] = Field(exclude=False, title="value")
+    not_found: Optional[list[int]] = Field(exclude=False, title="not_found")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[list[int]] = [],
+        not_found: Optional[list[int]] = [],
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value, not_found=not_found)
+
+
 def init_client_types_routes(app: FastAPI):
 
 
@@ -64,7 +87,7 @@ def init_client_types_routes(app: FastAPI):
     async def get_by_id(
         response: Response,
         id: int,
-        session: AsyncSession = Depends(get_session),
+        session: AsyncSession = Depends(get_read_session),
     ):
         try:
             result: DbResult = await ClientType.get_by_id(session, id)
@@ -80,14 +103,19 @@ def init_client_types_routes(app: FastAPI):
 
     @app.get("/client_types/get_all", response_model=ClientTypesResponse)
     async def get_all(
+        request: Request,
         response: Response,
-        session: AsyncSession = Depends(get_session),
+        session: AsyncSession = Depends(get_read_session),
     ):
         try:
+            etag = client_types_version.etag(await client_types_version.current(session), response_representation(request))
+            if client_types_version.matches(request.headers.get("if-none-match"), etag):
+                return Response(status_code=304, headers={"ETag": etag})
             result: DbResult = await ClientType.get_all(session)
             if result.is_error is True:
                 response.status_code = 500
                 return ClientTypesResponse(code=500, error_desc=result.error_desc)
+            response.headers["ETag"] = etag
             return ClientTypesResponse(code=200, value=ClientType.from_list_to_schema(result.value))
         except Exception as e:
             response.status_code = 500
@@ -114,7 +142,19 @@ def init_client_types_routes(app: FastAPI):
         except Exception as e:
             response.status_code = 500
             return ClientTypesResponse(code=500, error_desc=str(e))
-        
-    
 
-    
+    @app.put("/client_types/bulk_update_discount", response_model=BulkResponse)
+    async def bulk_update_discount(
+        response: Response,
+        data: NewValues,
+        session: AsyncSession = Depends(get_session),
+    ):
+        try:
+            result = await ClientType.set_discount_many(session, data.ids, data.new_discount)
+            if result.is_error is True:
+                response.status_code = 500
+                return BulkResponse(code=500, error_desc=result.error_desc)
+            return BulkResponse(code=200, value=result.value, not_found=sorted(set(data.ids) - set(result.value)))
+        except Exception as e:
+            response.status_code = 500
+            return BulkResponse(code=500, error_desc=str(e))
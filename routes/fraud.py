@@ -0,0 +1,46 @@
+from typing import Literal, Optional
+
+from fastapi import FastAPI, Query
+from pydantic import BaseModel, Field
+
+from fraud import fraud_detector
+
+
+class FraudAlertSchema(BaseModel):
+    id: int = Field(exclude=False, title="id")
+    kind: str = Field(exclude=False, title="kind")
+    name: str = Field(exclude=False, title="name")
+    bus_id: int = Field(exclude=False, title="bus_id")
+    client_type: int = Field(exclude=False, title="client_type")
+    date: str = Field(exclude=False, title="date")
+    transaction_id: Optional[int] = Field(default=None, exclude=False, title="transaction_id")
+    previous_bus_id: Optional[int] = Field(default=None, exclude=False, title="previous_bus_id")
+    seconds: Optional[float] = Field(default=None, exclude=False, title="seconds")
+    count: Optional[int] = Field(default=None, exclude=False, title="count")
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class FraudAlertsResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[list[FraudAlertSchema]] = Field(exclude=False, title="values", serialization_alias="values")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[list[FraudAlertSchema]] = [],
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value)
+
+
+def init_fraud_routes(app: FastAPI):
+
+    @app.get("/fraud/alerts", response_model=FraudAlertsResponse, response_model_exclude_none=True)
+    async def get_alerts(
+        since: int = 0,
+        limit: int = Query(default=100, ge=1, le=1000),
+        kind: Optional[Literal["bus_change", "concession_overuse"]] = None,
+    ):
+        alerts = fraud_detector.recent(since, limit, kind)
+        return FraudAlertsResponse(code=200, value=[FraudAlertSchema(**alert) for alert in alerts])
@@ -0,0 +1,60 @@
+import datetime
+from typing import Optional
+
+from fastapi import FastAPI
+from pydantic import BaseModel, Field
+
+from db import async_session
+from load import fleet_load, minute_of
+from models.bus import Bus
+from models.transaction import Transaction
+
+
+class LoadWindowSchema(BaseModel):
+    minutes: int = Field(exclude=False, title="minutes")
+    taps: int = Field(exclude=False, title="taps")
+    revenue: float = Field(exclude=False, title="revenue")
+
+
+class BusLoadSchema(BaseModel):
+    bus_id: int = Field(exclude=False, title="bus_id")
+    windows: list[LoadWindowSchema] = Field(exclude=False, title="windows")
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class FleetLoadResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[list[BusLoadSchema]] = Field(exclude=False, title="values", serialization_alias="values")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[list[BusLoadSchema]] = [],
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value)
+
+
+async def rebuild_fleet_load():
+    """Заполняет кольца проходами за последние fleet_load.slots минут, по индексу (bus_id, date) каждого автобуса."""
+    now = datetime.datetime.now()
+    since = datetime.datetime.fromtimestamp((minute_of(now) - fleet_load.slots + 1) * 60)
+    rows = []
+    async with async_session() as session:
+        buses = await Bus.get_all(session)
+        if buses.is_error is True:
+            raise RuntimeError(buses.error_desc)
+        for bus in buses.value:
+            result = await Transaction.get_by_bus_and_time(session, bus.id, since, now)
+            if result.is_error is True:
+                raise RuntimeError(result.error_desc)
+            rows.extend((t.bus_id, t.price, t.date) for t in result.value)
+    fleet_load.rebuild(rows, now)
+
+
+def init_load_routes(app: FastAPI):
+
+    @app.get("/load/fleet", response_model=FleetLoadResponse)
+    async def get_fleet_load():
+        return FleetLoadResponse(code=200, value=[BusLoadSchema(**row) for row in fleet_load.fleet()])
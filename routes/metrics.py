@@ -0,0 +1,104 @@
+from typing import Optional
+
+from fastapi import FastAPI
+from pydantic import BaseModel, Field
+
+from admission import admission
+from backup import backup, backup_latency
+from compression import compression_stats
+from db import replica, statement_cache
+from deadline import query_deadlines
+from feed import transaction_feed
+from fraud import fraud_detector
+from load import fleet_load
+from scheduler import scheduler
+from spool import tap_spool
+from routes.stats import stats_cache
+from routes.transaction import recent_taps, rider_totals
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class MetricsResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[dict] = Field(exclude=False, title="value")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[dict] = None,
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value)
+
+
+def init_metrics_routes(app: FastAPI):
+
+    @app.get("/metrics/admission", response_model=MetricsResponse)
+    async def get_admission():
+        return MetricsResponse(code=200, value=admission.stats())
+
+    @app.get("/metrics/stats_cache", response_model=MetricsResponse)
+    async def get_stats_cache():
+        return MetricsResponse(code=200, value=stats_cache.stats())
+
+    @app.get("/metrics/feed", response_model=MetricsResponse)
+    async def get_feed():
+        return MetricsResponse(code=200, value=transaction_feed.stats())
+
+    @app.get("/metrics/replica", response_model=MetricsResponse)
+    async def get_replica():
+        if replica is None:
+            return MetricsResponse(code=200, value={"enabled": False})
+        return MetricsResponse(code=200, value={"enabled": True, **replica.stats()})
+
+    @app.get("/metrics/compression", response_model=MetricsResponse)
+    async def get_compression():
+        return MetricsResponse(code=200, value={path: route.stats() for path, route in compression_stats.items()})
+
+    @app.get("/metrics/idempotency", response_model=MetricsResponse)
+    async def get_idempotency():
+        return MetricsResponse(code=200, value=recent_taps.stats())
+
+    @app.get("/metrics/jobs", response_model=MetricsResponse)
+    async def get_jobs():
+        return MetricsResponse(code=200, value=scheduler.stats())
+
+    @app.get("/metrics/statement_cache", response_model=MetricsResponse)
+    async def get_statement_cache():
+        return MetricsResponse(code=200, value=statement_cache.stats())
+
+    @app.get("/metrics/rider_totals", response_model=MetricsResponse)
+    async def get_rider_totals():
+        return MetricsResponse(code=200, value=rider_totals.stats())
+
+    @app.get("/metrics/fraud", response_model=MetricsResponse)
+    async def get_fraud():
+        return MetricsResponse(code=200, value=fraud_detector.stats())
+
+    @app.get("/metrics/spool", response_model=MetricsResponse)
+    async def get_spool():
+        if tap_spool is None:
+            return MetricsResponse(code=200, value={"enabled": False})
+        return MetricsResponse(code=200, value={"enabled": True, **tap_spool.stats()})
+
+    @app.get("/metrics/backup", response_model=MetricsResponse)
+    async def get_backup():
+        if backup is None:
+            return MetricsResponse(code=200, value={"enabled": False})
+        return MetricsResponse(code=200, value={"enabled": True, **backup.stats(), "latency": backup_latency.stats()})
+
+    @app.get("/metrics/load", response_model=MetricsResponse)
+    async def get_load():
+        return MetricsResponse(code=200, value=fleet_load.stats())
+
+    @app.get("/metrics/deadlines", response_model=MetricsResponse)
+    async def get_deadlines():
+        return MetricsResponse(code=200, value=query_deadlines.stats())
+
+    @app.get("/metrics/startup", response_model=MetricsResponse)
+    async def get_startup():
+        return MetricsResponse(code=200, value={
+            "timings_ms": {phase: seconds * 1000 for phase, seconds in app.state.startup_timings.items()},
+            "openapi": app.state.openapi_source,
+        })
@@ -0,0 +1,102 @@
+import datetime
+from typing import Literal, Optional
+
+from fastapi import Depends, FastAPI, Response
+from pydantic import BaseModel, Field
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import DbResult, async_session, get_read_session
+from models.revenue_report import PERIODS, RevenueReport, RevenueRowSchema, period_bounds
+from scheduler import scheduler
+
+
+class RecomputePeriod(BaseModel):
+    period: Literal["day", "month"] = Field(exclude=False, title="period")
+    date: datetime.date = Field(exclude=False, title="date")
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class ReportResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[list[RevenueRowSchema]] = Field(exclude=False, title="values", serialization_alias="values")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[list[RevenueRowSchema]] = [],
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value)
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class RecomputeResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[int] = Field(exclude=False, title="value")
+
+    def __init__(
+        self, code: int = 200, error_desc: Optional[str] = None, value: Optional[int] = None
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value)
+
+
+async def build_revenue_reports(day: Optional[datetime.date] = None, periods: tuple[str, ...] = PERIODS) -> int:
+    """Ночная задача: вчерашний день и его месяц (месяц пересчитывается каждую ночь до конца)."""
+    day = day or datetime.date.today() - datetime.timedelta(days=1)
+    rows = 0
+    async with async_session() as session:
+        for period in periods:
+            result: DbResult = await RevenueReport.build(session, period, day)
+            if result.is_error is True:
+                raise RuntimeError(f"{period} {day}: {result.error_desc}")
+            rows += result.value
+    return rows
+
+
+def init_report_routes(app: FastAPI):
+    async def summary(response: Response, session: AsyncSession, period: str, date_from, date_to, group_by: str):
+        try:
+            date_to = date_to or datetime.date.today()
+            date_from = period_bounds(period, date_from or date_to)[0]
+            result: DbResult = await RevenueReport.summary(session, period, date_from, date_to, group_by)
+            if result.is_error is True:
+                response.status_code = 500
+                return ReportResponse(code=500, error_desc=result.error_desc)
+            return ReportResponse(code=200, value=RevenueReport.from_list_to_schema(result.value))
+        except Exception as e:
+            response.status_code = 500
+            return ReportResponse(code=500, error_desc=str(e))
+
+    @app.get("/reports/by_client_type", response_model=ReportResponse, response_model_exclude_none=True)
+    async def get_by_client_type(
+        response: Response,
+        period: Literal["day", "month"] = "day",
+        date_from: Optional[datetime.date] = None,
+        date_to: Optional[datetime.date] = None,
+        session: AsyncSession = Depends(get_read_session),
+    ):
+        return await summary(response, session, period, date_from, date_to, "client_type")
+
+    @app.get("/reports/by_bus", response_model=ReportResponse, response_model_exclude_none=True)
+    async def get_by_bus(
+        response: Response,
+        period: Literal["day", "month"] = "day",
+        date_from: Optional[datetime.date] = None,
+        date_to: Optional[datetime.date] = None,
+        session: AsyncSession = Depends(get_read_session),
+    ):
+        return await summary(response, session, period, date_from, date_to, "bus")
+
+    @app.post("/reports/recompute", response_model=RecomputeResponse)
+    async def recompute(
+        response: Response,
+        data: RecomputePeriod,
+    ):
+        try:
+            rows = await scheduler.call("revenue_reports", build_revenue_reports, data.date, (data.period,))
+            return RecomputeResponse(code=200, value=rows)
+        except Exception as e:
+            response.status_code = 500
+            return RecomputeResponse(code=500, error_desc=str(e))
@@ -1,12 +1,15 @@
 
 import datetime
+import os
 from typing import Optional
 
-from fastapi import Depends, FastAPI, Response
+from fastapi import Depends, FastAPI, Request, Response
 from pydantic import BaseModel, Field
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db import DbResult, get_session
+from cache import QueryCache
+from db import DbResult, get_read_session
+from deadline import QueryInterrupted, query_deadlines
 from models.transaction import Transaction
 
 
@@ -29,28 +32,60 @@ class BusDateFilter(BaseModel):
     bus_id: int = Field(exclude=False, title="bus_id"),
     date_from: datetime.datetime = Field(exclude=False, title="date_from"),
     date_to: datetime.datetime = Field(exclude=False, title="date_to"),
+    allow_stale: bool = Field(default=False, exclude=False, title="allow_stale")
 
 
+stats_cache = QueryCache(
+    maxsize=int(os.environ.get("STATS_CACHE_SIZE", "1024")),
+    ttl=float(os.environ.get("STATS_CACHE_TTL", "5")),
+)
+
+
+def window_key(name: str, data: BusDateFilter, session: AsyncSession) -> tuple:
+    return (name, data.bus_id, data.date_from.isoformat(), data.date_to.isoformat(), session.info.get("snapshot", ""))
+
+
+def load_session(session: AsyncSession) -> AsyncSession:
+    """Своя сессия общей загрузки: начавший её запрос может уйти и закрыть свою раньше остальных ждущих."""
+    return AsyncSession(session.bind, expire_on_commit=False)
+
+
+def is_cacheable(data: BusDateFilter) -> bool:
+    # Окно, захватывающее текущий момент, ещё пополняется новыми проходами.
+    return data.allow_stale or data.date_to < datetime.datetime.now(data.date_to.tzinfo)
+
 
 def init_stats_routes(app: FastAPI):
 
 
     @app.post("/stats/get_all_price", response_model=StatsResponse)
     async def get_all_price(
+        request: Request,
         response: Response,
         data: BusDateFilter,
-        session: AsyncSession = Depends(get_session),
+        session: AsyncSession = Depends(get_read_session),
     ):
-        try:
-            result_trans: DbResult = await Transaction.get_by_bus_and_time(session,data.bus_id,data.date_from,data.date_to)
+        async def load() -> DbResult:
+            async with load_session(session) as own:
+                result_trans: DbResult = await Transaction.get_by_bus_and_time(own,data.bus_id,data.date_from,data.date_to)
             if result_trans.is_error is True:
-                response.status_code = 500
-                return StatsResponse(code=500, error_desc=result_trans.error_desc)
+                return result_trans
             transactions: list[Transaction] = result_trans.value
             price = 0.0
             for transaction in transactions:
                 price += transaction.price
-            return StatsResponse(code=200, value=price)
+            return DbResult.result(price)
+
+        try:
+            async with query_deadlines.guard(request):
+                result: DbResult = await stats_cache.get_or_load(window_key("all_price", data, session), load, is_cacheable(data))
+            if result.is_error is True:
+                response.status_code = 500
+                return StatsResponse(code=500, error_desc=result.error_desc)
+            return StatsResponse(code=200, value=result.value)
+        except QueryInterrupted as e:
+            response.status_code = 504
+            return StatsResponse(code=504, error_desc=str(e))
         except Exception as e:
             response.status_code = 500
             return StatsResponse(code=500, error_desc=str(e))
@@ -58,22 +93,35 @@ def init_stats_routes(app: FastAPI):
     
     @app.get("/stats/get_median_price/{id}", response_model=StatsResponse)
     async def get_median_price(
+        request: Request,
         response: Response,
         id: int,
-        session: AsyncSession = Depends(get_session),
+        allow_stale: bool = False,
+        session: AsyncSession = Depends(get_read_session),
     ):
-        try:
-            result_trans: DbResult = await Transaction.get_by_bus(session,id)
+        async def load() -> DbResult:
+            async with load_session(session) as own:
+                result_trans: DbResult = await Transaction.get_by_bus(own,id)
             if result_trans.is_error is True:
-                response.status_code = 500
-                return StatsResponse(code=500, error_desc=result_trans.error_desc)
+                return result_trans
             transactions: list[Transaction] = result_trans.value
             price = 0.0
             for transaction in transactions:
                 price += transaction.price
             if len(transactions):
                 price /= len(transactions)
-            return StatsResponse(code=200, value=price)
+            return DbResult.result(price)
+
+        try:
+            async with query_deadlines.guard(request):
+                result: DbResult = await stats_cache.get_or_load(("median_price", id, session.info.get("snapshot", "")), load, allow_stale)
+            if result.is_error is True:
+                response.status_code = 500
+                return StatsResponse(code=500, error_desc=result.error_desc)
+            return StatsResponse(code=200, value=result.value)
+        except QueryInterrupted as e:
+            response.status_code = 504
+            return StatsResponse(code=504, error_desc=str(e))
         except Exception as e:
             response.status_code = 500
             return StatsResponse(code=500, error_desc=str(e))
@@ -81,19 +129,31 @@ def init_stats_routes(app: FastAPI):
         
     @app.post("/stats/get_human_count", response_model=StatsResponse)
     async def get_human_count(
+        request: Request,
         response: Response,
         data: BusDateFilter,
-        session: AsyncSession = Depends(get_session),
+        session: AsyncSession = Depends(get_read_session),
     ):
-        try:
-            result_trans: DbResult = await Transaction.get_by_bus_and_time(session,data.bus_id,data.date_from,data.date_to)
+        async def load() -> DbResult:
+            async with load_session(session) as own:
+                result_trans: DbResult = await Transaction.get_by_bus_and_time(own,data.bus_id,data.date_from,data.date_to)
             if result_trans.is_error is True:
-                response.status_code = 500
-                return StatsResponse(code=500, error_desc=result_trans.error_desc)
+                return result_trans
             transactions: list[Transaction] = result_trans.value
             date = data.date_to - data.date_from
             power = len(transactions)/(date.total_seconds()/60/60)
-            return StatsResponse(code=200, value=power)
+            return DbResult.result(power)
+
+        try:
+            async with query_deadlines.guard(request):
+                result: DbResult = await stats_cache.get_or_load(window_key("human_count", data, session), load, is_cacheable(data))
+            if result.is_error is True:
+                response.status_code = 500
+                return StatsResponse(code=500, error_desc=result.error_desc)
+            return StatsResponse(code=200, value=result.value)
+        except QueryInterrupted as e:
+            response.status_code = 504
+            return StatsResponse(code=504, error_desc=str(e))
         except Exception as e:
             response.status_code = 500
             return StatsResponse(code=500, error_desc=str(e))   
@@ -1,15 +1,29 @@
+import asyncio
 import datetime
+import json
+import os
 import threading
 from typing import Optional
 
-from fastapi import Depends, FastAPI, Response
+from fastapi import Depends, FastAPI, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db import DbResult, get_session
+from analytics.columns import column_store
+from cache import QueryCache
+from db import DbResult, async_session, get_read_session, get_session
+from deadline import QueryInterrupted, query_deadlines, wait_disconnect
+from feed import transaction_feed
+from fraud import fraud_detector
+from load import fleet_load
 from models.bus import Bus
 from models.client_type import ClientType
-from models.transaction import Transaction, TransactionSchema
+from models.transaction import RiderTotalsSchema, Transaction, TransactionSchema
+from spool import tap_spool
+
+
+MAX_PAGE_SIZE = 1000
 
 
 class NewTransaction(BaseModel):
@@ -61,6 +75,200 @@ class TransactionsResponse(BaseModel):
         super().__init__(code=code, error_desc=error_desc, value=value)
 
 
+# pylint: disable=E0213,C0115,C0116,W0718
+class TransactionPageResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[list[TransactionSchema]] = Field(exclude=False, title="values", serialization_alias="values")
+    next_cursor: Optional[int] = Field(exclude=False, title="next_cursor")
+    count: Optional[int] = Field(exclude=False, title="count")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[list[TransactionSchema]] = None,
+        next_cursor: Optional[int] = None,
+        count: Optional[int] = None,
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value, next_cursor=next_cursor, count=count)
+
+
+class PageParams:
+    """Параметры выборки: без limit возвращаются все строки, как раньше."""
+
+    def __init__(
+        self,
+        limit: Optional[int] = Query(default=None, ge=1, le=MAX_PAGE_SIZE),
+        cursor: Optional[int] = None,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+        count_only: bool = False,
+    ):
+        self.limit = limit
+        self.cursor = cursor
+        self.date_from = date_from
+        self.date_to = date_to
+        self.count_only = count_only
+
+
+async def read_page(get_page, count, params: PageParams) -> TransactionPageResponse:
+    """Страница строк от новых к старым или только их число (count_only)."""
+    if params.count_only:
+        result: DbResult = await count(params.date_from, params.date_to)
+        if result.is_error is True:
+            return TransactionPageResponse(code=500, error_desc=result.error_desc)
+        return TransactionPageResponse(code=200, count=result.value)
+    result: DbResult = await get_page(params.limit, params.cursor, params.date_from, params.date_to)
+    if result.is_error is True:
+        return TransactionPageResponse(code=500, error_desc=result.error_desc)
+    rows = result.value
+    next_cursor = rows[-1].id if params.limit is not None and len(rows) == params.limit else None
+    return TransactionPageResponse(code=200, value=Transaction.from_list_to_schema(rows), next_cursor=next_cursor)
+
+
+recent_taps = QueryCache(
+    maxsize=int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", "65536")),
+    ttl=float(os.environ.get("IDEMPOTENCY_CACHE_TTL", "86400")),
+)
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class RiderTotalsResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[RiderTotalsSchema] = Field(exclude=False, title="value")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[RiderTotalsSchema] = None,
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value)
+
+
+# Итоги по пассажиру; запись сбрасывается при каждом новом проходе этого пассажира.
+rider_totals = QueryCache(
+    maxsize=int(os.environ.get("RIDER_TOTALS_CACHE_SIZE", "4096")),
+    ttl=float(os.environ.get("RIDER_TOTALS_CACHE_TTL", "3600")),
+)
+
+
+def on_tap(transaction: Transaction):
+    rider_totals.invalidate(transaction.name)
+    transaction_feed.publish("transaction", Transaction.from_one_to_schema(transaction).model_dump(mode="json"))
+    for alert in fraud_detector.observe(
+        transaction.name, transaction.bus_id, transaction.client_type, transaction.date, transaction.id
+    ):
+        transaction_feed.publish("fraud_alert", alert)
+    fleet_load.record(transaction.bus_id, transaction.price, transaction.date)
+    if column_store is not None:
+        column_store.append(
+            transaction.id, transaction.bus_id, transaction.client_type, transaction.price, transaction.date
+        )
+
+
+async def tap(session: AsyncSession, data: NewTransaction, idempotency_key: Optional[str] = None) -> DbResult:
+    """Проход по карте. Ошибка возвращается как DbResult.error с готовым AddResponse в value."""
+    if idempotency_key is not None:
+        existing = await Transaction.get_by_idempotency_key(session, idempotency_key)
+        if not existing.is_error and existing.value is not None:
+            return DbResult.result(existing.value)
+
+    bus_result = await Bus.get_by_id(session,data.bus_id)
+    if not bus_result.is_error:
+        if bus_result.value.status is False:
+            return DbResult.error(value=AddResponse(code=502, error_desc="Bus status is false"))
+
+    client_result = await ClientType.get_by_id(session,data.client_type)
+    if client_result.is_error:
+        return DbResult.error(value=AddResponse(code=500, error_desc="Client Not Found"))
+
+    new_transaction = Transaction()
+    new_transaction.name = data.name
+    new_transaction.client_type = data.client_type
+    new_transaction.price = bus_result.value.price * (100-client_result.value.discount)/100
+    new_transaction.date = datetime.datetime.now()
+    new_transaction.bus_id = data.bus_id
+    new_transaction.idempotency_key = idempotency_key
+    result = await new_transaction.add(session)
+    if result.is_error is True:
+        if idempotency_key is not None:
+            # Тот же ключ успел записать другой процесс: отдаём его проход.
+            existing = await Transaction.get_by_idempotency_key(session, idempotency_key)
+            if not existing.is_error and existing.value is not None:
+                return DbResult.result(existing.value)
+        return DbResult.error(value=AddResponse(code=500, error_desc=result.error_desc))
+    on_tap(new_transaction)
+
+    await Bus.set_active(session,new_transaction.bus_id,False)
+
+    thread = threading.Thread(target=Bus.auto_open,args=(session,data.bus_id,))
+    thread.start()
+    return DbResult.result(result.value)
+
+
+async def spool_tap(data: NewTransaction, idempotency_key: Optional[str] = None) -> DbResult:
+    """Проход в журнал: ответ сразу после fsync, цена и запись в базу - при переносе."""
+    seq = await tap_spool.append({
+        "name": data.name,
+        "client_type": data.client_type,
+        "bus_id": data.bus_id,
+        "date": datetime.datetime.now().isoformat(),
+        "idempotency_key": idempotency_key,
+    })
+    return DbResult.result(seq)
+
+
+async def apply_spooled(records: list[dict]) -> int:
+    """Переносит пачку из журнала в transactions. Возвращает число отброшенных записей.
+
+    Уже вставленные ключи пропускаются, поэтому повтор пачки после падения безопасен.
+    Ошибка базы пробрасывается: пачка останется в журнале и будет повторена.
+    """
+    async with async_session() as session:
+        keys = [record.get("idempotency_key") or f"spool:{record['seq']}" for record in records]
+        existing: DbResult = await Transaction.get_existing_keys(session, keys)
+        if existing.is_error is True:
+            raise RuntimeError(existing.error_desc)
+        prices: dict[tuple[int, int], Optional[float]] = {}
+        transactions = []
+        rejected = 0
+        for record, key in zip(records, keys):
+            if key in existing.value:
+                continue
+            existing.value.add(key)
+            price_key = (record["bus_id"], record["client_type"])
+            if price_key not in prices:
+                bus_result = await Bus.get_by_id(session, record["bus_id"])
+                client_result = await ClientType.get_by_id(session, record["client_type"])
+                if bus_result.is_error or client_result.is_error:
+                    raise RuntimeError(bus_result.error_desc or client_result.error_desc)
+                prices[price_key] = (
+                    bus_result.value.price * (100 - client_result.value.discount) / 100
+                    if bus_result.value is not None and client_result.value is not None else None
+                )
+            if prices[price_key] is None:
+                rejected += 1
+                continue
+            new_transaction = Transaction()
+            new_transaction.name = record["name"]
+            new_transaction.client_type = record["client_type"]
+            new_transaction.price = prices[price_key]
+            new_transaction.date = datetime.datetime.fromisoformat(record["date"])
+            new_transaction.bus_id = record["bus_id"]
+            new_transaction.idempotency_key = key
+            transactions.append(new_transaction)
+        if transactions:
+            result = await Transaction.add_many(session, transactions)
+            if result.is_error is True:
+                raise RuntimeError(result.error_desc)
+    for transaction in transactions:
+        on_tap(transaction)
+    return rejected
+
+
 def init_transactions_routes(app: FastAPI):
     @app.post(
         "/transactions/add", response_model=AddResponse, response_model_exclude_none=True
@@ -69,38 +277,22 @@ def init_transactions_routes(app: FastAPI):
         response: Response,
         data: NewTransaction,
         session: AsyncSession = Depends(get_session),
+        idempotency_key: Optional[str] = Header(default=None),
     ):
-        try:            
-            bus_result = await Bus.get_by_id(session,data.bus_id)
-            if not bus_result.is_error:
-
-                if bus_result.value.status is False:
-                    response.status_code = 502
-                    return AddResponse(code=502, error_desc="Bus status is false")
-                
-
-            client_result = await ClientType.get_by_id(session,data.client_type)
-            if client_result.is_error:
-                response.status_code = 500
-                return AddResponse(code=500, error_desc="Client Not Found")
-            
-            new_transaction = Transaction()
-            new_transaction.name = data.name
-            new_transaction.client_type = data.client_type
-            new_transaction.price = bus_result.value.price * (100-client_result.value.discount)/100
-            new_transaction.date = datetime.datetime.now()
-            new_transaction.bus_id = data.bus_id
-            result = await new_transaction.add(session)
+        # С журналом ответ 202, а value - номер записи в журнале, а не id транзакции.
+        accept = (lambda key: spool_tap(data, key)) if tap_spool is not None else (lambda key: tap(session, data, key))
+        try:
+            if idempotency_key is None:
+                result = await accept(None)
+            else:
+                # Повтор с тем же ключом получает исходный ответ из кэша; одновременные повторы ждут первый.
+                result = await recent_taps.get_or_load(idempotency_key, lambda: accept(idempotency_key))
             if result.is_error is True:
-                response.status_code = 500
-                return AddResponse(code=500, error_desc=result.error_desc)
-
-
-            await Bus.set_active(session,new_transaction.bus_id,False)
-
-        
-            thread = threading.Thread(target=Bus.auto_open,args=(session,data.bus_id,))
-            thread.start()
+                response.status_code = result.value.code
+                return result.value
+            if tap_spool is not None:
+                response.status_code = 202
+                return AddResponse(code=202, value=result.value)
             return AddResponse(code=200, value=result.value)
         except Exception as e:
             response.status_code = 500
@@ -110,7 +302,7 @@ def init_transactions_routes(app: FastAPI):
     async def get_by_id(
         response: Response,
         id: int,
-        session: AsyncSession = Depends(get_session),
+        session: AsyncSession = Depends(get_read_session),
     ):
         try:
             result: DbResult = await Transaction.get_by_id(session, id)
@@ -122,35 +314,150 @@ def init_transactions_routes(app: FastAPI):
             response.status_code = 500
             return TransactionResponse(code=500, error_desc=str(e))
 
-    @app.get("/transactions/get_by_client_type/{id}", response_model=TransactionResponse)
+    @app.get(
+        "/transactions/get_by_client_type/{id}", response_model=TransactionPageResponse, response_model_exclude_none=True
+    )
     async def get_by_client_type(
         response: Response,
         id: int,
+        params: PageParams = Depends(),
+        session: AsyncSession = Depends(get_read_session),
+    ):
+        try:
+            result = await read_page(
+                lambda *page: Transaction.get_by_client_type(session, id, *page),
+                lambda *dates: Transaction.count_by_client_type(session, id, *dates),
+                params,
+            )
+            response.status_code = result.code
+            return result
+        except Exception as e:
+            response.status_code = 500
+            return TransactionPageResponse(code=500, error_desc=str(e))
+
+    @app.get(
+        "/transactions/get_by_bus/{id}", response_model=TransactionPageResponse, response_model_exclude_none=True
+    )
+    async def get_by_bus(
+        response: Response,
+        id: int,
+        params: PageParams = Depends(),
+        session: AsyncSession = Depends(get_read_session),
+    ):
+        try:
+            result = await read_page(
+                lambda *page: Transaction.get_by_bus(session, id, *page),
+                lambda *dates: Transaction.count_by_bus(session, id, *dates),
+                params,
+            )
+            response.status_code = result.code
+            return result
+        except Exception as e:
+            response.status_code = 500
+            return TransactionPageResponse(code=500, error_desc=str(e))
+
+    @app.get(
+        "/transactions/get_by_rider", response_model=TransactionPageResponse, response_model_exclude_none=True
+    )
+    async def get_by_rider(
+        response: Response,
+        name: str,
+        params: PageParams = Depends(),
+        session: AsyncSession = Depends(get_read_session),
+    ):
+        try:
+            result = await read_page(
+                lambda *page: Transaction.get_by_rider(session, name, *page),
+                lambda *dates: Transaction.count_by_rider(session, name, *dates),
+                params,
+            )
+            response.status_code = result.code
+            return result
+        except Exception as e:
+            response.status_code = 500
+            return TransactionPageResponse(code=500, error_desc=str(e))
+
+    @app.get("/transactions/rider_totals", response_model=RiderTotalsResponse)
+    async def get_rider_totals(
+        response: Response,
+        name: str,
         session: AsyncSession = Depends(get_session),
     ):
+        # Из основной базы: сброс кэша в on_tap должен сразу давать свежие итоги.
         try:
-            result: DbResult = await Transaction.get_by_client_type(session, id)
+            result: DbResult = await rider_totals.get_or_load(name, lambda: Transaction.get_rider_totals(session, name))
             if result.is_error is True:
                 response.status_code = 500
-                return TransactionResponse(code=500, error_desc=result.error_desc)
-            return TransactionResponse(code=200, value=Transaction.from_one_to_schema(result.value))
+                return RiderTotalsResponse(code=500, error_desc=result.error_desc)
+            return RiderTotalsResponse(code=200, value=result.value)
         except Exception as e:
             response.status_code = 500
-            return TransactionResponse(code=500, error_desc=str(e))
-
+            return RiderTotalsResponse(code=500, error_desc=str(e))
 
     @app.get("/transactions/get_all", response_model=TransactionsResponse)
     async def get_all(
+        request: Request,
         response: Response,
-        session: AsyncSession = Depends(get_session),
+        session: AsyncSession = Depends(get_read_session),
     ):
         try:
-            result: DbResult = await Transaction.get_all(session)
+            async with query_deadlines.guard(request):
+                result: DbResult = await Transaction.get_all(session)
             if result.is_error is True:
                 response.status_code = 500
                 return TransactionsResponse(code=500, error_desc=result.error_desc)
             result.value.reverse()
             return TransactionsResponse(code=200, value=Transaction.from_list_to_schema(result.value))
+        except QueryInterrupted as e:
+            response.status_code = 504
+            return TransactionsResponse(code=504, error_desc=str(e))
         except Exception as e:
             response.status_code = 500
             return TransactionsResponse(code=500, error_desc=str(e))
+
+    @app.get("/transactions/export")
+    async def export(
+        session: AsyncSession = Depends(get_read_session),
+    ):
+        # Тот же конверт, что у /transactions/get_all, но строки уходят клиенту по мере чтения.
+        async def body():
+            yield '{"code":200,"error_desc":null,"values":['
+            first = True
+            async for partition in Transaction.stream_all(session):
+                rows = ",".join(
+                    Transaction.from_one_to_schema(transaction).model_dump_json() for transaction in partition
+                )
+                if rows:
+                    yield rows if first else "," + rows
+                    first = False
+            yield "]}"
+
+        return StreamingResponse(body(), media_type="application/json")
+
+    @app.get("/transactions/stream")
+    async def stream(
+        request: Request,
+        bus_id: Optional[int] = None,
+        client_type: Optional[int] = None,
+    ):
+        async def events():
+            # Подписка внутри генератора: если клиент ушёл до начала отправки, отписываться не от чего.
+            subscriber = transaction_feed.subscribe(bus_id, client_type)
+            disconnected = asyncio.ensure_future(wait_disconnect(request))
+            try:
+                while True:
+                    waiting = asyncio.ensure_future(subscriber.wait(timeout=15))
+                    await asyncio.wait((waiting, disconnected), return_when=asyncio.FIRST_COMPLETED)
+                    if disconnected.done():
+                        waiting.cancel()
+                        return
+                    batch = waiting.result()
+                    if not batch:
+                        yield ": keepalive\n\n"
+                    for kind, payload in batch:
+                        yield f"event: {kind}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+            finally:
+                disconnected.cancel()
+                transaction_feed.unsubscribe(subscriber)
+
+        return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
@@ -0,0 +1,119 @@
+import asyncio
+import datetime
+import os
+import time
+from typing import Awaitable, Callable, Optional
+
+from dotenv import load_dotenv
+
+
+dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
+if os.path.exists(dotenv_path):
+    load_dotenv(dotenv_path)
+
+
+def daily_at(at: str) -> Callable[[datetime.datetime], datetime.datetime]:
+    """Расписание "раз в сутки в HH:MM" по местному времени сервиса."""
+    hour, minute = (int(part) for part in at.split(":"))
+
+    def next_run(now: datetime.datetime) -> datetime.datetime:
+        run_at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        return run_at if run_at > now else run_at + datetime.timedelta(days=1)
+
+    return next_run
+
+
+def every(seconds: float) -> Callable[[datetime.datetime], datetime.datetime]:
+    def next_run(now: datetime.datetime) -> datetime.datetime:
+        return now + datetime.timedelta(seconds=seconds)
+
+    return next_run
+
+
+class Job:
+    def __init__(self, name: str, schedule: Callable[[datetime.datetime], datetime.datetime], fn: Callable[..., Awaitable]):
+        self.name = name
+        self.schedule = schedule
+        self.fn = fn
+        self.runs = 0
+        self.failures = 0
+        self.running = False
+        self.last_error = ""
+        self.last_started: Optional[datetime.datetime] = None
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.next_run: Optional[datetime.datetime] = None
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "failures": self.failures,
+            "running": self.running,
+            "last_error": self.last_error,
+            "last_started": self.last_started.isoformat() if self.last_started else None,
+            "last_duration": self.last_duration,
+            "max_duration": self.max_duration,
+            "mean_duration": self.total_duration / self.runs if self.runs else None,
+            "next_run": self.next_run.isoformat() if self.next_run else None,
+        }
+
+
+class JobScheduler:
+    """Фоновые задачи по расписанию внутри цикла событий сервиса.
+
+    Запуск по расписанию и ручной запуск (run_now) проходят через один и тот же
+    учёт длительности; ошибка задачи не останавливает планировщик.
+    """
+
+    def __init__(self):
+        self.jobs: dict[str, Job] = {}
+
+    def add(self, name: str, schedule: Callable[[datetime.datetime], datetime.datetime], fn: Callable[..., Awaitable]):
+        self.jobs[name] = Job(name, schedule, fn)
+
+    async def run_now(self, name: str, *args):
+        job = self.jobs[name]
+        job.running = True
+        job.last_started = datetime.datetime.now()
+        started = time.perf_counter()
+        try:
+            return await job.fn(*args)
+        except Exception as e:
+            job.failures += 1
+            job.last_error = str(e)
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            job.running = False
+            job.runs += 1
+            job.last_duration = duration
+            job.max_duration = max(job.max_duration, duration)
+            job.total_duration += duration
+
+    async def call(self, name: str, fn: Callable[..., Awaitable], *args):
+        """Ручной запуск: через учёт задачи, если она зарегистрирована, иначе просто fn."""
+        if name in self.jobs:
+            return await self.run_now(name, *args)
+        return await fn(*args)
+
+    async def run(self):
+        while self.jobs:
+            now = datetime.datetime.now()
+            for job in self.jobs.values():
+                if job.next_run is None:
+                    job.next_run = job.schedule(now)
+            job = min(self.jobs.values(), key=lambda j: j.next_run)
+            await asyncio.sleep(max(0.0, (job.next_run - datetime.datetime.now()).total_seconds()))
+            job.next_run = None
+            try:
+                await self.run_now(job.name)
+            except Exception:
+                pass
+
+    def stats(self) -> dict:
+        return {name: job.stats() for name, job in self.jobs.items()}
+
+
+scheduler = JobScheduler()
+reports_at = os.environ.get("REPORTS_AT", "00:05")
@@ -1,5 +1,16 @@
+import asyncio
+import glob
+import hashlib
+import importlib
+import json
 import os
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Optional
 
+import fastapi
+import pydantic
 import uvicorn
 from dotenv import load_dotenv
 from fastapi import FastAPI
@@ -8,56 +19,251 @@ from fastapi.openapi.utils import get_openapi
 from fastapi_async_sqlalchemy import SQLAlchemyMiddleware
 from sqlalchemy.ext.asyncio import AsyncEngine
 
-from db import engine
-from models.bus import Bus, init_bus
-from models.client_type import ClientType, init_client_type
-from models.transaction import init_transaction
-from routes.bus import init_bus_routes
-
-# pylint: disable=E0401
-from routes.client_type import init_client_types_routes
-from routes.stats import init_stats_routes
-from routes.transaction import init_transactions_routes
-
 dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
 if os.path.exists(dotenv_path):
     load_dotenv(dotenv_path)
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# Модули маршрутов и подсистем (база, журнал, планировщик, снимки) импортируются только в функциях,
+# которым они нужны: импорт service не создаёт движки и синглтоны до сборки приложения.
+ROUTES = (
+    ("routes.client_type", "init_client_types_routes"),
+    ("routes.bus", "init_bus_routes"),
+    ("routes.transaction", "init_transactions_routes"),
+    ("routes.stats", "init_stats_routes"),
+    ("routes.report", "init_report_routes"),
+    ("routes.fraud", "init_fraud_routes"),
+    ("routes.backup", "init_backup_routes"),
+    ("routes.load", "init_load_routes"),
+    ("routes.metrics", "init_metrics_routes"),
+)
 
 
-app = FastAPI()
+class Settings:
+    """Параметры сборки приложения. Settings.from_env() - как у сервиса, тесты собирают свои.
 
-origins = ["*"]
+    Базы здесь нет: движки и сессии создаёт db.py из DATABASE_URL и
+    DATABASE_READ_URL окружения, SQLAlchemyMiddleware получает тот же engine.
+    """
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+    def __init__(
+        self,
+        cors_origins: tuple[str, ...] = ("*",),
+        admission: bool = True,
+        latency_probe: bool = True,
+        compression_minimum_size: Optional[int] = None,
+        background: bool = True,
+        openapi_cache: Optional[str] = None,
+        routes: tuple[tuple[str, str], ...] = ROUTES,
+    ):
+        self.cors_origins = cors_origins
+        self.admission = admission
+        self.latency_probe = latency_probe
+        self.compression_minimum_size = compression_minimum_size
+        self.background = background
+        self.openapi_cache = openapi_cache
+        self.routes = routes
+
+    @staticmethod
+    def from_env() -> "Settings":
+        return Settings(
+            openapi_cache=os.environ.get("OPENAPI_CACHE", os.path.join(BASE_DIR, ".openapi.json")) or None,
+        )
+
+
+@contextmanager
+def timed(timings: dict, phase: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = time.perf_counter() - started
+
+
+def source_hash(routes) -> str:
+    """Ключ кэша OpenAPI: исходники сервиса, версии fastapi/pydantic и набор маршрутов."""
+    digest = hashlib.sha256(f"{fastapi.__version__} {pydantic.VERSION} {routes!r}".encode())
+    for pattern in ("*.py", "routes/*.py", "models/*.py"):
+        for path in sorted(glob.glob(os.path.join(BASE_DIR, pattern))):
+            digest.update(os.path.relpath(path, BASE_DIR).encode())
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
 
 
-app.add_middleware(SQLAlchemyMiddleware, db_url=os.environ["DATABASE_URL"])
+def save_openapi_cache(path: str, cached: dict):
+    """Запись через свой временный файл: воркеры, стартующие одновременно, не пишут в один и тот же .tmp."""
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path), suffix=".tmp")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(cached, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
 
+def cached_openapi(app: FastAPI, settings: Settings) -> Callable[[], dict]:
+    """Схема строится при первом обращении и кладётся в файл; пока исходники не менялись, берётся из него."""
 
-def custom_openapi():
-    if app.openapi_schema:
+    def openapi() -> dict:
+        if app.openapi_schema:
+            return app.openapi_schema
+        with timed(app.state.startup_timings, "openapi"):
+            key = source_hash(settings.routes) if settings.openapi_cache else None
+            if key is not None and os.path.exists(settings.openapi_cache):
+                try:
+                    with open(settings.openapi_cache, encoding="utf-8") as f:
+                        cached = json.load(f)
+                    if cached.get("key") == key:
+                        app.openapi_schema = cached["schema"]
+                        app.state.openapi_source = "cache"
+                except (OSError, ValueError):
+                    pass
+            if not app.openapi_schema:
+                app.openapi_schema = get_openapi(
+                    title="Оплата проезда",
+                    version="2.5.0",
+                    summary="----------",
+                    description="Бэкэнд сервиса по оплате проезда",
+                    routes=app.routes,
+                )
+                app.state.openapi_source = "generated"
+                if key is not None:
+                    save_openapi_cache(settings.openapi_cache, {"key": key, "schema": app.openapi_schema})
         return app.openapi_schema
-    openapi_schema = get_openapi(
-        title="Оплата проезда",
-        version="2.5.0",
-        summary="----------",
-        description="Бэкэнд сервиса по оплате проезда",
-        routes=app.routes,
-    )
-    return openapi_schema
+
+    return openapi
+
+
+def timed_startup(timings: dict, name: str, fn: Callable[[], Awaitable]) -> Callable[[], Awaitable]:
+    async def handler():
+        with timed(timings, f"startup.{name}"):
+            await fn()
+
+    return handler
+
+
+def add_background_tasks(app: FastAPI):
+    # pylint: disable=C0415
+    from backup import backup, backup_interval
+    from db import replica
+    from routes.report import build_revenue_reports
+    from scheduler import daily_at, every, reports_at, scheduler
+    from spool import tap_spool
+
+    scheduler.add("revenue_reports", daily_at(reports_at), build_revenue_reports)
+    if backup is not None:
+        scheduler.add("backup", every(backup_interval), backup.run_once)
+
+    async def start_fleet_load():
+        from routes.load import rebuild_fleet_load  # pylint: disable=C0415
+
+        # До запуска переноса из журнала: иначе перенесённый проход посчитается и в on_tap, и при чтении из базы.
+        await rebuild_fleet_load()
+
+    async def start_replica_sync():
+        if replica is not None and not replica.external:
+            app.state.replica_task = asyncio.create_task(replica.run())
+
+    async def start_tap_spool():
+        from routes.transaction import apply_spooled  # pylint: disable=C0415
+
+        if tap_spool is not None:
+            tap_spool.open()
+            app.state.spool_tasks = [
+                asyncio.create_task(tap_spool.run_fsync()),
+                asyncio.create_task(tap_spool.run_drainer(apply_spooled)),
+            ]
+
+    async def start_scheduler():
+        app.state.scheduler_task = asyncio.create_task(scheduler.run())
+
+    # Обработчики запускаются по порядку.
+    for name, fn in (
+        ("fleet_load", start_fleet_load),
+        ("replica_sync", start_replica_sync),
+        ("tap_spool", start_tap_spool),
+        ("scheduler", start_scheduler),
+    ):
+        app.add_event_handler("startup", timed_startup(app.state.startup_timings, name, fn))
+
+
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    """Собирает приложение: middleware, маршруты из settings.routes, фоновые задачи и OpenAPI из кэша.
+
+    Без аргументов - настройки из окружения, так что годится и для uvicorn --factory service:create_app.
+    """
+    # pylint: disable=C0415
+    from admission import AdmissionMiddleware, admission
+    from backup import LatencyProbeMiddleware, backup, backup_latency
+    from compression import CompressionMiddleware, compression_options
+    from db import engine, upgrade_schema
+    from negotiation import MsgPackMiddleware, NegotiatedResponse
+
+    settings = settings or Settings.from_env()
+    started = time.perf_counter()
+    app = FastAPI(default_response_class=NegotiatedResponse)
+    timings = app.state.startup_timings = {}
+    app.state.openapi_source = None
+
+    with timed(timings, "middleware"):
+        if settings.cors_origins:
+            app.add_middleware(
+                CORSMiddleware,
+                allow_origins=list(settings.cors_origins),
+                allow_credentials=True,
+                allow_methods=["*"],
+                allow_headers=["*"],
+            )
+        app.add_middleware(SQLAlchemyMiddleware, custom_engine=engine)
+        if settings.admission:
+            app.add_middleware(AdmissionMiddleware, controller=admission)
+        app.add_middleware(MsgPackMiddleware)
+        options = dict(compression_options)
+        if settings.compression_minimum_size is not None:
+            options["minimum_size"] = settings.compression_minimum_size
+        app.add_middleware(CompressionMiddleware, **options)
+        if settings.latency_probe and backup is not None:
+            app.add_middleware(LatencyProbeMiddleware, backup=backup, probe=backup_latency)
+
+    with timed(timings, "routes.import"):
+        init_routes = [getattr(importlib.import_module(module), name) for module, name in settings.routes]
+    with timed(timings, "routes.init"):
+        for init in init_routes:
+            init(app)
+
+    async def upgrade():
+        await upgrade_schema(engine)
+
+    # Первым: uvicorn --factory не вызывает init_models, а фоновые задачи уже читают базу.
+    app.add_event_handler("startup", timed_startup(timings, "schema", upgrade))
+    if settings.background:
+        add_background_tasks(app)
+    app.openapi = cached_openapi(app, settings)
+    timings["create_app"] = time.perf_counter() - started
+    return app
 
 
 async def init_models():
+    # pylint: disable=C0415
+    from backup import backup
+    from db import engine
+    from models.bus import init_bus
+    from models.client_type import init_client_type
+    from models.transaction import init_transaction
+
     try:
         if os.environ.get("REINIT_DB") == "1":
+            if backup is not None and os.path.exists(backup.db_path):
+                # Последний снимок перед тем, как REINIT_DB сотрёт данные.
+                print(f"Backup before reinit: {await backup.run_once()}")
             await init_client_type(engine)
             await init_bus(engine)
             await init_transaction(engine)
@@ -67,6 +273,10 @@ async def init_models():
         print(e)
 
 async def init_base_vars(engine: AsyncEngine):
+    # pylint: disable=C0415
+    from models.bus import Bus
+    from models.client_type import ClientType
+
     try:
         client_types = [
             ["Пенсионеры",30],
@@ -100,9 +310,11 @@ async def init_base_vars(engine: AsyncEngine):
 
 
 def run():
-    init_client_types_routes(app)
-    init_bus_routes(app)
-    init_transactions_routes(app)
-    init_stats_routes(app)
-    app.openapi_schema = custom_openapi()
+    app = create_app()
+
+    @app.on_event("startup")
+    async def report_startup():
+        phases = ", ".join(f"{phase} {seconds * 1000:.1f} ms" for phase, seconds in app.state.startup_timings.items())
+        print(f"Startup: {phases}")
+
     uvicorn.run(app, host=os.environ.get("HOST"), port=int(os.environ.get("PORT")))
@@ -0,0 +1,236 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+from dotenv import load_dotenv
+
+
+dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
+if os.path.exists(dotenv_path):
+    load_dotenv(dotenv_path)
+
+
+class TapSpool:
+    """Журнал проходов на диске: запись подтверждается после fsync, в базу попадает позже.
+
+    Файл - строки JSON с возрастающим seq. Запись идёт в конец файла, fsync
+    делается одним вызовом на всех, кто успел дописать за fsync_interval.
+    Рядом лежит файл .offset с последним перенесённым seq и его позицией:
+    после падения перенос продолжается с неё, а повтор уже вставленных строк
+    отсекается ключом идемпотентности spool:<seq>. Если fsync не удался,
+    неподтверждённые записи обрезаются из файла: клиент получил ошибку, и
+    переносить их в базу нельзя.
+    """
+
+    def __init__(self, path: str, fsync_interval: float = 0.005, batch_size: int = 500, compact_bytes: int = 1 << 20):
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.fsync_interval = fsync_interval
+        self.batch_size = batch_size
+        self.compact_bytes = compact_bytes
+        self.fd: Optional[int] = None
+        self.last_seq = 0
+        self.written_offset = 0
+        self.synced_offset = 0
+        self.drained_seq = 0
+        self.drained_offset = 0
+        self.fsyncs = 0
+        self.synced_records = 0
+        self.drained = 0
+        self.drain_errors = 0
+        self.rejected = 0
+        self.fsync_errors = 0
+        self.last_error = ""
+        self.failed = ""
+        self._syncing = False
+        self._appended_at: deque[tuple[int, float]] = deque()
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._written = asyncio.Event()
+        self._synced = asyncio.Event()
+
+    def open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        if os.path.exists(self.offset_path):
+            with open(self.offset_path, encoding="utf-8") as f:
+                saved = json.load(f)
+            self.drained_seq, self.drained_offset = saved["seq"], saved["offset"]
+        size = os.fstat(self.fd).st_size
+        if self.drained_offset > size:
+            # .offset старше обрезки файла (журнал от версии, писавшей .offset после обрезки): всё до неё перенесено.
+            self.drained_offset = 0
+        self.last_seq = self.drained_seq
+        good_offset = self.drained_offset
+        for end, record in self._scan(self.drained_offset, size):
+            if record["seq"] <= self.drained_seq:
+                # .offset с нулевой позицией записан, а обрезать файл не успели: эти записи уже перенесены.
+                self.drained_offset = good_offset = end
+                continue
+            self.last_seq = record["seq"]
+            good_offset = end
+            self._appended_at.append((record["seq"], time.time()))
+        if good_offset < size:
+            # Хвост, недописанный при падении, ни разу не подтверждался клиенту.
+            os.ftruncate(self.fd, good_offset)
+        self.written_offset = self.synced_offset = good_offset
+
+    def _scan(self, start: int, end: int, max_bytes: Optional[int] = None):
+        data = os.pread(self.fd, min(end - start, max_bytes or end - start), start)
+        position = start
+        for line in data.split(b"\n")[:-1]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                return
+            position += len(line) + 1
+            yield position, record
+
+    async def append(self, record: dict) -> int:
+        """Дописывает проход и ждёт fsync. Возвращает seq записи."""
+        if self.failed:
+            raise OSError(f"Tap spool is unusable: {self.failed}")
+        self.last_seq += 1
+        seq = self.last_seq
+        line = json.dumps({"seq": seq, **record}, ensure_ascii=False, default=str).encode("utf-8") + b"\n"
+        os.write(self.fd, line)
+        self.written_offset += len(line)
+        self._appended_at.append((seq, time.time()))
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((self.written_offset, seq, waiter))
+        self._written.set()
+        await waiter
+        return seq
+
+    async def run_fsync(self):
+        while True:
+            await self._written.wait()
+            self._written.clear()
+            await asyncio.sleep(self.fsync_interval)
+            target = self.written_offset
+            waiters = [w for w in self._waiters if w[0] <= target]
+            self._waiters = [w for w in self._waiters if w[0] > target]
+            self._syncing = True
+            try:
+                await asyncio.to_thread(os.fsync, self.fd)
+            except OSError as e:
+                # Дописанные во время этого fsync тоже не подтверждены и обрезаются вместе с остальными.
+                self.rollback(waiters + self._waiters, e)
+                continue
+            finally:
+                self._syncing = False
+            self.synced_offset = target
+            self.fsyncs += 1
+            self.synced_records += len(waiters)
+            for _, _, waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+            self._synced.set()
+
+    def rollback(self, waiters: list[tuple[int, int, asyncio.Future]], error: OSError):
+        """Обрезает файл до последнего удачного fsync и отвечает ошибкой всем, кто ждал подтверждения."""
+        self.fsync_errors += 1
+        self.last_error = str(error)
+        self._waiters = []
+        for _, _, waiter in waiters:
+            if not waiter.done():
+                waiter.set_exception(error)
+        try:
+            os.ftruncate(self.fd, self.synced_offset)
+        except OSError as e:
+            # Неподтверждённые записи остались в файле и ушли бы в базу: новые проходы не принимаются.
+            self.failed = str(e)
+            return
+        self.written_offset = self.synced_offset
+        if waiters:
+            self.last_seq = min(seq for _, seq, _ in waiters) - 1
+        while self._appended_at and self._appended_at[-1][0] > self.last_seq:
+            self._appended_at.pop()
+
+    def pending(self) -> list[tuple[int, dict]]:
+        """Подтверждённые, но ещё не перенесённые записи с позицией конца каждой."""
+        # Читается не весь хвост, а окно примерно на batch_size строк; обрезанная строка дочитается в следующий раз.
+        window = self.batch_size * 1024
+        batch = list(self._scan(self.drained_offset, self.synced_offset, window))[: self.batch_size]
+        if not batch and self.synced_offset - self.drained_offset > window:
+            batch = list(self._scan(self.drained_offset, self.synced_offset))[:1]
+        return batch
+
+    def mark_drained(self, seq: int, offset: int):
+        self.drained += seq - self.drained_seq
+        self.drained_seq, self.drained_offset = seq, offset
+        while self._appended_at and self._appended_at[0][0] <= seq:
+            self._appended_at.popleft()
+        compact = not self._syncing and offset == self.written_offset and offset >= self.compact_bytes
+        # При сжатии .offset с нулевой позицией и текущим seq пишется до обрезки: после падения
+        # между ними seq не откатится назад и ключи spool:<seq> новых проходов не совпадут со старыми.
+        self.save_offset(seq, 0 if compact else offset)
+        if compact:
+            os.ftruncate(self.fd, 0)
+            self.drained_offset = self.written_offset = self.synced_offset = 0
+
+    def save_offset(self, seq: int, offset: int):
+        tmp_path = self.offset_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"seq": seq, "offset": offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.offset_path)
+
+    async def drain_once(self, apply: Callable[[list[dict]], Awaitable[int]]) -> int:
+        batch = self.pending()
+        if not batch:
+            return 0
+        self.rejected += await apply([record for _, record in batch])
+        self.mark_drained(batch[-1][1]["seq"], batch[-1][0])
+        return len(batch)
+
+    async def run_drainer(self, apply: Callable[[list[dict]], Awaitable[int]], retry_delay: float = 0.5):
+        while True:
+            try:
+                if await self.drain_once(apply):
+                    continue
+            except Exception as e:
+                # База занята или недоступна: записи остаются в журнале до следующей попытки.
+                self.drain_errors += 1
+                self.last_error = str(e)
+                await asyncio.sleep(retry_delay)
+                continue
+            self._synced.clear()
+            try:
+                await asyncio.wait_for(self._synced.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+
+    def lag(self) -> float:
+        """Сколько секунд ждёт самая старая неперенесённая запись."""
+        return time.time() - self._appended_at[0][1] if self._appended_at else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.last_seq - self.drained_seq,
+            "lag_seconds": self.lag(),
+            "last_seq": self.last_seq,
+            "drained_seq": self.drained_seq,
+            "drained": self.drained,
+            "fsyncs": self.fsyncs,
+            "mean_fsync_batch": self.synced_records / self.fsyncs if self.fsyncs else None,
+            "fsync_errors": self.fsync_errors,
+            "failed": self.failed,
+            "drain_errors": self.drain_errors,
+            "rejected": self.rejected,
+            "last_error": self.last_error,
+            "file_bytes": self.written_offset,
+        }
+
+
+tap_spool = (
+    TapSpool(
+        os.environ["TAP_SPOOL"],
+        fsync_interval=float(os.environ.get("SPOOL_FSYNC_INTERVAL", "0.005")),
+        batch_size=int(os.environ.get("SPOOL_BATCH_SIZE", "500")),
+    )
+    if os.environ.get("TAP_SPOOL") else None
+)
@@ -1,37 +1,96 @@
+import asyncio
 import datetime
 import json
 import os
 import random as rnd
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from typing import Optional
+
+import msgpack
+import pytest
 
 from dotenv import load_dotenv
-from fastapi import FastAPI
-from fastapi.security import OAuth2PasswordBearer
 from fastapi.testclient import TestClient
-from fastapi_async_sqlalchemy import SQLAlchemyMiddleware
-
-from routes.bus import init_bus_routes
-from routes.client_type import init_client_types_routes
-from routes.stats import init_stats_routes
-from routes.transaction import init_transactions_routes
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from admission import RouteClass, admission
+from analytics import query
+from analytics.columns import ColumnStore
+from backup import LatencyProbeMiddleware, SnapshotBackup
+from cache import QueryCache
+import db
+from db import DbResult, ReplicaSync, async_session, engine, sqlite_path, upgrade_schema
+from deadline import query_deadlines
+from feed import TransactionFeed, transaction_feed
+from fraud import FraudDetector
+from load import FleetLoad
+from models.bus import Bus
+from models.transaction import EpochMillis, Transaction
+from negotiation import accepts_msgpack
+from scheduler import daily_at, reports_at, scheduler
+from spool import TapSpool
+from routes.report import build_revenue_reports
+from routes.stats import stats_cache
+from routes.transaction import apply_spooled
+from service import Settings, create_app, save_openapi_cache
 
 dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
 if os.path.exists(dotenv_path):
     load_dotenv(dotenv_path)
 
-app = FastAPI()
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
-app.add_middleware(SQLAlchemyMiddleware, db_url=os.environ["DATABASE_URL"])
+app = create_app(Settings(
+    cors_origins=(),
+    admission=False,
+    compression_minimum_size=64,
+    background=False,
+))
+
+
+
+
+async def prepare_schema():
+    await upgrade_schema(engine)
+    await engine.dispose()
 
-init_client_types_routes(app)
-init_bus_routes(app)
-init_transactions_routes(app)
-init_stats_routes(app)
 
+asyncio.run(prepare_schema())
 
 client = TestClient(app)
 auth = ""
 
 
+async def asgi_get(path: str, disconnect: asyncio.Event, messages: Optional[list] = None) -> list:
+    """GET прямо в ASGI-приложение; клиент отключается, когда выставлен disconnect."""
+    messages = [] if messages is None else messages
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(b"host", b"testserver")], "client": ("testclient", 50000), "server": ("testserver", 80),
+    }
+    await app(scope, receive, send)
+    return messages
+
+
 def test_add_bus():
     test_data = {"price": 35}
     post_data = json.dumps(test_data)
@@ -47,6 +106,89 @@ def test_get_all_bus():
     assert response.json()["values"] is not None
 
 
+def test_bulk_bus_updates():
+    response = client.post("/bus/bulk_add", data=json.dumps({"prices": [31, 32, 33]}))
+    assert response.json()["code"] == 200
+    ids = response.json()["value"]
+    assert len(ids) == 3
+    response_2 = client.put("/bus/bulk_set_price", data=json.dumps({"ids": ids + [10**9], "price": 50}))
+    assert response_2.json()["code"] == 200
+    assert sorted(response_2.json()["value"]) == sorted(ids)
+    assert response_2.json()["not_found"] == [10**9]
+    response_3 = client.put("/bus/bulk_set_status", data=json.dumps({"ids": ids, "status": True}))
+    assert sorted(response_3.json()["value"]) == sorted(ids)
+    bus = client.get(f"/bus/get_by_id/{ids[0]}").json()["value"]
+    assert bus["price"] == 50
+    repriced = [{"id": bus_id, "price": 60 + i} for i, bus_id in enumerate(ids)]
+    response_4 = client.put("/bus/bulk_set_price", data=json.dumps({"prices": repriced + [{"id": 10**9, "price": 1}]}))
+    assert sorted(response_4.json()["value"]) == sorted(ids)
+    assert response_4.json()["not_found"] == [10**9]
+    assert [client.get(f"/bus/get_by_id/{bus_id}").json()["value"]["price"] for bus_id in ids] == [60, 61, 62]
+    assert client.put("/bus/bulk_set_price", data=json.dumps({"ids": ids})).status_code == 400
+
+
+def test_get_all_bus_not_modified():
+    response = client.get("/bus/get_all")
+    etag = response.headers["etag"]
+    response_2 = client.get("/bus/get_all", headers={"If-None-Match": etag})
+    assert response_2.status_code == 304
+    client.post("/bus/add", data=json.dumps({"price": 40}))
+    response_3 = client.get("/bus/get_all", headers={"If-None-Match": etag})
+    assert response_3.status_code == 200
+    assert response_3.headers["etag"] != etag
+
+
+def test_get_all_bus_etag_follows_database_and_representation():
+    etag = client.get("/bus/get_all").headers["etag"]
+    # Запись из другого процесса (воркера): счётчик в памяти этого процесса её бы не увидел.
+    conn = sqlite3.connect(sqlite_path(os.environ["DATABASE_URL"]))
+    conn.execute("UPDATE buses SET price = price + 1 WHERE id = 1")
+    conn.commit()
+    conn.close()
+    response = client.get("/bus/get_all", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    bus = client.get("/bus/get_by_id/1").json()["value"]
+    client.put("/bus/bulk_set_status", data=json.dumps({"ids": [1], "status": bus["status"]}))
+    assert client.get("/bus/get_all", headers={"If-None-Match": etag}).status_code == 304
+    as_msgpack = client.get("/bus/get_all", headers={"Accept": "application/msgpack"})
+    identity = client.get("/bus/get_all", headers={"Accept-Encoding": "identity"})
+    assert len({etag, as_msgpack.headers["etag"], identity.headers["etag"]}) == 3
+    assert client.get("/bus/get_all", headers={"If-None-Match": as_msgpack.headers["etag"]}).status_code == 200
+
+
+def test_get_all_bus_error_has_no_etag(monkeypatch):
+    async def failing_get_all(session):
+        return DbResult.error("database is locked")
+
+    monkeypatch.setattr(Bus, "get_all", failing_get_all)
+    response = client.get("/bus/get_all")
+    assert response.status_code == 500
+    assert "etag" not in response.headers
+
+
+def test_reads_go_to_replica_until_primary_requested_or_lagging(tmp_path, monkeypatch):
+    replica_path = str(tmp_path / "replica.sqlite3")
+    source = sqlite3.connect(sqlite_path(os.environ["DATABASE_URL"]))
+    target = sqlite3.connect(replica_path)
+    source.backup(target)
+    source.close()
+    target.execute("UPDATE buses SET price = 777 WHERE id = 1")
+    target.commit()
+    target.close()
+    read_engine = create_async_engine(f"sqlite+aiosqlite:///{replica_path}", poolclass=NullPool)
+    monkeypatch.setattr(db, "async_read_session", sessionmaker(read_engine, class_=AsyncSession, expire_on_commit=False))
+    # REPLICA_SYNC_INTERVAL=0: реплику копирует внешний процесс, возраст - по mtime файла.
+    monkeypatch.setattr(db, "replica", ReplicaSync(sqlite_path(os.environ["DATABASE_URL"]), replica_path, 0))
+
+    assert client.get("/bus/get_by_id/1").json()["value"]["price"] == 777
+    assert client.get("/bus/get_by_id/1", headers={"X-Consistency": "primary"}).json()["value"]["price"] != 777
+    stale = time.time() - db.replica_max_lag - 60
+    os.utime(replica_path, (stale, stale))
+    assert client.get("/bus/get_by_id/1").json()["value"]["price"] != 777
+    assert db.replica.stats()["lag_seconds"] > db.replica_max_lag
+
+
 def test_get_bus_by_id():
     response = client.get("/bus/get_by_id/1")
     print(response.json())
@@ -55,6 +197,14 @@ def test_get_bus_by_id():
 
 
 
+def test_statement_cache_hits_on_point_reads():
+    client.get("/bus/get_by_id/1")
+    hits = client.get("/metrics/statement_cache").json()["value"]["hits"]
+    client.get("/bus/get_by_id/2")
+    client.get("/bus/get_by_id/3")
+    assert client.get("/metrics/statement_cache").json()["value"]["hits"] >= hits + 2
+
+
 def test_get_all_client_types():
     response = client.get("/client_types/get_all")
     print(response.json())
@@ -62,6 +212,13 @@ def test_get_all_client_types():
     assert response.json()["values"] is not None
 
 
+def test_get_all_client_types_not_modified():
+    response = client.get("/client_types/get_all")
+    etag = response.headers["etag"]
+    response_2 = client.get("/client_types/get_all", headers={"If-None-Match": etag})
+    assert response_2.status_code == 304
+
+
 def test_get_client_type_by_id():
     response = client.get("/client_types/get_by_id/1")
     print(response.json())
@@ -101,6 +258,40 @@ def test_transactions_add():
     assert response.json()["value"] is not None
 
 
+def test_transactions_add_idempotent():
+    client.put("/bus/bulk_set_status", data=json.dumps({"ids": [3], "status": True}))
+    key = f"validator-7-{rnd.randint(0, 10**9)}"
+    test_data = {"name": "125XFS", "client_type": 1, "bus_id": 3}
+    response = client.post("/transactions/add", data=json.dumps(test_data), headers={"Idempotency-Key": key})
+    assert response.json()["code"] == 200
+    hits = client.get("/metrics/idempotency").json()["value"]["hits"]
+    response_2 = client.post("/transactions/add", data=json.dumps(test_data), headers={"Idempotency-Key": key})
+    assert response_2.json() == response.json()
+    assert client.get("/metrics/idempotency").json()["value"]["hits"] == hits + 1
+
+
+def test_msgpack_tap_and_response():
+    test_data = {"name": "125XFS", "client_type": 1, "bus_id": 2}
+    response = client.post(
+        "/transactions/add",
+        content=msgpack.packb(test_data),
+        headers={"Content-Type": "application/msgpack", "Accept": "application/msgpack"},
+    )
+    assert response.headers["content-type"] == "application/msgpack"
+    body = msgpack.unpackb(response.content)
+    assert body["code"] in (200, 502)
+    response_2 = client.get("/client_types/get_all", headers={"Accept": "application/msgpack"})
+    assert msgpack.unpackb(response_2.content)["values"] == client.get("/client_types/get_all").json()["values"]
+
+
+def test_accepts_msgpack_compares_quality_with_json():
+    assert accepts_msgpack("application/msgpack")
+    assert accepts_msgpack("application/json;q=0.5, application/x-msgpack")
+    assert not accepts_msgpack("application/json;q=1, application/msgpack;q=0.1")
+    assert not accepts_msgpack("*/*, application/msgpack;q=0.5")
+    assert not accepts_msgpack("application/msgpack;q=0")
+
+
 def test_transaction_get_by_id():
     response = client.get(
         "/transactions/get_by_id/1"
@@ -109,6 +300,40 @@ def test_transaction_get_by_id():
     assert response.json()["value"] is not None
 
 
+def test_transactions_by_client_type_pages():
+    for _ in range(3):
+        client.put("/bus/bulk_set_status", data=json.dumps({"ids": [1], "status": True}))
+        client.post("/transactions/add", data=json.dumps({"name": "125XFS", "client_type": 3, "bus_id": 1}))
+    count = client.get("/transactions/get_by_client_type/3", params={"count_only": True}).json()
+    assert count["code"] == 200 and count["count"] >= 3
+    page = client.get("/transactions/get_by_client_type/3", params={"limit": 2}).json()
+    assert len(page["values"]) == 2
+    assert page["values"][0]["date"] >= page["values"][1]["date"]
+    rest = client.get("/transactions/get_by_client_type/3", params={"limit": 1000, "cursor": page["next_cursor"]}).json()
+    ids = [row["id"] for row in page["values"] + rest["values"]]
+    assert len(ids) == len(set(ids)) == count["count"]
+    by_bus = client.get("/transactions/get_by_bus/1", params={"count_only": True}).json()
+    assert by_bus["count"] >= 3
+    assert client.get("/transactions/get_by_bus/1", params={"limit": 0}).status_code == 422
+
+
+def test_rider_history_and_totals():
+    name = f"rider-{rnd.randint(0, 10**9)}"
+    for bus_id in (1, 2):
+        client.put("/bus/bulk_set_status", data=json.dumps({"ids": [bus_id], "status": True}))
+        client.post("/transactions/add", data=json.dumps({"name": name, "client_type": 3, "bus_id": bus_id}))
+    page = client.get("/transactions/get_by_rider", params={"name": name, "limit": 1}).json()
+    assert [row["bus_id"] for row in page["values"]] == [2]
+    older = client.get("/transactions/get_by_rider", params={"name": name, "cursor": page["next_cursor"]}).json()
+    assert [row["bus_id"] for row in older["values"]] == [1]
+    totals = client.get("/transactions/rider_totals", params={"name": name}).json()["value"]
+    assert totals["trips"] == 2
+    assert client.get("/transactions/rider_totals", params={"name": name}).json()["value"] == totals
+    client.put("/bus/bulk_set_status", data=json.dumps({"ids": [3], "status": True}))
+    client.post("/transactions/add", data=json.dumps({"name": name, "client_type": 3, "bus_id": 3}))
+    assert client.get("/transactions/rider_totals", params={"name": name}).json()["value"]["trips"] == 3
+
+
 def test_get_all_transactions():
     response = client.get(
         "/transactions/get_all"
@@ -117,6 +342,26 @@ def test_get_all_transactions():
     assert response.json()["values"] is not None
 
 
+def test_get_all_interrupted_by_deadline(monkeypatch):
+    monkeypatch.setattr(query_deadlines, "routes", [("/transactions/get_all", 0.0)])
+    monkeypatch.setattr(query_deadlines, "steps", 1)
+    interrupted = query_deadlines.stats()["interrupted"]["deadline"]
+    response = client.get("/transactions/get_all")
+    assert response.status_code == 504
+    assert "deadline" in response.json()["error_desc"]
+    assert query_deadlines.stats()["interrupted"]["deadline"] == interrupted + 1
+    monkeypatch.setattr(query_deadlines, "routes", [])
+    # Прерванное соединение вернулось в пул рабочим.
+    assert client.get("/transactions/get_all").json()["code"] == 200
+
+
+def test_export_transactions_compressed():
+    response = client.get("/transactions/export", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json()["code"] == 200
+    assert response.json()["values"] == client.get("/transactions/get_all").json()["values"]
+
+
 def test_get_median_price():
     response = client.get(
         "/stats/get_median_price/1"
@@ -137,3 +382,588 @@ def test_get_all_price():
     assert response.json()["value"] is not None
 
 
+def test_revenue_reports_recompute(monkeypatch):
+    # Тестовое приложение без фоновых задач: задачу регистрируем сами, чтобы проверить учёт ручного запуска.
+    monkeypatch.setattr(scheduler, "jobs", {})
+    scheduler.add("revenue_reports", daily_at(reports_at), build_revenue_reports)
+    client.put("/bus/bulk_set_status", data=json.dumps({"ids": [4], "status": True}))
+    client.post("/transactions/add", data=json.dumps({"name": "125XFS", "client_type": 2, "bus_id": 4}))
+    today = datetime.date.today().isoformat()
+    response = client.post("/reports/recompute", data=json.dumps({"period": "day", "date": today}))
+    assert response.json()["code"] == 200
+    assert response.json()["value"] >= 1
+    rows = client.get("/reports/by_client_type", params={"date_from": today}).json()["values"]
+    students = [row for row in rows if row["client_type"] == 2]
+    assert students and students[0]["client_name"] == "Студенты" and students[0]["rides"] >= 1
+    by_bus = client.get("/reports/by_bus", params={"date_from": today}).json()["values"]
+    assert sum(row["revenue"] for row in by_bus) == pytest.approx(sum(row["revenue"] for row in rows))
+    assert client.get("/metrics/jobs").json()["value"]["revenue_reports"]["runs"] >= 1
+
+
+def test_create_app_reuses_cached_openapi(tmp_path):
+    settings = Settings(background=False, openapi_cache=str(tmp_path / "openapi.json"))
+    first = create_app(settings)
+    schema = first.openapi()
+    assert first.state.openapi_source == "generated"
+    assert "/transactions/add" in schema["paths"]
+    second = create_app(settings)
+    assert second.openapi() == schema
+    assert second.state.openapi_source == "cache"
+    timings = TestClient(second).get("/metrics/startup").json()["value"]
+    assert timings["openapi"] == "cache"
+    assert {"middleware", "routes.import", "routes.init", "create_app", "openapi"} <= set(timings["timings_ms"])
+    assert os.listdir(tmp_path) == ["openapi.json"]
+
+
+def test_openapi_cache_concurrent_writers(tmp_path):
+    path = str(tmp_path / "openapi.json")
+    threads = [
+        threading.Thread(target=save_openapi_cache, args=(path, {"key": str(i), "schema": {"paths": list(range(5000))}}))
+        for i in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with open(path, encoding="utf-8") as f:
+        assert len(json.load(f)["schema"]["paths"]) == 5000
+    assert os.listdir(tmp_path) == ["openapi.json"]
+
+
+def test_background_jobs_registered_only_with_background(monkeypatch):
+    monkeypatch.setattr(scheduler, "jobs", {})
+    create_app(Settings(background=False))
+    assert "revenue_reports" not in scheduler.jobs
+    create_app(Settings())
+    assert "revenue_reports" in scheduler.jobs
+
+
+def test_latency_probe_follows_settings(tmp_path, monkeypatch):
+    monkeypatch.setattr("backup.backup", SnapshotBackup(str(tmp_path / "live.sqlite3"), str(tmp_path / "backups")))
+
+    def middleware(settings: Settings) -> list:
+        return [m.cls for m in create_app(settings).user_middleware]
+
+    assert LatencyProbeMiddleware in middleware(Settings(background=False))
+    assert LatencyProbeMiddleware not in middleware(Settings(background=False, latency_probe=False))
+
+
+def test_service_import_defers_subsystems():
+    # Отдельный процесс: в этом все модули уже импортированы.
+    code = "import sys, service; print(sorted({'db', 'backup', 'spool', 'scheduler', 'admission', 'models.bus'} & set(sys.modules)))"
+    output = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(__file__) or ".", capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == "[]"
+
+
+def test_create_app_upgrades_schema_on_startup():
+    # Как при uvicorn --factory service:create_app: init_models не вызывается.
+    with TestClient(create_app(Settings(background=False))) as started:
+        timings = started.get("/metrics/startup").json()["value"]["timings_ms"]
+    assert "startup.schema" in timings
+
+
+def test_stats_cache_coalesces_identical_queries():
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return DbResult.result(42.0)
+
+    async def burst():
+        cache = QueryCache(maxsize=8, ttl=60)
+        results = await asyncio.gather(*[cache.get_or_load(("k",), load) for _ in range(10)])
+        cached = await cache.get_or_load(("k",), load)
+        return results, cached
+
+    results, cached = asyncio.run(burst())
+    assert len(calls) == 1
+    assert all(r.value == 42.0 for r in results)
+    assert cached.value == 42.0
+
+
+def test_query_cache_drops_load_invalidated_in_flight():
+    totals = iter([1, 2])
+    release = None
+
+    async def load():
+        value = next(totals)
+        if value == 1:
+            await release.wait()
+        return DbResult.result(value)
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        cache = QueryCache(maxsize=8, ttl=3600)
+        stale = asyncio.ensure_future(cache.get_or_load("rider", load))
+        await asyncio.sleep(0)
+        # Проход записан, пока первая загрузка ещё читала старые итоги.
+        cache.invalidate("rider")
+        fresh = await cache.get_or_load("rider", load)
+        release.set()
+        return (await stale).value, fresh.value, cache.cache.get("rider"), cache.stats()["discarded"]
+
+    stale, fresh, cached, discarded = asyncio.run(scenario())
+    assert (stale, fresh) == (1, 2)
+    assert cached == (True, 2)
+    assert discarded == 1
+
+
+def test_admission_sheds_and_prioritizes_taps():
+    async def scenario():
+        taps = RouteClass("taps", limit=1, queue_size=1, deadline=1)
+        stats = RouteClass("stats", limit=1, queue_size=1, deadline=0.05, yield_to=taps)
+        assert await taps.acquire()
+        tap_waiter = asyncio.ensure_future(taps.acquire())
+        await asyncio.sleep(0)
+        # Пока проход ждёт в очереди, аналитика не получает свободный слот.
+        assert await stats.acquire() is False
+        assert await taps.acquire() is False
+        taps.release()
+        assert await tap_waiter
+        assert await stats.acquire()
+        return taps.stats(), stats.stats()
+
+    taps_stats, stats_stats = asyncio.run(scenario())
+    assert taps_stats["admitted"] == 2
+    assert taps_stats["shed"] == 1
+    assert stats_stats["shed"] == 1
+    assert stats_stats["admitted"] == 1
+
+
+def test_admission_counts_bus_writes_apart_from_reads():
+    with_admission = TestClient(create_app(Settings(cors_origins=(), background=False)))
+    before = admission.stats()
+    response = with_admission.post("/bus/bulk_add", data=json.dumps({"prices": [31, 32]}))
+    assert response.json()["code"] == 200
+    with_admission.get("/bus/get_all")
+    after = admission.stats()
+    assert after["admin_writes"]["admitted"] == before["admin_writes"]["admitted"] + 1
+    assert after["reads"]["admitted"] == before["reads"]["admitted"] + 1
+    assert admission.classify("/stats/get_all_price", "POST").name == "stats"
+
+
+def test_get_admission_metrics():
+    response = client.get("/metrics/admission")
+    assert response.json()["code"] == 200
+    assert "taps" in response.json()["value"]
+
+
+def test_stream_unsubscribes_on_disconnect():
+    async def scenario():
+        subscribers = transaction_feed.stats()["subscribers"]
+        gone = asyncio.Event()
+        messages = []
+        stream = asyncio.create_task(asgi_get("/transactions/stream", gone, messages))
+        while transaction_feed.stats()["subscribers"] == subscribers:
+            await asyncio.sleep(0.01)
+        transaction_feed.publish("bus_status", {"bus_id": 1, "status": True})
+        while not any(b"event: bus_status" in m.get("body", b"") for m in messages):
+            await asyncio.sleep(0.01)
+        gone.set()
+        # Лента молчит: отписка не должна ждать keepalive через 15 секунд.
+        await asyncio.wait_for(stream, 2)
+        after_stream = transaction_feed.stats()["subscribers"]
+        # Клиент ушёл ещё до начала отправки: генератор событий может так и не запуститься.
+        gone_early = asyncio.Event()
+        gone_early.set()
+        await asyncio.wait_for(asgi_get("/transactions/stream", gone_early), 2)
+        return subscribers, after_stream, transaction_feed.stats()["subscribers"]
+
+    before, after_stream, after_early = asyncio.run(scenario())
+    assert after_stream == before and after_early == before
+
+
+def test_feed_drops_oldest_for_slow_subscriber():
+    async def scenario():
+        feed = TransactionFeed(buffer_size=3)
+        subscriber = feed.subscribe(bus_id=1)
+        for i in range(5):
+            feed.publish("transaction", {"id": i, "bus_id": 1, "client_type": 1})
+        feed.publish("transaction", {"id": 99, "bus_id": 2, "client_type": 1})
+        return await subscriber.wait(timeout=1), subscriber.dropped
+
+    batch, dropped = asyncio.run(scenario())
+    assert [payload["id"] for _, payload in batch] == [2, 3, 4]
+    assert dropped == 2
+
+
+def test_fraud_detector_flags_bus_change_and_concession_overuse():
+    detector = FraudDetector(
+        window=3600, min_transfer=300, max_concessions=2, concession_types={2}, max_riders=2, max_taps=8, max_alerts=10
+    )
+    start = datetime.datetime(2024, 3, 17, 8, 0)
+    assert detector.observe("card-1", 1, 2, start) == []
+    assert detector.observe("card-1", 1, 2, start + datetime.timedelta(minutes=30)) == []
+    alerts = detector.observe("card-1", 2, 2, start + datetime.timedelta(minutes=32))
+    assert [alert["kind"] for alert in alerts] == ["bus_change", "concession_overuse"]
+    assert alerts[0]["previous_bus_id"] == 1
+    assert detector.observe("card-1", 2, 2, start + datetime.timedelta(hours=3)) == []
+    detector.observe("card-2", 1, 3, start)
+    detector.observe("card-3", 1, 3, start)
+    assert list(detector.riders) == ["card-2", "card-3"]
+    assert [alert["id"] for alert in detector.recent(since=1)] == [2]
+
+
+def test_fleet_load_windows_and_ring_wrap():
+    now = datetime.datetime(2024, 3, 8, 9, 0, 30)
+    load = FleetLoad(slots=60, windows=(5, 15, 60))
+    load.rebuild([
+        (1, 30.0, now - datetime.timedelta(minutes=2)),
+        (1, 21.0, now - datetime.timedelta(minutes=10)),
+        (2, 30.0, now - datetime.timedelta(minutes=59)),
+        (2, 30.0, now - datetime.timedelta(minutes=61)),
+    ], now)
+    load.record(1, 30.0, now, now)
+    fleet = {row["bus_id"]: row["windows"] for row in load.fleet(now)}
+    assert fleet[1] == [
+        {"minutes": 5, "taps": 2, "revenue": 60.0},
+        {"minutes": 15, "taps": 3, "revenue": 81.0},
+        {"minutes": 60, "taps": 3, "revenue": 81.0},
+    ]
+    assert [w["taps"] for w in fleet[2]] == [0, 0, 1]
+    assert load.stats()["stale"] == 1
+    # Через час ячейки прошлого круга не попадают в окна, а новая запись их переиспользует.
+    later = now + datetime.timedelta(minutes=60)
+    load.record(1, 30.0, later, later)
+    assert [w["taps"] for w in load.fleet(later)[0]["windows"]] == [1, 1, 1]
+
+
+def test_fleet_load_endpoint_counts_tap():
+    client.put("/bus/bulk_set_status", data=json.dumps({"ids": [4], "status": True}))
+    before = {row["bus_id"]: row["windows"][0]["taps"] for row in client.get("/load/fleet").json()["values"]}
+    assert client.post("/transactions/add", json={"name": "load-check", "client_type": 3, "bus_id": 4}).json()["code"] == 200
+    after = {row["bus_id"]: row["windows"][0]["taps"] for row in client.get("/load/fleet").json()["values"]}
+    assert after[4] == before.get(4, 0) + 1
+
+
+def test_tap_spool_drains_once_across_restarts(tmp_path):
+    name = f"spooled-{rnd.randint(0, 10**9)}"
+    path = str(tmp_path / "taps.log")
+
+    async def scenario():
+        spool = TapSpool(path, fsync_interval=0)
+        spool.open()
+        fsync = asyncio.ensure_future(spool.run_fsync())
+        tap = {"name": name, "client_type": 3, "bus_id": 1, "date": datetime.datetime.now().isoformat()}
+        seqs = [await spool.append(tap), await spool.append({**tap, "idempotency_key": "k-" + name})]
+        drained = await spool.drain_once(apply_spooled)
+        fsync.cancel()
+        # Падение до записи .offset: после перезапуска та же пачка переносится повторно.
+        os.remove(path + ".offset")
+        restarted = TapSpool(path)
+        restarted.open()
+        redrained = await restarted.drain_once(apply_spooled)
+        async with async_session() as session:
+            count = (await Transaction.count_by_rider(session, name)).value
+        await engine.dispose()
+        return seqs, drained, redrained, count, restarted.stats()
+
+    seqs, drained, redrained, count, stats = asyncio.run(scenario())
+    assert seqs == [1, 2]
+    assert drained == redrained == 2
+    assert count == 2
+    assert stats["depth"] == 0
+
+
+def test_tap_spool_drops_records_of_failed_fsync(tmp_path, monkeypatch):
+    path = str(tmp_path / "taps.log")
+    tap = {"name": "spool-fsync", "client_type": 3, "bus_id": 1, "date": datetime.datetime.now().isoformat()}
+    real_fsync = os.fsync
+    failures = []
+
+    def flaky_fsync(fd):
+        if failures:
+            failures.pop()
+            raise OSError(5, "Input/output error")
+        real_fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", flaky_fsync)
+
+    async def scenario():
+        spool = TapSpool(path, fsync_interval=0)
+        spool.open()
+        fsync = asyncio.ensure_future(spool.run_fsync())
+        await spool.append({**tap, "idempotency_key": "synced"})
+        failures.append(1)
+        failed = await asyncio.gather(
+            spool.append({**tap, "idempotency_key": "lost-1"}),
+            spool.append({**tap, "idempotency_key": "lost-2"}),
+            return_exceptions=True,
+        )
+        after = await spool.append({**tap, "idempotency_key": "after"})
+        fsync.cancel()
+        pending = [record["idempotency_key"] for _, record in spool.pending()]
+        restarted = TapSpool(path)
+        restarted.open()
+        reopened = [record["idempotency_key"] for _, record in restarted.pending()]
+        return failed, after, pending, reopened, spool.stats()
+
+    failed, after, pending, reopened, stats = asyncio.run(scenario())
+    assert all(isinstance(e, OSError) for e in failed)
+    assert after == 2
+    assert pending == reopened == ["synced", "after"]
+    assert stats["fsync_errors"] == 1 and not stats["failed"]
+
+    def no_truncate(fd, length):
+        raise OSError(5, "Input/output error")
+
+    # Обрезать не вышло: журнал больше не принимает проходы, иначе неподтверждённые ушли бы в базу.
+    monkeypatch.setattr(os, "ftruncate", no_truncate)
+
+    async def broken():
+        spool = TapSpool(str(tmp_path / "broken.log"), fsync_interval=0)
+        spool.open()
+        fsync = asyncio.ensure_future(spool.run_fsync())
+        failures.append(1)
+        with pytest.raises(OSError):
+            await spool.append(tap)
+        with pytest.raises(OSError, match="unusable"):
+            await spool.append(tap)
+        fsync.cancel()
+        return spool.stats()
+
+    assert asyncio.run(broken())["failed"]
+
+
+def test_snapshot_backup_checks_and_rotates(tmp_path):
+    source = str(tmp_path / "live.sqlite3")
+    conn = sqlite3.connect(source)
+    conn.execute("CREATE TABLE taps (id INTEGER PRIMARY KEY, name TEXT)")
+    conn.executemany("INSERT INTO taps (name) VALUES (?)", [(f"rider-{i}",) for i in range(5000)])
+    conn.commit()
+    backup = SnapshotBackup(source, str(tmp_path / "backups"), pages=8, step_sleep=0, keep=1)
+    first = asyncio.run(backup.run_once())
+    conn.execute("INSERT INTO taps (name) VALUES ('after-first')")
+    conn.commit()
+    conn.close()
+    second = asyncio.run(backup.run_once())
+    assert backup.snapshots() == [second] and not os.path.exists(first)
+    assert backup.last_steps > 1
+    snapshot = sqlite3.connect(second)
+    assert snapshot.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    assert snapshot.execute("SELECT count(*) FROM taps").fetchone()[0] == 5001
+    snapshot.close()
+
+
+def test_app_database_runs_in_wal_mode(tmp_path):
+    async def journal_mode():
+        async with engine.connect() as conn:
+            mode = (await conn.execute(text("PRAGMA journal_mode"))).scalar()
+        await engine.dispose()
+        return mode
+
+    assert asyncio.run(journal_mode()) == "wal"
+    backup = SnapshotBackup(sqlite_path(os.environ["DATABASE_URL"]), str(tmp_path), pages=4, step_sleep=0)
+    asyncio.run(backup.run_once())
+    assert backup.last_mode == "wal_snapshot" and backup.fallbacks == 0
+
+
+@pytest.mark.parametrize("journal_mode", ["wal", "delete"])
+def test_snapshot_backup_under_concurrent_writes(tmp_path, journal_mode):
+    source = str(tmp_path / "live.sqlite3")
+    conn = sqlite3.connect(source)
+    conn.execute(f"PRAGMA journal_mode={journal_mode}")
+    conn.execute("CREATE TABLE taps (id INTEGER PRIMARY KEY, name TEXT)")
+    conn.executemany("INSERT INTO taps (name) VALUES (?)", [(f"rider-{i}",) for i in range(20000)])
+    conn.commit()
+    conn.close()
+    backup = SnapshotBackup(source, str(tmp_path / "backups"), pages=4, step_sleep=0.005, keep=1, max_restarts=0)
+    stop = threading.Event()
+    written = []
+
+    def writer():
+        writes = sqlite3.connect(source, timeout=10)
+        while not stop.is_set():
+            writes.execute("INSERT INTO taps (name) VALUES ('during-backup')")
+            writes.commit()
+            written.append(1)
+            time.sleep(0.001)
+        writes.close()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        while not written:
+            time.sleep(0.001)
+        path = asyncio.run(backup.run_once())
+    finally:
+        stop.set()
+        thread.join()
+    if journal_mode == "wal":
+        assert backup.last_mode == "wal_snapshot" and backup.last_restarts == 0 and backup.fallbacks == 0
+    else:
+        assert backup.last_mode == "single_step" and backup.fallbacks == 1
+    assert backup.stats()["restarts"] == backup.restarts
+    snapshot = sqlite3.connect(path)
+    assert snapshot.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    assert snapshot.execute("SELECT count(*) FROM taps").fetchone()[0] >= 20000
+    snapshot.close()
+
+
+def slow_stats(monkeypatch) -> tuple[list, AsyncEngine]:
+    """/stats/ под дедлайном на отдельном движке; get_by_bus - долгий запрос, вызовы и исходы пишутся в список."""
+    primary = create_async_engine(os.environ["DATABASE_URL"], poolclass=NullPool)
+    query_deadlines.attach(primary)
+    monkeypatch.setattr(db, "async_session", sessionmaker(primary, class_=AsyncSession, expire_on_commit=False))
+    monkeypatch.setattr(db, "async_read_session", None)
+    monkeypatch.setattr(query_deadlines, "routes", [("/stats/", 30.0)])
+    monkeypatch.setattr(query_deadlines, "steps", 100)
+    loads = []
+
+    async def slow_get_by_bus(session, bus_id, *args):
+        loads.append("started")
+        try:
+            await session.execute(text(
+                "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 2000000) SELECT count(*) FROM c"
+            ))
+        except Exception as e:
+            loads.append("interrupted")
+            return DbResult.error(str(e))
+        loads.append("finished")
+        return DbResult.result([])
+
+    monkeypatch.setattr(Transaction, "get_by_bus", slow_get_by_bus)
+    return loads, primary
+
+
+async def stats_call(path: str, disconnect: asyncio.Event) -> tuple[int, dict]:
+    messages = await asgi_get(path, disconnect)
+    body = b"".join(m.get("body", b"") for m in messages if m["type"] == "http.response.body")
+    return messages[0]["status"], json.loads(body) if body else None
+
+
+def test_concurrent_stats_requests_share_one_load(monkeypatch):
+    loads, primary = slow_stats(monkeypatch)
+    path = f"/stats/get_median_price/{rnd.randint(10**6, 10**7)}"
+
+    async def scenario():
+        stays = asyncio.Event()
+        try:
+            return await asyncio.gather(*[stats_call(path, stays) for _ in range(5)])
+        finally:
+            stays.set()
+
+    before = stats_cache.flight.stats()
+    results = asyncio.run(scenario())
+    asyncio.run(primary.dispose())
+    after = stats_cache.flight.stats()
+    assert [status for status, _ in results] == [200] * 5
+    assert loads == ["started", "finished"]
+    assert after["executions"] == before["executions"] + 1
+    assert after["coalesced"] == before["coalesced"] + 4
+
+
+def test_stats_caller_disconnect_does_not_fail_other_callers(monkeypatch):
+    loads, primary = slow_stats(monkeypatch)
+    path = f"/stats/get_median_price/{rnd.randint(10**6, 10**7)}"
+
+    async def scenario():
+        gone, stays = asyncio.Event(), asyncio.Event()
+        first = asyncio.create_task(stats_call(path, gone))
+        await asyncio.sleep(0.02)
+        second = asyncio.create_task(stats_call(path, stays))
+        await asyncio.sleep(0.1)
+        gone.set()
+        try:
+            return await first, await second
+        finally:
+            stays.set()
+
+    interrupted = query_deadlines.stats()["interrupted"]["disconnect"]
+    (first_status, _), (second_status, second) = asyncio.run(scenario())
+    asyncio.run(primary.dispose())
+    assert first_status == 504
+    assert query_deadlines.stats()["interrupted"]["disconnect"] == interrupted + 1
+    # Отключение первого не прервало общую загрузку: второй получил её результат.
+    assert second_status == 200 and second["value"] == 0.0
+    assert loads == ["started", "finished"]
+
+
+def test_stats_load_abandoned_by_all_callers_is_interrupted(monkeypatch):
+    loads, primary = slow_stats(monkeypatch)
+    path = f"/stats/get_median_price/{rnd.randint(10**6, 10**7)}"
+
+    async def scenario():
+        gone = asyncio.Event()
+        first = asyncio.create_task(stats_call(path, gone))
+        await asyncio.sleep(0.1)
+        gone.set()
+        status, _ = await first
+        for _ in range(100):
+            if len(loads) > 1:
+                break
+            await asyncio.sleep(0.05)
+        stays = asyncio.Event()
+        try:
+            return status, await stats_call(path, stays)
+        finally:
+            stays.set()
+
+    abandoned = stats_cache.flight.stats()["abandoned"]
+    status, (again, _) = asyncio.run(scenario())
+    asyncio.run(primary.dispose())
+    assert status == 504 and again == 200
+    assert stats_cache.flight.stats()["abandoned"] == abandoned + 1
+    # Брошенная загрузка прервана, следующий вызов начал новую, а не получил её ошибку.
+    assert loads == ["started", "interrupted", "started", "finished"]
+
+
+def test_tap_spool_crash_during_compaction_keeps_seq(tmp_path, monkeypatch):
+    name = f"compacted-{rnd.randint(0, 10**9)}"
+    path = str(tmp_path / "taps.log")
+    tap = {"name": name, "client_type": 3, "bus_id": 1, "date": datetime.datetime.now().isoformat()}
+
+    def crash(fd, length):
+        raise KeyboardInterrupt("crash before truncate")
+
+    async def scenario():
+        spool = TapSpool(path, fsync_interval=0, compact_bytes=1)
+        spool.open()
+        fsync = asyncio.ensure_future(spool.run_fsync())
+        await spool.append({**tap, "idempotency_key": name + "-1"})
+        await spool.append({**tap, "idempotency_key": name + "-2"})
+        with monkeypatch.context() as patch:
+            patch.setattr(os, "ftruncate", crash)
+            with pytest.raises(KeyboardInterrupt):
+                await spool.drain_once(apply_spooled)
+        fsync.cancel()
+        restarted = TapSpool(path, fsync_interval=0, compact_bytes=1)
+        restarted.open()
+        assert restarted.pending() == []
+        fsync = asyncio.ensure_future(restarted.run_fsync())
+        seq = await restarted.append({**tap, "idempotency_key": name + "-3"})
+        drained = await restarted.drain_once(apply_spooled)
+        fsync.cancel()
+        async with async_session() as session:
+            count = (await Transaction.count_by_rider(session, name)).value
+        await engine.dispose()
+        return seq, drained, restarted.rejected, count
+
+    seq, drained, rejected, count = asyncio.run(scenario())
+    assert seq == 3
+    assert drained == 1 and rejected == 0
+    assert count == 3
+
+
+def test_column_store_group_by(tmp_path):
+    store = ColumnStore(str(tmp_path))
+    store.append(1, 1, 1, 30.0, datetime.datetime(2024, 3, 8, 7, 15))
+    store.append(2, 1, 2, 20.0, datetime.datetime(2024, 3, 8, 7, 45))
+    store.append(3, 2, 1, 30.0, datetime.datetime(2024, 3, 8, 18, 5))
+    store.close()
+    cols = query.load(store)
+    assert query.total(cols, bus_id=1) == 50.0
+    assert query.count(cols, date_from=datetime.datetime(2024, 3, 8, 7, 30)) == 2
+    rows = query.group_by(cols, ("client_type", "hour"))
+    assert {"client_type": 1, "hour": 7, "rides": 1, "revenue": 30.0} in rows
+    assert {"client_type": 1, "hour": 18, "rides": 1, "revenue": 30.0} in rows
+
+
+def test_epoch_millis_round_trip():
+    date = datetime.datetime(2024, 3, 8, 7, 15, 30, 123000)
+    column_type = EpochMillis()
+    stored = column_type.process_bind_param(date, None)
+    assert isinstance(stored, int)
+    assert column_type.process_result_value(stored, None) == date